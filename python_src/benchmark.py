@@ -0,0 +1,253 @@
+"""
+Benchmark suite for per-step latency and batch throughput
+
+Measures p50/p99/p999 latency and frames per second for the single-lane
+estimator steps, the legacy set_data + estimate_lane_line_param path and
+KalmanFilterBank with 1 to 10k lanes in float64 and float32. Results are written as JSON; with
+--baseline the run fails when any workload regresses past the tolerance.
+
+Usage:
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+from estimate_lane_param import EstimateLaneParam
+from kalman_filter import KalmanFilterBank
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, build_motion_matrices
+
+
+LANE_COUNTS = (1, 10, 100, 1000, 10000)
+
+
+def initial_state():
+    """
+    Initial state and covariance used by main.py
+    """
+    return np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001
+
+
+def measurement(i):
+    """
+    Measurement sequence used by main.py
+    """
+    return np.array([1.95 + 0.3 * (i % 10), 0.13 + 0.01 * (i % 10), 0.006 + 0.001 * (i % 10), 0.000001])
+
+
+def single_lane_workloads():
+    """
+    Step functions for the single-lane estimator paths
+    """
+    measurements = [measurement(i) for i in range(10)]
+
+    def predict():
+        estimator = EstimateLaneParam()
+        estimator.set_motion_data(3.6, 0.5, 0.0)
+        matrix_X, matrix_P = initial_state()
+
+        def step(i):
+            estimator.predict(matrix_P, matrix_X)
+            if i % 10 == 9:
+                matrix_X[:], matrix_P[:] = initial_state()
+        return step
+
+    def update():
+        estimator = EstimateLaneParam()
+        estimator.set_motion_data(3.6, 0.5, 0.0)
+        matrix_X, matrix_P = initial_state()
+        estimator.predict(matrix_P, matrix_X)
+
+        def step(i):
+            estimator.update(matrix_P, matrix_X, measurements[i % 10])
+        return step
+
+    def predict_and_update(engine="numpy"):
+        estimator = EstimateLaneParam(engine=engine)
+        estimator.set_motion_data(3.6, 0.5, 0.0)
+        matrix_X, matrix_P = initial_state()
+
+        def step(i):
+            estimator.predict_and_update(matrix_P, matrix_X, measurements[i % 10])
+        return step
+
+    def legacy():
+        matrix_X, matrix_P = initial_state()
+
+        def step(i):
+            estimator = EstimateLaneParam()
+            estimator.set_data(matrix_X, 3.6, 0.5, 0.0, measurements[i % 10])
+            estimator.estimate_lane_line_param(matrix_P, matrix_X)
+        return step
+
+    return {
+        "single.predict": predict,
+        "single.update": update,
+        "single.predict_and_update": predict_and_update,
+        "single.predict_and_update.scalar": lambda: predict_and_update("scalar"),
+        "legacy.set_data+estimate_lane_line_param": legacy,
+    }
+
+
+def bank_workload(lanes, seed=0, dtype=np.float64):
+    """
+    Step function running predict+update for a bank of lanes
+
+    Each lane has its own speed; about 10% of lanes miss their measurement.
+    """
+    def setup():
+        rng = np.random.default_rng(seed)
+        models = [build_motion_matrices(speed, 0.5) for speed in np.round(rng.uniform(5.0, 30.0, lanes), 1)]
+        x, P = initial_state()
+        bank = KalmanFilterBank(
+            np.stack([A for A, _ in models]), np.stack([B for _, B in models]),
+            MATRIX_H, np.tile(P, (lanes, 1, 1)), MATRIX_Q, MATRIX_R,
+            np.tile(x, (lanes, 1)), rng.normal(0.0, 0.05, (lanes, 1)), dtype=dtype)
+        Z = np.tile(x, (lanes, 1)) + rng.normal(0.0, [0.1, 0.01, 0.001, 0.0001], (lanes, 4))
+        masks = rng.random((16, lanes)) > 0.1
+
+        def step(i):
+            bank.predict()
+            bank.update(Z, masks[i % 16])
+        return step
+    return setup
+
+
+def run_workload(setup, iterations, warmup):
+    """
+    Time one workload
+
+    Args:
+        setup: callable returning step(i)
+        iterations: number of timed steps
+        warmup: number of untimed steps run first
+
+    Returns:
+        dict with latency percentiles (ns) and frames per second
+    """
+    step = setup()
+    for i in range(warmup):
+        step(i)
+
+    latencies = np.empty(iterations, dtype=np.int64)
+    clock = time.perf_counter_ns
+    start = clock()
+    for i in range(iterations):
+        t0 = clock()
+        step(i)
+        latencies[i] = clock() - t0
+    total = clock() - start
+
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+    return {
+        "iterations": iterations,
+        "p50_ns": float(p50),
+        "p99_ns": float(p99),
+        "p999_ns": float(p999),
+        "mean_ns": float(latencies.mean()),
+        "fps": iterations * 1e9 / total,
+    }
+
+
+def run_suite(iterations=2000, warmup=200, lane_counts=LANE_COUNTS, workloads=None):
+    """
+    Run all benchmarks
+
+    Args:
+        iterations: timed steps per single-lane workload; bank workloads
+                    scale this down with the lane count
+        warmup: untimed steps per workload
+        lane_counts: bank sizes to benchmark
+        workloads: optional substring filter on workload names
+
+    Returns:
+        dict of workload name -> result
+    """
+    setups = dict(single_lane_workloads())
+    bank_iterations = {}
+    for lanes in lane_counts:
+        name = f"bank.predict_and_update.{lanes}"
+        setups[name] = bank_workload(lanes)
+        bank_iterations[name] = max(50, iterations * 10 // max(lanes, 10))
+        name32 = f"bank.float32.predict_and_update.{lanes}"
+        setups[name32] = bank_workload(lanes, dtype=np.float32)
+        bank_iterations[name32] = bank_iterations[name]
+
+    results = {}
+    for name, setup in setups.items():
+        if workloads and not any(w in name for w in workloads):
+            continue
+        n = bank_iterations.get(name, iterations)
+        results[name] = run_workload(setup, n, min(warmup, n))
+        if name in bank_iterations:
+            results[name]["lanes_per_second"] = results[name]["fps"] * int(name.rsplit(".", 1)[1])
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Find workloads that regressed against a baseline
+
+    A workload regresses when its p50 or p99 latency grows, or its frames
+    per second drops, by more than `tolerance` (relative).
+
+    Returns:
+        list of human-readable regression descriptions
+    """
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for key in ("p50_ns", "p99_ns"):
+            if current[key] > base[key] * (1.0 + tolerance):
+                regressions.append(f"{name}: {key} {current[key]:.0f} > baseline {base[key]:.0f}")
+        if current["fps"] < base["fps"] / (1.0 + tolerance):
+            regressions.append(f"{name}: fps {current['fps']:.1f} < baseline {base['fps']:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lane Kalman filter benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--iterations", type=int, default=2000, help="timed steps per workload")
+    parser.add_argument("--warmup", type=int, default=200, help="untimed steps per workload")
+    parser.add_argument("--lanes", type=int, nargs="*", default=list(LANE_COUNTS), help="bank sizes")
+    parser.add_argument("--workload", action="append", help="only run workloads containing this text")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.iterations, args.warmup, args.lanes, args.workload)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'workload':45s} {'p50 us':>10s} {'p99 us':>10s} {'p999 us':>10s} {'fps':>12s}")
+    for name, r in results.items():
+        print(f"{name:45s} {r['p50_ns'] / 1e3:10.1f} {r['p99_ns'] / 1e3:10.1f} "
+              f"{r['p999_ns'] / 1e3:10.1f} {r['fps']:12.1f}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
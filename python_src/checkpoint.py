@@ -0,0 +1,261 @@
+"""
+Compact binary checkpoints of KalmanFilter and EstimateLaneParam state
+
+Blob/file layout: the 64-byte lane_log.HEADER_DTYPE header with magic
+b"LANECKPT" and kind KIND_FILTER or KIND_ESTIMATOR, followed by `count`
+fixed-size records.
+
+Filter record (576 bytes, FILTER_DTYPE): x, packed P, F, B (4 x 1 as 4),
+u, H, packed Q, packed R, update method, Joseph form and workspace flags.
+
+Estimator record (152 bytes, ESTIMATOR_DTYPE): x, packed P, speed,
+look_forward_time, w, steady-state step count, engine and flags. The motion
+model matrices are restored through the estimator's MotionModelCache, which
+builds them from the quantized (speed, look_forward_time).
+
+Covariances are packed upper triangles, see kalman_filter.pack_covariance.
+Only the 4-state lane model (n = 4, k = 4, m = 1) is supported.
+"""
+import numpy as np
+from estimate_lane_param import EstimateLaneParam
+from kalman_filter import KalmanFilter, pack_covariance, unpack_covariance
+from lane_log import HEADER_DTYPE
+
+
+MAGIC = b"LANECKPT"
+FORMAT_VERSION = 1
+KIND_FILTER = 1
+KIND_ESTIMATOR = 2
+
+FLAG_INITIALIZED = 1
+FLAG_WORKSPACE = 2
+
+FILTER_DTYPE = np.dtype([
+    ("x", "<f8", (4,)),
+    ("p_upper", "<f8", (10,)),
+    ("F", "<f8", (4, 4)),
+    ("B", "<f8", (4,)),
+    ("u", "<f8"),
+    ("H", "<f8", (4, 4)),
+    ("q_upper", "<f8", (10,)),
+    ("r_upper", "<f8", (10,)),
+    ("update_method", "u1"),
+    ("joseph_form", "u1"),
+    ("flags", "u1"),
+    ("padding", "V5"),
+])
+
+ESTIMATOR_DTYPE = np.dtype([
+    ("x", "<f8", (4,)),
+    ("p_upper", "<f8", (10,)),
+    ("speed", "<f8"),
+    ("look_forward_time", "<f8"),
+    ("w", "<f8"),
+    ("steady_state_steps", "<u8"),
+    ("engine", "u1"),
+    ("flags", "u1"),
+    ("padding", "V6"),
+])
+
+_RECORD_DTYPES = {KIND_FILTER: FILTER_DTYPE, KIND_ESTIMATOR: ESTIMATOR_DTYPE}
+
+
+def filter_records(filters):
+    """
+    Checkpoint records of a sequence of KalmanFilter instances
+    """
+    records = np.zeros(len(filters), dtype=FILTER_DTYPE)
+    for record, kf in zip(records, filters):
+        if np.size(kf.x_) != 4 or np.shape(kf.H_) != (4, 4) or np.size(kf.u_) != 1:
+            raise ValueError("checkpoints support the 4-state lane model only")
+        record["x"] = np.ravel(kf.x_)
+        record["p_upper"] = pack_covariance(np.asarray(kf.P_))
+        record["F"] = kf.F_
+        record["B"] = np.ravel(kf.B_)
+        record["u"] = np.ravel(kf.u_)[0]
+        record["H"] = kf.H_
+        record["q_upper"] = pack_covariance(np.asarray(kf.Q_))
+        record["r_upper"] = pack_covariance(np.asarray(kf.R_))
+        record["update_method"] = KalmanFilter.UPDATE_METHODS.index(kf.update_method_)
+        record["joseph_form"] = kf.joseph_form_
+        record["flags"] = FLAG_WORKSPACE if kf.use_workspace_ else 0
+    return records
+
+
+def estimator_records(estimators):
+    """
+    Checkpoint records of a sequence of EstimateLaneParam instances
+
+    The state is taken from the estimator's filter, i.e. the state after
+    its last predict/update step (including steady-state steps).
+    """
+    records = np.zeros(len(estimators), dtype=ESTIMATOR_DTYPE)
+    for record, estimator in zip(records, estimators):
+        estimator.sync_filter_state()
+        record["speed"] = estimator.speed_
+        record["look_forward_time"] = estimator.look_forward_time_
+        record["w"] = estimator.w_
+        record["steady_state_steps"] = estimator.steady_state_steps_
+        record["engine"] = EstimateLaneParam.ENGINES.index(estimator.engine_)
+        flags = FLAG_WORKSPACE if estimator.use_workspace_ else 0
+        if estimator.kalman_ is not None:
+            record["x"] = np.ravel(estimator.kalman_.x_)
+            record["p_upper"] = pack_covariance(np.asarray(estimator.kalman_.P_))
+            flags |= FLAG_INITIALIZED
+        record["flags"] = flags
+    return records
+
+
+def dumps(records, kind):
+    """
+    Serialize checkpoint records to one contiguous blob
+
+    Args:
+        records: FILTER_DTYPE or ESTIMATOR_DTYPE records
+        kind: KIND_FILTER or KIND_ESTIMATOR
+
+    Returns:
+        bytes
+    """
+    dtype = _RECORD_DTYPES[kind]
+    blob = np.zeros(HEADER_DTYPE.itemsize + len(records) * dtype.itemsize, dtype=np.uint8)
+    header = blob[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["kind"] = kind
+    header["record"] = dtype.itemsize
+    header["count"] = len(records)
+    blob[HEADER_DTYPE.itemsize:].view(dtype)[:] = records
+    return blob.tobytes()
+
+
+def loads(blob):
+    """
+    Parse a checkpoint blob without copying the records
+
+    Returns:
+        (kind, records) with records a read-only view into the blob
+    """
+    if len(blob) < HEADER_DTYPE.itemsize:
+        raise ValueError("not a lane checkpoint")
+    header = np.frombuffer(blob, dtype=HEADER_DTYPE, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError("not a lane checkpoint")
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported lane checkpoint version {header['version']}")
+    kind = int(header["kind"])
+    dtype = _RECORD_DTYPES.get(kind)
+    if dtype is None or header["record"] != dtype.itemsize:
+        raise ValueError(f"unknown lane checkpoint record kind {kind}")
+    records = np.frombuffer(blob, dtype=dtype, count=int(header["count"]), offset=HEADER_DTYPE.itemsize)
+    return kind, records
+
+
+def _expect(blob, kind):
+    """
+    Records of a blob that must be of the given kind
+    """
+    found, records = loads(blob)
+    if found != kind:
+        raise ValueError(f"expected lane checkpoint kind {kind}, found {found}")
+    return records
+
+
+def restore_filter(record, **kwargs):
+    """
+    Build a KalmanFilter from one FILTER_DTYPE record
+
+    Args:
+        record: checkpoint record
+        kwargs: KalmanFilter arguments that are not checkpointed
+                (log_hook, instrumentation)
+    """
+    return KalmanFilter(
+        record["F"].copy(), record["B"].reshape(4, 1).copy(), record["H"].copy(),
+        unpack_covariance(record["p_upper"]), unpack_covariance(record["q_upper"]),
+        unpack_covariance(record["r_upper"]), record["x"].copy(),
+        np.array([[record["u"]]]),
+        use_workspace=bool(record["flags"] & FLAG_WORKSPACE),
+        update_method=KalmanFilter.UPDATE_METHODS[record["update_method"]],
+        joseph_form=bool(record["joseph_form"]),
+        **kwargs
+    )
+
+
+def restore_estimator(record, **kwargs):
+    """
+    Build an EstimateLaneParam from one ESTIMATOR_DTYPE record
+
+    Args:
+        record: checkpoint record
+        kwargs: EstimateLaneParam arguments that are not checkpointed
+                (log_hook, model_cache, instrumentation)
+
+    Returns:
+        (estimator, matrix_X, matrix_P); pass matrix_X/matrix_P to the next
+        predict/update call to continue where the checkpoint was taken
+    """
+    estimator = EstimateLaneParam(
+        use_workspace=bool(record["flags"] & FLAG_WORKSPACE),
+        engine=EstimateLaneParam.ENGINES[record["engine"]],
+        **kwargs
+    )
+    estimator.set_motion_data(float(record["speed"]), float(record["look_forward_time"]), float(record["w"]))
+    estimator.steady_state_steps_ = int(record["steady_state_steps"])
+    matrix_X = record["x"].copy()
+    matrix_P = unpack_covariance(record["p_upper"])
+    if record["flags"] & FLAG_INITIALIZED:
+        estimator.warm_start(matrix_P, matrix_X)
+    return estimator, matrix_X, matrix_P
+
+
+def save_filter(kf):
+    """
+    Serialize one KalmanFilter to a blob
+    """
+    return dumps(filter_records([kf]), KIND_FILTER)
+
+
+def load_filter(blob, **kwargs):
+    """
+    Restore one KalmanFilter from save_filter output
+    """
+    return restore_filter(_expect(blob, KIND_FILTER)[0], **kwargs)
+
+
+def save_estimator(estimator):
+    """
+    Serialize one EstimateLaneParam to a blob
+    """
+    return dumps(estimator_records([estimator]), KIND_ESTIMATOR)
+
+
+def load_estimator(blob, **kwargs):
+    """
+    Restore one EstimateLaneParam from save_estimator output
+
+    Returns:
+        (estimator, matrix_X, matrix_P), see restore_estimator
+    """
+    return restore_estimator(_expect(blob, KIND_ESTIMATOR)[0], **kwargs)
+
+
+def write_checkpoint(path, estimators):
+    """
+    Write the state of many estimators (tracks) with a single write call
+    """
+    blob = dumps(estimator_records(estimators), KIND_ESTIMATOR)
+    with open(path, "wb") as f:
+        f.write(blob)
+
+
+def read_checkpoint(path, **kwargs):
+    """
+    Restore all estimators of a write_checkpoint file
+
+    Returns:
+        list of (estimator, matrix_X, matrix_P)
+    """
+    with open(path, "rb") as f:
+        records = _expect(f.read(), KIND_ESTIMATOR)
+    return [restore_estimator(record, **kwargs) for record in records]
@@ -4,30 +4,186 @@ Equivalent to the C++ estimateLaneParam.h and estimateLaneParam.cpp
 """
 import numpy as np
 from kalman_filter import KalmanFilter
+from lane_filter import LaneKalmanFilter
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, build_motion_matrices_batch, default_model_cache
+
+
+def _coefficient(index):
+    """
+    Property exposing one coefficient of the backing array as a float
+    """
+    def getter(self):
+        return float(self.coeffs_[index])
+    
+    def setter(self, value):
+        self.coeffs_[index] = value
+    
+    return property(getter, setter)
 
 
 class LaneParamInfo:
     """
     Lane parameter information structure
     Equivalent to the C++ laneParamInfo struct
+    
+    c0_..c3_ live in a float64 array of length 4. as_array() returns that
+    array and from_array() wraps an existing one without copying, so a
+    LaneParamInfo can alias a state vector such as matrix_X.
     """
+    __slots__ = ("coeffs_",)
+    
     def __init__(self, c0=0.0, c1=0.0, c2=0.0, c3=0.0):
-        self.c0_ = c0
-        self.c1_ = c1
-        self.c2_ = c2
-        self.c3_ = c3
+        self.coeffs_ = np.array([c0, c1, c2, c3], dtype=float)
+    
+    c0_ = _coefficient(0)
+    c1_ = _coefficient(1)
+    c2_ = _coefficient(2)
+    c3_ = _coefficient(3)
+    
+    @classmethod
+    def from_array(cls, array):
+        """
+        Wrap a length-4 float64 array (or view) without copying
+        
+        Args:
+            array: 1-D float64 array [c0, c1, c2, c3]; may be strided
+        """
+        if not isinstance(array, np.ndarray) or array.shape != (4,) or array.dtype != np.float64:
+            raise ValueError("LaneParamInfo.from_array expects a float64 array of shape (4,)")
+        lane_param = cls.__new__(cls)
+        lane_param.coeffs_ = array
+        return lane_param
+    
+    def as_array(self):
+        """
+        The backing array [c0, c1, c2, c3] (a view, not a copy)
+        """
+        return self.coeffs_
+    
+    def __repr__(self):
+        return "LaneParamInfo(c0={}, c1={}, c2={}, c3={})".format(*self.coeffs_.tolist())
+
+
+class LaneParamBatch:
+    """
+    Lane parameters of many lanes and/or frames as a structure of arrays
+    
+    The coefficients are the rows of one (4, *shape) float64 or float32
+    array, so each of c0_..c3_ is a contiguous array of shape `shape` and
+    all accessors return views.
+    """
+    __slots__ = ("coeffs_",)
+    
+    def __init__(self, shape, dtype=np.float64):
+        """
+        Initialize a zeroed batch
+        
+        Args:
+            shape: batch shape, e.g. (lanes,) or (frames, lanes)
+            dtype: coefficient dtype, np.float64 or np.float32
+        """
+        if isinstance(shape, int):
+            shape = (shape,)
+        self.coeffs_ = np.zeros((4,) + tuple(shape), dtype=dtype)
+    
+    @classmethod
+    def from_coefficients(cls, coeffs):
+        """
+        Wrap a (4, *shape) float64/float32 array without copying;
+        other dtypes are converted to float64
+        """
+        coeffs = np.asarray(coeffs)
+        if coeffs.dtype not in (np.float64, np.float32):
+            coeffs = coeffs.astype(float)
+        if coeffs.ndim < 1 or coeffs.shape[0] != 4:
+            raise ValueError("LaneParamBatch expects coefficients of shape (4, ...)")
+        batch = cls.__new__(cls)
+        batch.coeffs_ = coeffs
+        return batch
+    
+    @classmethod
+    def from_states(cls, states):
+        """
+        Build a batch from stacked state vectors of shape (..., 4)
+        """
+        return cls.from_coefficients(np.ascontiguousarray(np.moveaxis(np.asarray(states), -1, 0)))
+    
+    c0_ = property(lambda self: self.coeffs_[0])
+    c1_ = property(lambda self: self.coeffs_[1])
+    c2_ = property(lambda self: self.coeffs_[2])
+    c3_ = property(lambda self: self.coeffs_[3])
+    
+    @property
+    def shape(self):
+        return self.coeffs_.shape[1:]
+    
+    def __len__(self):
+        return self.coeffs_.shape[1]
+    
+    def states(self):
+        """
+        View of the batch as state vectors of shape (*shape, 4)
+        """
+        return np.moveaxis(self.coeffs_, 0, -1)
+    
+    def set_states(self, index, states):
+        """
+        Write state vectors of shape (..., 4) into the selected entries
+        
+        Args:
+            index: index into the batch shape
+            states: state vectors, e.g. matrix_X or a KalmanFilterBank.x_
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        self.coeffs_[(slice(None),) + index] = np.moveaxis(np.asarray(states), -1, 0)
+    
+    def __getitem__(self, index):
+        """
+        LaneParamInfo view for a single entry, LaneParamBatch view otherwise
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        coeffs = self.coeffs_[(slice(None),) + index]
+        if coeffs.ndim == 1:
+            return LaneParamInfo.from_array(coeffs)
+        return LaneParamBatch.from_coefficients(coeffs)
 
 
 class EstimateLaneParam:
     """
     Lane parameter estimation using Kalman Filter
     Equivalent to the C++ estimateLaneParam class
+    
+    engine selects the filter implementation:
+        "numpy":  KalmanFilter
+        "scalar": LaneKalmanFilter, unrolled on Python floats for the 4-state
+                  lane model; several times faster per step for one lane
     """
     
-    def __init__(self):
+    ENGINES = ("numpy", "scalar")
+    
+    def __init__(self, use_workspace=False, log_hook=None, model_cache=None, instrumentation=None,
+                 engine="numpy"):
         """
         Initialize the lane parameter estimator
+        
+        Args:
+            use_workspace: run the Kalman Filter on preallocated in-place buffers
+            log_hook: optional callable log_hook(stage, x) forwarded to the filter
+            model_cache: MotionModelCache for the A/B matrices
+                         (defaults to the cache shared by all estimators)
+            instrumentation: optional FilterInstrumentation, shared with the filter
+            engine: "numpy" or "scalar"
         """
+        if engine not in self.ENGINES:
+            raise ValueError(f"unknown engine: {engine}")
+        self.engine_ = engine
+        self.use_workspace_ = use_workspace
+        self.log_hook_ = log_hook
+        self.instrumentation_ = instrumentation
+        self.model_cache_ = model_cache if model_cache is not None else default_model_cache
+        
         self.lane_param_ = LaneParamInfo()
         self.speed_ = 0.0
         self.look_forward_time_ = 0.0
@@ -43,6 +199,15 @@ class EstimateLaneParam:
         
         # Kalman Filter instance
         self.kalman_ = None
+        
+        # Optional steady-state gain table for constant-speed operation
+        self.steady_state_table_ = None
+        self.steady_state_steps_ = 0
+        # (matrix_P, matrix_X) of the last steady-state step, not yet in the filter
+        self.pending_state_ = None
+        
+        # Powers of F and accumulated control/noise terms for predict_horizon
+        self.horizon_cache_ = None
     
     def set_motion_data(self, speed, look_forward_time, w):
         """
@@ -53,9 +218,22 @@ class EstimateLaneParam:
             look_forward_time: look forward time
             w: angular velocity
         """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+        
         self.speed_ = speed
         self.look_forward_time_ = look_forward_time
         self.w_ = w
+        
+        # Swap the cached motion model into an existing filter
+        if self.kalman_ is not None:
+            matrix_A, matrix_B = self.model_cache_.get(speed, look_forward_time)
+            self.matrix_U_[0, 0] = w
+            self.kalman_.set_model(matrix_A, matrix_B, self.matrix_U_)
+        
+        if instrumentation is not None:
+            instrumentation.record_time("set_motion_data", instrumentation.clock_() - start)
     
     def set_state_data(self, matrix_X, matrix_P):
         """
@@ -81,57 +259,90 @@ class EstimateLaneParam:
         """
         Initialize Kalman Filter matrices
         """
-        # Calculate look ahead distance
-        look_ahead_dist = self.speed_ * self.look_forward_time_
-        dx = look_ahead_dist
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
         
-        # State transition matrix A (equivalent to matrix_A in C++)
-        matrix_A = np.zeros((4, 4))
-        matrix_A[0, 0] = 1
-        matrix_A[0, 1] = dx
-        matrix_A[0, 2] = pow(dx, 2) / 2
-        matrix_A[0, 3] = pow(dx, 3) / 6
+        # State transition matrix A and control matrix B, cached per
+        # (speed, look forward time)
+        matrix_A, matrix_B = self.model_cache_.get(self.speed_, self.look_forward_time_)
         
-        matrix_A[1, 1] = 1
-        matrix_A[1, 2] = dx
-        matrix_A[1, 3] = pow(dx, 2) / 2
+        # Measurement matrix H, process noise Q and measurement noise R are shared
+        matrix_H = MATRIX_H
+        self.matrix_Q_ = MATRIX_Q
+        self.matrix_R_ = MATRIX_R
         
-        matrix_A[2, 2] = 1
-        matrix_A[2, 3] = dx
-        
-        matrix_A[3, 3] = 1
-        
-        # Control matrix B (equivalent to matrix_B in C++)
-        matrix_B = np.zeros((4, 1))
-        matrix_B[0, 0] = -pow(dx, 2) / (2 * self.speed_)
-        matrix_B[1, 0] = -self.look_forward_time_
+        # Control vector U
+        self.matrix_U_ = np.array([[self.w_]])
         
-        # Measurement matrix H (equivalent to matrix_H in C++)
-        matrix_H = np.zeros((4, 4))
-        matrix_H[0, 0] = 1
-        matrix_H[1, 1] = 1
-        matrix_H[2, 2] = 1
-        matrix_H[3, 3] = 1
+        # Create Kalman Filter instance
+        if self.engine_ == "scalar":
+            self.kalman_ = LaneKalmanFilter(
+                matrix_A, matrix_B, matrix_H,
+                self.matrix_P_, self.matrix_Q_, self.matrix_R_,
+                self.matrix_X_, self.matrix_U_,
+                log_hook=self.log_hook_, instrumentation=instrumentation
+            )
+        else:
+            self.kalman_ = KalmanFilter(
+                matrix_A, matrix_B, matrix_H, 
+                self.matrix_P_, self.matrix_Q_, self.matrix_R_,
+                self.matrix_X_, self.matrix_U_,
+                use_workspace=self.use_workspace_, log_hook=self.log_hook_,
+                instrumentation=instrumentation
+            )
         
-        # Process noise covariance matrix Q
-        self.matrix_Q_ = np.zeros((4, 4))
-        diag_Q = np.array([0.001, 0.001, 0.001, 0.001])
-        np.fill_diagonal(self.matrix_Q_, diag_Q)
+        if instrumentation is not None:
+            instrumentation.record_time("initialize", instrumentation.clock_() - start)
+    
+    def model_cache_info(self):
+        """
+        Hit/miss statistics of the motion model cache
+        """
+        return self.model_cache_.cache_info()
+    
+    def set_log_hook(self, log_hook):
+        """
+        Set the logging hook of the estimator and its Kalman Filter
         
-        # Measurement noise covariance matrix R； 固定测量噪声；
-        self.matrix_R_ = np.zeros((4, 4))
-        diag_R = np.array([0.1, 0.1, 0.1, 0.1])
-        np.fill_diagonal(self.matrix_R_, diag_R)
+        Args:
+            log_hook: callable log_hook(stage, x), or None to disable logging
+        """
+        self.log_hook_ = log_hook
+        if self.kalman_ is not None:
+            self.kalman_.log_hook_ = log_hook
+    
+    def set_instrumentation(self, instrumentation):
+        """
+        Attach instrumentation to the estimator and its Kalman Filter
         
-        # Control vector U
-        self.matrix_U_ = np.array([[self.w_]])
+        Args:
+            instrumentation: FilterInstrumentation, or None to disable it
+        """
+        self.instrumentation_ = instrumentation
+        if self.kalman_ is not None:
+            self.kalman_.instrumentation_ = instrumentation
+    
+    def _load_state(self, matrix_P, matrix_X):
+        """
+        Load the caller's state into the Kalman Filter, creating it if needed
+        """
+        self.pending_state_ = None
+        if self.kalman_ is None:
+            self.set_state_data(matrix_X, matrix_P)
+            self._initialize_matrices()
+        else:
+            self.kalman_.load_state(matrix_X, matrix_P)
+    
+    def warm_start(self, matrix_P, matrix_X):
+        """
+        Load a saved state into the filter without running a step
         
-        # Create Kalman Filter instance
-        self.kalman_ = KalmanFilter(
-            matrix_A, matrix_B, matrix_H, 
-            self.matrix_P_, self.matrix_Q_, self.matrix_R_,
-            self.matrix_X_, self.matrix_U_
-        )
+        Args:
+            matrix_P: error covariance matrix
+            matrix_X: state vector
+        """
+        self._load_state(matrix_P, matrix_X)
     
     def predict(self, matrix_P, matrix_X):
         """
@@ -141,37 +352,90 @@ class EstimateLaneParam:
             matrix_P: error covariance matrix (input/output)
             matrix_X: state vector (input/output)
         """
-        # Set current state
-        self.set_state_data(matrix_X, matrix_P)
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
         
-        # Initialize matrices if needed
-        if self.kalman_ is None:
-            self._initialize_matrices()
-        else:
-            # Update Kalman Filter with current state
-            self.kalman_.x_ = self.matrix_X_.copy()
-            self.kalman_.P_ = self.matrix_P_.copy()
+        self._load_state(matrix_P, matrix_X)
         
         # Perform prediction
         self.kalman_.predict()
         
         # Update output parameters
-        matrix_X[:] = self.kalman_.x_[:4]
-        matrix_P[:] = self.kalman_.P_[:]
+        self.kalman_.store_state(matrix_X, matrix_P)
+        
+        if instrumentation is not None:
+            instrumentation.record_time("step", instrumentation.clock_() - start)
+    
+    def _skip_update(self, matrix_P, matrix_X):
+        """
+        Predict for a frame whose measurement is missing
+        """
+        if self.instrumentation_ is not None:
+            self.instrumentation_.count("skips")
+        self.predict(matrix_P, matrix_X)
 
-    def update(self, matrix_P, matrix_X, matrix_Z):
+    def update(self, matrix_P, matrix_X, matrix_Z, matrix_R=None):
         """
         Perform update step only
+        
+        Args:
+            matrix_P: error covariance matrix (input/output)
+            matrix_X: state vector (input/output)
+            matrix_Z: measurement vector
+            matrix_R: optional measurement noise covariance of this measurement,
+                      e.g. from measurement_fit; the fixed matrix_R_ otherwise
         """
-        self.set_measurement_data(matrix_Z)
-        self.set_state_data(matrix_X, matrix_P)
-        # Update Kalman Filter with current state
-        self.kalman_.x_ = self.matrix_X_.copy()
-        self.kalman_.P_ = self.matrix_P_.copy()        
-        self.kalman_.update(self.matrix_Z_)
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+        
+        self.matrix_Z_ = matrix_Z
+        self.pending_state_ = None
+        self.kalman_.load_state(matrix_X, matrix_P)
+        if matrix_R is None:
+            self.kalman_.update(matrix_Z)
+        else:
+            self.kalman_.set_measurement_noise(matrix_R)
+            try:
+                self.kalman_.update(matrix_Z)
+            finally:
+                self.kalman_.set_measurement_noise(self.matrix_R_)
         # Update output parameters
-        matrix_X[:] = self.kalman_.x_[:4]
-        matrix_P[:] = self.kalman_.P_[:]
+        self.kalman_.store_state(matrix_X, matrix_P)
+        
+        if instrumentation is not None:
+            instrumentation.record_time("step", instrumentation.clock_() - start)
+    
+    def update_points(self, matrix_P, matrix_X, x, y, variances):
+        """
+        Perform update step with raw lane points instead of a fitted cubic
+        
+        Each point (x_i, y_i) measures the lateral offset
+        c0 + c1*x_i + c2*x_i^2 + c3*x_i^3 = phi(x_i)^T*X, so all points of the
+        frame are fused in one block with H = [phi(x_i)^T], see
+        KalmanFilter.update_ekf. A frame without points leaves the state as is.
+        
+        Args:
+            matrix_P: error covariance matrix (input/output)
+            matrix_X: state vector (input/output)
+            x: longitudinal positions of the points, (m,)
+            y: lateral positions of the points, (m,)
+            variances: lateral noise variance, scalar or per point (m,)
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+        
+        phi = np.vander(np.asarray(x, dtype=float).reshape(-1), 4, increasing=True)
+        if phi.shape[0]:
+            self.pending_state_ = None
+            self.kalman_.load_state(matrix_X, matrix_P)
+            self.kalman_.update_ekf(y, lambda state: phi @ state, lambda state: phi, variances)
+            self.kalman_.store_state(matrix_X, matrix_P)
+        
+        if instrumentation is not None:
+            instrumentation.record_time("step", instrumentation.clock_() - start)
     
     def predict_and_update(self, matrix_P, matrix_X, matrix_Z):
         """
@@ -182,32 +446,174 @@ class EstimateLaneParam:
             matrix_X: state vector (input/output)
             matrix_Z: measurement vector
         """
-        # First predict
-        self.predict(matrix_P, matrix_X)
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
         
-        # Then update with measurement
-        self.set_measurement_data(matrix_Z)
+        self.matrix_Z_ = matrix_Z
+        if self.steady_state_table_ is None or not self._steady_state_step(matrix_P, matrix_X, matrix_Z):
+            self._load_state(matrix_P, matrix_X)
+            
+            # First predict, then update with measurement; the state stays
+            # inside the filter between the two steps
+            self.kalman_.predict()
+            self.kalman_.update(matrix_Z)
+            
+            # Update output parameters
+            self.kalman_.store_state(matrix_X, matrix_P)
         
-        # Set current state (after prediction)
-        self.set_state_data(matrix_X, matrix_P)
+        if instrumentation is not None:
+            instrumentation.record_time("step", instrumentation.clock_() - start)
+    
+    def sync_filter_state(self):
+        """
+        Load the state of the last steady-state step into the filter
         
-        # Update Kalman Filter with current state
-        self.kalman_.x_ = self.matrix_X_.copy()
-        self.kalman_.P_ = self.matrix_P_.copy()
+        Steady-state steps write only the caller's matrix_X/matrix_P and keep
+        references to them; call this before reading the filter state, e.g.
+        for a checkpoint. Full predict/update steps load the caller's state
+        themselves.
+        """
+        if self.pending_state_ is not None:
+            matrix_P, matrix_X = self.pending_state_
+            self._load_state(matrix_P, matrix_X)
+    
+    def enable_steady_state(self, gain_table):
+        """
+        Use precomputed steady-state gains in predict_and_update
         
-        # Perform update
-        self.kalman_.update(self.matrix_Z_)
+        While the motion data falls in a bin of the table and the covariance
+        has converged to that bin's steady state, the step is the state-only
+        update x = (I - K)*F*x + (I - K)*B*u + K*z. Otherwise the full
+        Kalman recursion runs.
         
-        # Update output parameters
-        matrix_X[:] = self.kalman_.x_[:4]
-        matrix_P[:] = self.kalman_.P_[:]
+        Args:
+            gain_table: SteadyStateGainTable built for the estimator's Q and R
+        """
+        self.steady_state_table_ = gain_table
+    
+    def disable_steady_state(self):
+        """
+        Always run the full Kalman recursion
+        """
+        self.steady_state_table_ = None
+    
+    def _steady_state_step(self, matrix_P, matrix_X, matrix_Z):
+        """
+        Perform a steady-state predict+update if the table applies
+        
+        Returns:
+            True if the step was done, False if the full recursion is needed
+        """
+        table = self.steady_state_table_
+        entry = table.lookup(self.speed_, self.look_forward_time_)
+        if entry is None or not table.is_converged(matrix_P, entry):
+            return False
+        
+        # x = (I - K)*F*x + (I - K)*B*u + K*z
+        matrix_X[:] = entry.A_closed @ matrix_X + entry.B_closed[:, 0] * self.w_ + entry.K @ matrix_Z
+        matrix_P[:] = entry.P_filtered
+        # The filter catches up only when needed, see sync_filter_state
+        self.pending_state_ = (matrix_P, matrix_X)
+        self.steady_state_steps_ += 1
+        if self.instrumentation_ is not None:
+            self.instrumentation_.count("updates")
+            self.instrumentation_.count("steady_state")
+        return True
+    
+    def _horizon_terms(self, K):
+        """
+        F^k, sum_{j<k} F^j*B and sum_{j<k} F^j*Q*F^j^T for k = 1..K
+        
+        F^k is the motion model over k*dx, so all powers are built at once;
+        the terms are cached per model and horizon length.
+        """
+        cache = self.model_cache_
+        key = cache.key(self.speed_, self.look_forward_time_) + (K,)
+        if self.horizon_cache_ is not None and self.horizon_cache_[0] == key:
+            return self.horizon_cache_[1:]
+        
+        # Same quantized motion data as the cached one-step model
+        speed = key[0] / cache.scale_
+        look_forward_time = key[1] / cache.scale_
+        steps = np.arange(K + 1)
+        powers, matrix_B = build_motion_matrices_batch(np.full(K + 1, speed), look_forward_time * steps)
+        powers[0] = np.eye(4)  # F^0 (the k*dx model with k = 0 is the identity)
+        one_step_B = matrix_B[1]
+        
+        # Accumulated control and process noise: cumulative sums over F^j
+        matrix_Q = self.matrix_Q_ if self.matrix_Q_ is not None else MATRIX_Q
+        control = np.cumsum(powers[:K] @ one_step_B, axis=0)
+        noise = np.cumsum(powers[:K] @ matrix_Q @ np.swapaxes(powers[:K], -1, -2), axis=0)
+        self.horizon_cache_ = (key, powers[1:], control[..., 0], noise)
+        return self.horizon_cache_[1:]
+    
+    def predict_horizon(self, K, matrix_X, matrix_P=None, with_covariance=True):
+        """
+        Predict K steps ahead with the current motion data without mutating anything
+        
+        Equivalent to K calls of predict() on copies of the state, computed
+        in one vectorized step: x_k = F^k*x + sum_{j<k} F^j*B*u and
+        P_k = F^k*P*F^k^T + sum_{j<k} F^j*Q*F^j^T.
+        
+        Args:
+            K: number of future steps
+            matrix_X: current state vector
+            matrix_P: current error covariance matrix (needed with_covariance)
+            with_covariance: also propagate the covariance
+        
+        Returns:
+            (states (K, 4), covariances (K, 4, 4) or None)
+        """
+        powers, control, noise = self._horizon_terms(K)
+        states = powers @ np.reshape(matrix_X, -1) + control * self.w_
+        if not with_covariance:
+            return states, None
+        covariances = powers @ matrix_P @ np.swapaxes(powers, -1, -2) + noise
+        return states, covariances
+    
+    def stream(self, frames, matrix_X, matrix_P, copy=False):
+        """
+        Run the estimator lazily over a sequence of frames
+        
+        Each frame is (timestamp, speed, look_forward_time, w, z_or_None);
+        a frame without measurement only runs the prediction step. The
+        state is advanced in place in matrix_X/matrix_P, and by default the
+        yielded LaneParamInfo is a view of matrix_X and the covariance is
+        matrix_P itself, so consumers must copy what they keep (or pass
+        copy=True). matrix_X must be a float64 array of shape (4,).
+        
+        Args:
+            frames: iterable of (timestamp, speed, look_forward_time, w, z_or_None)
+            matrix_X: initial state vector (input/output)
+            matrix_P: initial error covariance matrix (input/output)
+            copy: yield independent LaneParamInfo/covariance objects per frame
+        
+        Yields:
+            (timestamp, lane_param, matrix_P) after each frame
+        """
+        lane_param = LaneParamInfo.from_array(matrix_X)
+        for timestamp, speed, look_forward_time, w, matrix_Z in frames:
+            if (speed != self.speed_ or look_forward_time != self.look_forward_time_
+                    or w != self.w_ or self.kalman_ is None):
+                self.set_motion_data(speed, look_forward_time, w)
+            
+            if matrix_Z is None:
+                self._skip_update(matrix_P, matrix_X)
+            else:
+                self.predict_and_update(matrix_P, matrix_X, matrix_Z)
+            
+            if copy:
+                yield timestamp, LaneParamInfo.from_array(matrix_X.copy()), matrix_P.copy()
+            else:
+                yield timestamp, lane_param, matrix_P
     
     def predict_only(self, matrix_P, matrix_X):
         """
         Legacy method for backward compatibility
         Perform prediction step only
         """
-        self.predict(matrix_P, matrix_X)
+        self._skip_update(matrix_P, matrix_X)
     
     # Legacy methods for backward compatibility
     def set_data(self, matrix_X, speed, look_forward_time, w, matrix_Z=None):
@@ -241,4 +647,4 @@ class EstimateLaneParam:
         if measurement_available and self.matrix_Z_ is not None:
             self.predict_and_update(matrix_P, matrix_X, self.matrix_Z_)
         else:
-            self.predict(matrix_P, matrix_X) 
\ No newline at end of file
+            self._skip_update(matrix_P, matrix_X) 
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Golden-output validator for replay results
+Compares a reference lane state sequence (e.g. the C++ `kalman` output) with
+a Python replay in one vectorized pass and gates on the first divergent frame
+
+Usage:
+    python golden_validator.py reference.txt replay_estimates.bin
+    python golden_validator.py golden.npy replay.npy --rtol 1e-9 --atol 1e-12
+"""
+import argparse
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+from lane_log import KIND_ESTIMATES, MAGIC, open_log
+
+
+# Number as printed by Eigen, NumPy or printf
+_NUMBER = rb"[-+]?(?:nan|inf|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+
+ValidationReport = namedtuple(
+    "ValidationReport",
+    ["frames", "reference_frames", "actual_frames", "max_abs", "mean_abs", "rms", "max_rel",
+     "divergent_frames", "first_divergent", "worst_frame", "passed"],
+)
+ValidationReport.__doc__ = """
+Comparison of two lane state sequences, per coefficient c0..c3 where shaped (4,)
+
+frames: number of compared frames (the shorter sequence)
+reference_frames, actual_frames: lengths of both sequences
+max_abs, mean_abs, rms: absolute error statistics, (4,)
+max_rel: maximum relative error |actual - reference| / |reference|, (4,)
+divergent_frames: number of frames outside atol + rtol * |reference|
+first_divergent: index of the first divergent frame, -1 if none
+worst_frame: index of the frame with the largest tolerance violation
+passed: no divergent frame, no non-finite value and equal lengths
+"""
+
+
+def parse_text_log(data, label="matrix_X_res"):
+    """
+    Extract the state vectors printed after `label =` in a text log
+
+    Handles the C++ Eigen output (one coefficient per line) and the Python
+    NumPy output (`[c0 c1 c2 c3]`); other lines are ignored.
+
+    Args:
+        data: log contents as bytes
+        label: name printed before each state vector
+
+    Returns:
+        states, (T, 4)
+    """
+    separator = rb"[\s,]+"
+    pattern = re.compile(
+        re.escape(label.encode()) + rb"\s*=\s*\[?\s*" + separator.join([b"(" + _NUMBER + b")"] * 4),
+        re.IGNORECASE,
+    )
+    matches = pattern.findall(data)
+    if not matches:
+        return np.zeros((0, 4))
+    return np.array(matches, dtype="S32").astype(np.float64)
+
+
+def load_states(path, label="matrix_X_res"):
+    """
+    Load a lane state sequence from a .npy array, a lane_log estimate log
+    or a text log (see parse_text_log)
+
+    Returns:
+        states, (T, 4)
+    """
+    if str(path).endswith(".npy"):
+        states = np.load(path, mmap_mode="r")
+    else:
+        with open(path, "rb") as f:
+            magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            return open_log(path, KIND_ESTIMATES)["x"]
+        with open(path, "rb") as f:
+            return parse_text_log(f.read(), label)
+    if states.ndim != 2 or states.shape[1] != 4:
+        raise ValueError(f"{path}: expected lane states of shape (T, 4), found {states.shape}")
+    return states
+
+
+def validate(reference, actual, rtol=1e-5, atol=1e-9):
+    """
+    Compare two lane state sequences frame by frame
+
+    A frame diverges when any coefficient violates
+    |actual - reference| <= atol + rtol * |reference|, or is not finite.
+    The default rtol matches the 6 significant digits printed by the C++
+    binary.
+
+    Args:
+        reference: reference states, (T, 4)
+        actual: states to validate, (T', 4)
+        rtol: relative tolerance
+        atol: absolute tolerance
+
+    Returns:
+        ValidationReport
+    """
+    frames = min(len(reference), len(actual))
+    reference_states = np.asarray(reference[:frames], dtype=np.float64)
+    actual_states = np.asarray(actual[:frames], dtype=np.float64)
+
+    error = np.abs(actual_states - reference_states)
+    magnitude = np.abs(reference_states)
+    # Tolerance violation per coefficient; nan (non-finite values) counts as divergent
+    excess = error - (atol + rtol * magnitude)
+    excess[~np.isfinite(excess)] = np.inf
+    worst = excess.max(axis=1) if frames else np.zeros(0)
+    divergent = worst > 0
+    divergent_frames = int(np.count_nonzero(divergent))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = np.where(magnitude > 0, error / magnitude, np.where(error > 0, np.inf, 0.0))
+    empty = np.zeros(4)
+    return ValidationReport(
+        frames=frames,
+        reference_frames=len(reference),
+        actual_frames=len(actual),
+        max_abs=error.max(axis=0) if frames else empty,
+        mean_abs=error.mean(axis=0) if frames else empty,
+        rms=np.sqrt(np.mean(error * error, axis=0)) if frames else empty,
+        max_rel=relative.max(axis=0) if frames else empty,
+        divergent_frames=divergent_frames,
+        first_divergent=int(np.argmax(divergent)) if divergent_frames else -1,
+        worst_frame=int(np.argmax(worst)) if frames else -1,
+        passed=divergent_frames == 0 and len(reference) == len(actual),
+    )
+
+
+def format_report(report, reference=None, actual=None):
+    """
+    Human-readable summary of a ValidationReport
+    """
+    lines = [f"frames compared: {report.frames} (reference {report.reference_frames}, "
+             f"actual {report.actual_frames})"]
+    lines.append(f"{'':10s} {'c0':>12s} {'c1':>12s} {'c2':>12s} {'c3':>12s}")
+    for name in ("max_abs", "mean_abs", "rms", "max_rel"):
+        lines.append(f"{name:10s} " + " ".join(f"{v:12.4e}" for v in getattr(report, name)))
+    lines.append(f"divergent frames: {report.divergent_frames}")
+    if report.first_divergent >= 0:
+        lines.append(f"first divergent frame: {report.first_divergent}")
+        if reference is not None and actual is not None:
+            lines.append(f"  reference: {np.asarray(reference[report.first_divergent])}")
+            lines.append(f"  actual:    {np.asarray(actual[report.first_divergent])}")
+    lines.append("PASSED" if report.passed else "FAILED")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate replay output against a golden reference")
+    parser.add_argument("reference", help="reference states: text log, lane_log estimate log or .npy")
+    parser.add_argument("actual", help="states to validate, same formats")
+    parser.add_argument("--label", default="matrix_X_res", help="state label in text logs")
+    parser.add_argument("--rtol", type=float, default=1e-5, help="relative tolerance")
+    parser.add_argument("--atol", type=float, default=1e-9, help="absolute tolerance")
+    args = parser.parse_args(argv)
+
+    reference = load_states(args.reference, args.label)
+    actual = load_states(args.actual, args.label)
+    report = validate(reference, actual, args.rtol, args.atol)
+    print(format_report(report, reference, actual))
+    return 0 if report.passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Opt-in instrumentation for the Kalman Filter hot path
+Records stage timings, update/skip counters and innovation statistics into
+fixed-size ring buffers; snapshot() aggregates them into histograms
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+# Fixed histogram edges, so snapshots taken at different times compare directly
+LATENCY_BIN_EDGES_NS = np.concatenate([[0.0], np.logspace(2, 8, 25), [np.inf]])
+INNOVATION_BIN_EDGES = np.concatenate([[0.0], np.logspace(-6, 2, 33), [np.inf]])
+NIS_BIN_EDGES = np.concatenate([np.arange(0.0, 41.0), [np.inf]])
+
+Histogram = namedtuple("Histogram", ["edges", "counts"])
+StageSnapshot = namedtuple(
+    "StageSnapshot",
+    ["count", "total_ns", "p50_ns", "p99_ns", "max_ns", "histogram"],
+)
+InstrumentationSnapshot = namedtuple(
+    "InstrumentationSnapshot",
+    ["counters", "stages", "innovation_norm", "nis", "nis_mean"],
+)
+InstrumentationSnapshot.__doc__ = """
+Aggregated view of a FilterInstrumentation
+
+counters: dict of event name -> count since the last reset
+stages: dict of stage name -> StageSnapshot over the buffered timings
+innovation_norm, nis: Histogram over the buffered updates
+nis_mean: mean NIS over the buffered updates (about the measurement
+          dimension for a consistent filter), nan without updates
+"""
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer keeping the most recent values
+
+    Appending never allocates; total_ counts every value ever appended,
+    including the ones that were overwritten.
+    """
+
+    def __init__(self, capacity, dtype=float):
+        self.data_ = np.zeros(capacity, dtype=dtype)
+        self.total_ = 0
+
+    def append(self, value):
+        self.data_[self.total_ % self.data_.shape[0]] = value
+        self.total_ += 1
+
+    def __len__(self):
+        return min(self.total_, self.data_.shape[0])
+
+    def values(self):
+        """
+        Buffered values, oldest first (a copy)
+        """
+        capacity = self.data_.shape[0]
+        if self.total_ <= capacity:
+            return self.data_[:self.total_].copy()
+        start = self.total_ % capacity
+        return np.concatenate([self.data_[start:], self.data_[:start]])
+
+    def clear(self):
+        self.total_ = 0
+
+
+class FilterInstrumentation:
+    """
+    Stage timers, event counters and innovation statistics of a filter
+
+    Attach one instance to a KalmanFilter or EstimateLaneParam through their
+    instrumentation argument; an estimator shares it with its filter. With
+    no instrumentation attached, each instrumented step costs one attribute
+    check.
+
+    Stages recorded by KalmanFilter: "predict", "update".
+    Stages recorded by EstimateLaneParam: "initialize" (filter creation),
+    "set_motion_data" and "step" (a whole predict/update/predict_and_update
+    call including state load and store).
+    Counters: "updates", "skips" (frames without measurement) and
+    "steady_state" (updates done with a precomputed gain).
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        Initialize the instrumentation
+
+        Args:
+            capacity: values kept per ring buffer
+        """
+        self.capacity_ = capacity
+        self.timings_ = {}
+        self.counters_ = {}
+        self.innovation_norm_ = RingBuffer(capacity)
+        self.nis_ = RingBuffer(capacity)
+        self.clock_ = time.perf_counter_ns
+
+    def record_time(self, stage, elapsed_ns):
+        """
+        Record the duration of one stage in nanoseconds
+        """
+        buffer = self.timings_.get(stage)
+        if buffer is None:
+            buffer = self.timings_[stage] = RingBuffer(self.capacity_, np.int64)
+        buffer.append(elapsed_ns)
+
+    def count(self, event, n=1):
+        """
+        Increment an event counter
+        """
+        self.counters_[event] = self.counters_.get(event, 0) + n
+
+    def record_innovation(self, y, S):
+        """
+        Record the innovation of one update
+
+        Args:
+            y: innovation z - H*x
+            S: innovation covariance H*P*H^T + R
+        """
+        y = np.reshape(y, -1)
+        self.innovation_norm_.append(np.sqrt(y @ y))
+        # Normalized innovation squared: y^T*S^(-1)*y
+        self.nis_.append(y @ np.linalg.solve(S, y))
+
+    def reset(self):
+        """
+        Drop all recorded values and counters
+        """
+        self.timings_.clear()
+        self.counters_.clear()
+        self.innovation_norm_.clear()
+        self.nis_.clear()
+
+    def snapshot(self):
+        """
+        Aggregate the recorded values
+
+        Returns:
+            InstrumentationSnapshot
+        """
+        stages = {}
+        for stage, buffer in self.timings_.items():
+            values = buffer.values()
+            p50, p99 = np.percentile(values, [50, 99])
+            stages[stage] = StageSnapshot(
+                buffer.total_, int(values.sum()), float(p50), float(p99), int(values.max()),
+                Histogram(LATENCY_BIN_EDGES_NS, np.histogram(values, LATENCY_BIN_EDGES_NS)[0]),
+            )
+
+        innovation_norm = self.innovation_norm_.values()
+        nis = self.nis_.values()
+        return InstrumentationSnapshot(
+            dict(self.counters_),
+            stages,
+            Histogram(INNOVATION_BIN_EDGES, np.histogram(innovation_norm, INNOVATION_BIN_EDGES)[0]),
+            Histogram(NIS_BIN_EDGES, np.histogram(nis, NIS_BIN_EDGES)[0]),
+            float(nis.mean()) if nis.size else float("nan"),
+        )
@@ -2,15 +2,142 @@
 Kalman Filter implementation in Python
 Equivalent to the C++ kalman_filter.h and kalman_filter.cpp
 """
+import functools
+
 import numpy as np
 
 
+@functools.lru_cache(maxsize=None)
+def packed_covariance_indices(n):
+    """
+    Row-major upper-triangle indices (rows, cols) of an n x n matrix, the
+    entry order of pack_covariance; built once per n, read-only
+    """
+    rows, cols = np.triu_indices(n)
+    rows.setflags(write=False)
+    cols.setflags(write=False)
+    return rows, cols
+
+
+def pack_covariance(P):
+    """
+    Pack symmetric covariance matrices into their upper-triangular entries
+    
+    Args:
+        P: covariance matrices, shape (..., n, n)
+    
+    Returns:
+        array of shape (..., n*(n+1)/2), row-major upper triangle
+    """
+    rows, cols = packed_covariance_indices(P.shape[-1])
+    return P[..., rows, cols]
+
+
+def unpack_covariance(packed, n=4):
+    """
+    Rebuild symmetric covariance matrices from pack_covariance output
+    
+    Args:
+        packed: packed upper triangles, shape (..., n*(n+1)/2)
+        n: state dimension
+    
+    Returns:
+        array of shape (..., n, n)
+    """
+    rows, cols = packed_covariance_indices(n)
+    P = np.empty(packed.shape[:-1] + (n, n), dtype=packed.dtype)
+    P[..., rows, cols] = packed
+    P[..., cols, rows] = packed
+    return P
+
+
+def solve_spd_batch(S, rhs):
+    """
+    Solve S*W = rhs for a batch of small symmetric positive definite S
+    
+    Gauss-Jordan elimination on a (k, k + r, N) structure-of-arrays copy:
+    every elimination step is one vectorized operation over the batch, which
+    for k = 4 is several times faster than the per-matrix LAPACK loop of
+    np.linalg.solve (S is positive definite, so no pivoting is needed).
+    
+    Args:
+        S: matrices, (..., k, k)
+        rhs: right-hand sides, (..., k, r)
+    
+    Returns:
+        W, (..., k, r), in the dtype of S and rhs
+    """
+    k = S.shape[-1]
+    batch = S.shape[:-2]
+    M = np.concatenate([S, rhs], axis=-1).reshape(-1, k, k + rhs.shape[-1])
+    M = np.ascontiguousarray(np.moveaxis(M, 0, -1))
+    for i in range(k):
+        M[i] /= M[i, i]
+        for j in range(k):
+            if j != i:
+                M[j] -= M[j, i] * M[i]
+    return np.moveaxis(M[:, k:], -1, 0).reshape(batch + (k, rhs.shape[-1]))
+
+
+def information_update(x, P, y, H, R):
+    """
+    Update with a block of m measurements in information form
+    
+    With the information I = H^T*R^(-1)*H and i = H^T*R^(-1)*y,
+    P = (P^(-1) + I)^(-1) = (E + P*I)^(-1)*P and x = x + P*i, so only an
+    n x n system is solved and the cost is linear in m.
+    
+    Args:
+        x: state vector, (n,)
+        P: error covariance matrix, (n, n)
+        y: innovation, (m,)
+        H: measurement matrix (Jacobian), (m, n)
+        R: measurement noise, a variance, variances (m,) or covariance (m, m)
+    
+    Returns:
+        (x, P) after the update
+    """
+    R = np.asarray(R, dtype=float)
+    Hy = np.column_stack([H, y])
+    if R.ndim == 2:
+        weighted = np.linalg.solve(R, Hy)
+    else:
+        weighted = Hy / R[..., None]
+    # [I | i] in one product
+    information = H.T @ weighted
+    
+    P = np.linalg.solve(np.eye(P.shape[0]) + P @ information[:, :-1], P)
+    P = 0.5 * (P + P.T)
+    return x + P @ information[:, -1], P
+
+
 class KalmanFilter:
     """
     Standard Kalman Filter implementation
+    
+    With use_workspace=True the filter owns its state buffers and all
+    intermediates of predict/update are preallocated once and written in
+    place, so the hot path does not allocate (apart from the LAPACK
+    inverse/solve of S in the update step).
+    
+    The update engine is chosen by update_method:
+        "inverse":    S^(-1) and P = (I - K*H)*P, as in the C++ version
+        "solve":      K from a linear solve with S, no explicit inverse
+        "sequential": one scalar update per measurement row (diagonal R only)
+        "auto":       "solve" when H is the identity, otherwise "inverse"
+    The "solve" and "sequential" engines keep P exactly symmetric; with
+    joseph_form=True the "solve" engine uses the Joseph form
+    P = (I - K*H)*P*(I - K*H)^T + K*R*K^T, which also keeps P positive
+    definite when the gain is inexact.
+    
+    An optional FilterInstrumentation records the "predict" and "update"
+    stage times and the innovation/NIS of every update.
     """
     
-    def __init__(self, A, B, H, P, Q, R, x, u):
+    UPDATE_METHODS = ("auto", "inverse", "solve", "sequential")
+    
+    def __init__(self, A, B, H, P, Q, R, x, u, use_workspace=False, log_hook=None,
+                 update_method="auto", joseph_form=False, instrumentation=None):
         """
         Initialize Kalman Filter
         
@@ -23,7 +150,16 @@ class KalmanFilter:
             R: measurement noise covariance matrix
             x: state vector
             u: control vector
+            use_workspace: preallocate buffers and run predict/update in place
+            log_hook: optional callable log_hook(stage, x) invoked after each
+                      step, e.g. to reproduce the C++ "predict x_" trace
+            update_method: "auto", "inverse", "solve" or "sequential"
+            joseph_form: use the Joseph form covariance update in "solve"
+            instrumentation: optional FilterInstrumentation
         """
+        if update_method not in self.UPDATE_METHODS:
+            raise ValueError(f"unknown update_method: {update_method}")
+
         self.F_ = A  # state transition matrix
         self.B_ = B  # control matrix
         self.H_ = H  # measurement matrix
@@ -32,25 +168,183 @@ class KalmanFilter:
         self.R_ = R  # measurement noise covariance matrix
         self.x_ = x  # state vector
         self.u_ = u  # control vector
+        self.log_hook_ = log_hook
+        self.use_workspace_ = use_workspace
+        self.update_method_ = update_method
+        self.joseph_form_ = joseph_form
+        self.instrumentation_ = instrumentation
+        
+        # Structure of the measurement model, refreshed when H_ or R_ change
+        self._model_H = None
+        self._model_R = None
+        self._h_identity = False
+        self._r_diagonal = None
+        self._ws_n = None
+        
+        if use_workspace:
+            # The filter owns x_ and P_ so they can be updated in place
+            self.x_ = np.array(x, dtype=float).reshape(-1)
+            self.P_ = np.array(P, dtype=float)
+            self._allocate_workspace()
+    
+    def _allocate_workspace(self):
+        """
+        Allocate the buffers used by the in-place predict/update
+        """
+        n = self.x_.shape[0]
+        k = self.H_.shape[0]
+        self._ws_x = np.empty(n)  # F*x and K*y
+        self._ws_bu = np.empty((n, 1))  # B*u
+        self._ws_nn = np.empty((n, n))  # F*P and (I - K*H)*P
+        self._ws_hx = np.empty(k)  # H*x
+        self._ws_y = np.empty(k)  # innovation
+        self._ws_hp = np.empty((k, n))  # H*P
+        self._ws_s = np.empty((k, k))  # innovation covariance
+        self._ws_pht = np.empty((n, k))  # P*H^T
+        self._ws_k = np.empty((n, k))  # Kalman gain
+        self._ws_ikh = np.empty((n, n))  # I - K*H
+        self._ws_kr = np.empty((n, k))  # K*R
+        self._ws_p = np.empty(n)  # P*h^T of one measurement row
+        self._ws_eye = np.eye(n)
+        self._ws_n = (n, k)
+    
+    def set_model(self, F, B, u):
+        """
+        Replace the motion model used by the predict step
+        
+        Args:
+            F: state transition matrix
+            B: control matrix
+            u: control vector
+        """
+        self.F_ = F
+        self.B_ = B
+        self.u_ = u
+    
+    def set_process_noise(self, Q):
+        """
+        Replace the process noise covariance used by the predict step
+        
+        Args:
+            Q: process noise covariance matrix
+        """
+        self.Q_ = Q
+    
+    def set_measurement_noise(self, R):
+        """
+        Replace the measurement noise covariance used by the update step
+        
+        Args:
+            R: measurement noise covariance matrix
+        """
+        self.R_ = R
+    
+    def load_state(self, x, P):
+        """
+        Load state vector and covariance into the filter
+        
+        Args:
+            x: state vector
+            P: error covariance matrix
+        """
+        if self.use_workspace_:
+            np.copyto(self.x_, np.reshape(x, -1))
+            np.copyto(self.P_, P)
+        else:
+            self.x_ = np.array(x, dtype=float)
+            self.P_ = np.array(P, dtype=float)
+    
+    def store_state(self, x, P):
+        """
+        Copy state vector and covariance out of the filter
+        
+        Args:
+            x: state vector (output)
+            P: error covariance matrix (output)
+        """
+        x[:] = self.x_[:x.shape[0]]
+        P[:] = self.P_
     
     def predict(self):
         """
         Predict step of Kalman Filter
         """
-        # State prediction: x = F*x + B*u
-        # Ensure x_ is a column vector for matrix operations
-        if self.x_.ndim == 1:
-            x_col = self.x_.reshape(-1, 1)
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+        
+        if self.use_workspace_:
+            self._predict_in_place()
         else:
-            x_col = self.x_
+            # State prediction: x = F*x + B*u
+            # Ensure x_ is a column vector for matrix operations
+            if self.x_.ndim == 1:
+                x_col = self.x_.reshape(-1, 1)
+            else:
+                x_col = self.x_
+                
+            result = self.F_ @ x_col + self.B_ @ self.u_
+            self.x_ = result.flatten()  # Convert back to 1D array
             
-        result = self.F_ @ x_col + self.B_ @ self.u_
-        self.x_ = result.flatten()  # Convert back to 1D array
-        print(f"predict x_: {self.x_}")
+            # Covariance prediction: P = F*P*F^T + Q
+            F_transpose = self.F_.T
+            self.P_ = self.F_ @ self.P_ @ F_transpose + self.Q_
+        
+        if instrumentation is not None:
+            instrumentation.record_time("predict", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("predict", self.x_)
+    
+    def _predict_in_place(self):
+        """
+        Predict step written into the preallocated workspace
+        """
+        # State prediction: x = F*x + B*u
+        np.matmul(self.F_, self.x_, out=self._ws_x)
+        np.matmul(self.B_, self.u_, out=self._ws_bu)
+        np.add(self._ws_x, self._ws_bu[:, 0], out=self.x_)
         
         # Covariance prediction: P = F*P*F^T + Q
-        F_transpose = self.F_.T
-        self.P_ = self.F_ @ self.P_ @ F_transpose + self.Q_
+        np.matmul(self.F_, self.P_, out=self._ws_nn)
+        np.matmul(self._ws_nn, self.F_.T, out=self.P_)
+        np.add(self.P_, self.Q_, out=self.P_)
+    
+    def _classify_measurement_model(self):
+        """
+        Detect identity H and diagonal R; cached until H_ or R_ is replaced
+        """
+        if self._model_H is self.H_ and self._model_R is self.R_:
+            return
+        H = np.asarray(self.H_)
+        R = np.asarray(self.R_)
+        self._h_identity = H.shape[0] == H.shape[1] and np.array_equal(H, np.eye(H.shape[0]))
+        r_diag = np.diag(R).copy()
+        self._r_diagonal = r_diag if np.array_equal(R, np.diag(r_diag)) else None
+        self._model_H = self.H_
+        self._model_R = self.R_
+    
+    def resolved_update_method(self):
+        """
+        Update engine used for the current H_ and R_
+        """
+        self._classify_measurement_model()
+        if self.update_method_ == "auto":
+            return "solve" if self._h_identity else "inverse"
+        if self.update_method_ == "sequential" and self._r_diagonal is None:
+            raise ValueError("sequential update requires a diagonal R")
+        return self.update_method_
+    
+    def _writable_state(self):
+        """
+        State and covariance the update engines may modify in place
+        """
+        if (self._ws_n is None or self._ws_n[0] != np.size(self.x_)
+                or self._ws_n[1] != self.H_.shape[0]):
+            self._allocate_workspace()
+        if not self.use_workspace_:
+            self.x_ = np.array(self.x_, dtype=float).reshape(-1)
+            self.P_ = np.array(self.P_, dtype=float)
+        return self.x_, self.P_
     
     def update(self, z):
         """
@@ -59,35 +353,456 @@ class KalmanFilter:
         Args:
             z: measurement vector
         """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            instrumentation.record_innovation(*self.innovation(z))
+            instrumentation.count("updates")
+            start = instrumentation.clock_()
+        
+        method = self.resolved_update_method()
+        if method == "solve":
+            self._update_solve(z)
+        elif method == "sequential":
+            self._update_sequential(z)
+        elif self.use_workspace_:
+            self._update_in_place(z)
+        else:
+            # Innovation: y = z - H*x
+            y = z - self.H_ @ self.x_
+            
+            # Innovation covariance: S = H*P*H^T + R
+            H_transpose = self.H_.T
+            S = self.H_ @ self.P_ @ H_transpose + self.R_
+            
+            # Kalman gain: K = P*H^T*S^(-1)
+            S_inv = np.linalg.inv(S)
+            K = self.P_ @ H_transpose @ S_inv
+            
+            # State update: x = x + K*y
+            # Ensure y is a column vector for matrix operations
+            if y.ndim == 1:
+                y_col = y.reshape(-1, 1)
+            else:
+                y_col = y
+                
+            update_term = K @ y_col
+            self.x_ = self.x_ + update_term.flatten()
+            
+            # Covariance update: P = (I - K*H)*P
+            x_size = self.x_.shape[0]  # Use shape[0] instead of size
+            I = np.eye(x_size)
+            self.P_ = (I - K @ self.H_) @ self.P_
+        
+        if instrumentation is not None:
+            instrumentation.record_time("update", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("update", self.x_)
+    
+    def innovation(self, z):
+        """
+        Innovation of a measurement against the current state
+        
+        Args:
+            z: measurement vector
+        
+        Returns:
+            (y, S) with y = z - H*x and S = H*P*H^T + R
+        """
+        y = np.reshape(z, -1) - self.H_ @ np.reshape(self.x_, -1)
+        S = self.H_ @ self.P_ @ self.H_.T + self.R_
+        return y, S
+    
+    def _update_in_place(self, z):
+        """
+        Update step written into the preallocated workspace
+        """
         # Innovation: y = z - H*x
-        y = z - self.H_ @ self.x_
+        np.matmul(self.H_, self.x_, out=self._ws_hx)
+        np.subtract(np.reshape(z, -1), self._ws_hx, out=self._ws_y)
         
         # Innovation covariance: S = H*P*H^T + R
-        H_transpose = self.H_.T
-        S = self.H_ @ self.P_ @ H_transpose + self.R_
+        np.matmul(self.H_, self.P_, out=self._ws_hp)
+        np.matmul(self._ws_hp, self.H_.T, out=self._ws_s)
+        np.add(self._ws_s, self.R_, out=self._ws_s)
         
         # Kalman gain: K = P*H^T*S^(-1)
-        S_inv = np.linalg.inv(S)
-        K = self.P_ @ H_transpose @ S_inv
+        np.matmul(self.P_, self.H_.T, out=self._ws_pht)
+        np.matmul(self._ws_pht, np.linalg.inv(self._ws_s), out=self._ws_k)
         
         # State update: x = x + K*y
-        # Ensure y is a column vector for matrix operations
-        if y.ndim == 1:
-            y_col = y.reshape(-1, 1)
+        np.matmul(self._ws_k, self._ws_y, out=self._ws_x)
+        np.add(self.x_, self._ws_x, out=self.x_)
+        
+        # Covariance update: P = (I - K*H)*P
+        np.matmul(self._ws_k, self.H_, out=self._ws_ikh)
+        np.subtract(self._ws_eye, self._ws_ikh, out=self._ws_ikh)
+        np.matmul(self._ws_ikh, self.P_, out=self._ws_nn)
+        np.copyto(self.P_, self._ws_nn)
+    
+    def _update_solve(self, z):
+        """
+        Update step with the gain from a linear solve instead of S^(-1)
+        
+        Uses W = S^(-1)*H*P, so that K = W^T for a symmetric P.
+        """
+        x, P = self._writable_state()
+        z = np.reshape(z, -1)
+        
+        # Innovation y = z - H*x, cross term H*P and S = H*P*H^T + R
+        if self._h_identity:
+            np.subtract(z, x, out=self._ws_y)
+            np.copyto(self._ws_hp, P)
+            np.add(P, self.R_, out=self._ws_s)
         else:
-            y_col = y
+            np.matmul(self.H_, x, out=self._ws_hx)
+            np.subtract(z, self._ws_hx, out=self._ws_y)
+            np.matmul(self.H_, P, out=self._ws_hp)
+            np.matmul(self._ws_hp, self.H_.T, out=self._ws_s)
+            np.add(self._ws_s, self.R_, out=self._ws_s)
+        
+        # Kalman gain: K = W^T with S*W = H*P
+        W = np.linalg.solve(self._ws_s, self._ws_hp)
+        K = W.T
+        
+        # State update: x = x + K*y
+        np.matmul(self._ws_y, W, out=self._ws_x)
+        np.add(x, self._ws_x, out=x)
+        
+        if self.joseph_form_:
+            # P = (I - K*H)*P*(I - K*H)^T + K*R*K^T
+            if self._h_identity:
+                np.subtract(self._ws_eye, K, out=self._ws_ikh)
+            else:
+                np.matmul(K, self.H_, out=self._ws_ikh)
+                np.subtract(self._ws_eye, self._ws_ikh, out=self._ws_ikh)
+            np.matmul(self._ws_ikh, P, out=self._ws_nn)
+            np.matmul(self._ws_nn, self._ws_ikh.T, out=P)
+            np.matmul(K, self.R_, out=self._ws_kr)
+            np.matmul(self._ws_kr, W, out=self._ws_nn)
+            np.add(P, self._ws_nn, out=P)
+        else:
+            # P = P - (H*P)^T*S^(-1)*(H*P)
+            np.matmul(self._ws_hp.T, W, out=self._ws_nn)
+            np.subtract(P, self._ws_nn, out=P)
+        
+        self._symmetrize(P)
+    
+    def _update_sequential(self, z):
+        """
+        Update step as one scalar update per measurement row (diagonal R)
+        
+        Each row i is fused on its own with p = P*h_i^T, s = h_i*p + r_i:
+        x = x + p*(z_i - h_i*x)/s and P = P - p*p^T/s.
+        """
+        x, P = self._writable_state()
+        z = np.reshape(z, -1)
+        r = self._r_diagonal
+        p = self._ws_p
+        
+        for i in range(z.shape[0]):
+            if self._h_identity:
+                np.copyto(p, P[:, i])
+                s = p[i] + r[i]
+                y = z[i] - x[i]
+            else:
+                h = self.H_[i]
+                np.matmul(P, h, out=p)
+                s = h @ p + r[i]
+                y = z[i] - h @ x
             
-        update_term = K @ y_col
-        self.x_ = self.x_ + update_term.flatten()
+            np.multiply(p, y / s, out=self._ws_x)
+            np.add(x, self._ws_x, out=x)
+            np.outer(p, p, out=self._ws_nn)
+            np.divide(self._ws_nn, s, out=self._ws_nn)
+            np.subtract(P, self._ws_nn, out=P)
+        
+        self._symmetrize(P)
+    
+    def _symmetrize(self, P):
+        """
+        Replace P by (P + P^T)/2 in place
+        """
+        np.add(P, P.T, out=self._ws_nn)
+        np.multiply(self._ws_nn, 0.5, out=P)
+    
+    def update_ekf(self, z, h, jacobian, R):
+        """
+        Extended Kalman Filter update with a block of measurements
+        
+        The measurement model is linearized once at the predicted state and
+        all m measurements are fused together in information form, see
+        information_update. m may change from call to call.
+        
+        Args:
+            z: measurements, (m,)
+            h: measurement function, h(x) -> (m,)
+            jacobian: Jacobian of h, jacobian(x) -> (m, n)
+            R: measurement noise, a variance, variances (m,) or covariance (m, m)
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            instrumentation.count("updates")
+            start = instrumentation.clock_()
+        
+        x = np.ravel(self.x_).astype(float)
+        # Innovation: y = z - h(x), with H = dh/dx at the predicted state
+        y = np.ravel(z) - np.ravel(h(x))
+        x, P = information_update(x, np.asarray(self.P_, dtype=float), y, np.asarray(jacobian(x), dtype=float), R)
+        self.load_state(x.reshape(np.shape(self.x_)), P)
+        
+        if instrumentation is not None:
+            instrumentation.record_time("update", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("update", self.x_)
+
+
+class KalmanFilterBank:
+    """
+    Bank of N independent Kalman Filters with a shared state layout
+    
+    States are stacked as (N, n) and covariances as (N, n, n) so that
+    predict/update run for every filter in one batched NumPy call.
+    Model matrices may be shared by all filters ((n, n), (n, m), ...) or
+    given per filter with a leading N axis ((N, n, n), (N, n, m), ...).
+    
+    update_method and joseph_form select the same update engines as
+    KalmanFilter, applied to all filters at once.
+    
+    dtype selects the storage precision of states, covariances and model
+    matrices. With float32 the bank moves half the memory per step; the
+    "solve" engine still accumulates the covariance update in float64
+    before rounding P back to float32.
+    """
+    
+    # Smallest batch for which reduced-precision banks use solve_spd_batch
+    SPD_BATCH_MIN = 128
+    
+    def __init__(self, A, B, H, P, Q, R, x, u, update_method="auto", joseph_form=False,
+                 dtype=np.float64):
+        """
+        Initialize Kalman Filter bank
+        
+        Args:
+            A: state transition matrix, (n, n) or (N, n, n)
+            B: control matrix, (n, m) or (N, n, m)
+            H: measurement matrix, (k, n) or (N, k, n)
+            P: error covariance matrices, (N, n, n)
+            Q: process noise covariance matrix, (n, n) or (N, n, n)
+            R: measurement noise covariance matrix, (k, k) or (N, k, k)
+            x: state vectors, (N, n)
+            u: control vector, (m,) / (m, 1) shared or (N, m) per filter
+            update_method: "auto", "inverse", "solve" or "sequential"
+            joseph_form: use the Joseph form covariance update in "solve"
+            dtype: storage precision, np.float64 or np.float32
+        """
+        if update_method not in KalmanFilter.UPDATE_METHODS:
+            raise ValueError(f"unknown update_method: {update_method}")
+        self.update_method_ = update_method
+        self.joseph_form_ = joseph_form
+        self.dtype_ = np.dtype(dtype)
+        self.F_ = np.asarray(A, dtype=self.dtype_)  # state transition matrix
+        self.B_ = np.asarray(B, dtype=self.dtype_)  # control matrix
+        self.H_ = np.asarray(H, dtype=self.dtype_)  # measurement matrix
+        self.Q_ = np.asarray(Q, dtype=self.dtype_)  # process noise covariance matrix
+        self.R_ = np.asarray(R, dtype=self.dtype_)  # measurement noise covariance matrix
+        self.x_ = np.array(x, dtype=self.dtype_)  # state vectors (N, n)
+        self.P_ = np.array(P, dtype=self.dtype_)  # error covariance matrices (N, n, n)
+        self.u_ = self._normalize_control(u)  # control vectors (N, m)
+    
+    @classmethod
+    def from_filters(cls, filters, **kwargs):
+        """
+        Stack a sequence of KalmanFilter instances into one bank
+        
+        Model matrices are taken per filter, so the filters may use
+        different motion models (e.g. different speeds).
+        
+        Args:
+            filters: sequence of KalmanFilter
+            kwargs: update_method / joseph_form / dtype for the bank
+        """
+        return cls(
+            np.stack([kf.F_ for kf in filters]),
+            np.stack([kf.B_ for kf in filters]),
+            np.stack([kf.H_ for kf in filters]),
+            np.stack([kf.P_ for kf in filters]),
+            np.stack([kf.Q_ for kf in filters]),
+            np.stack([kf.R_ for kf in filters]),
+            np.stack([np.ravel(kf.x_) for kf in filters]),
+            np.stack([np.ravel(kf.u_) for kf in filters]),
+            **kwargs
+        )
+    
+    @property
+    def size(self):
+        """
+        Number of filters in the bank
+        """
+        return self.x_.shape[0]
+    
+    def _normalize_control(self, u):
+        """
+        Convert a shared or per-filter control input to (N, m)
+        """
+        u = np.asarray(u, dtype=self.dtype_)
+        if u.ndim == 2 and u.shape[0] == self.x_.shape[0] and u.shape[1] == self.B_.shape[-1]:
+            return u.copy()
+        return np.tile(u.reshape(-1), (self.x_.shape[0], 1))
+    
+    def set_control(self, u):
+        """
+        Set the control input for all filters
+        
+        Args:
+            u: control vector, (m,) / (m, 1) shared or (N, m) per filter
+        """
+        self.u_ = self._normalize_control(u)
+    
+    def set_measurement_noise(self, R):
+        """
+        Set the measurement noise covariance for all filters
+        
+        Args:
+            R: measurement noise covariance, (k, k) shared or (N, k, k) per filter
+        """
+        self.R_ = np.asarray(R, dtype=self.dtype_)
+    
+    @staticmethod
+    def _select(matrix, index):
+        """
+        Select per-filter model matrices; shared matrices pass through
+        """
+        if matrix.ndim == 3:
+            return matrix[index]
+        return matrix
+    
+    def predict(self):
+        """
+        Predict step for all filters
+        """
+        # State prediction: x = F*x + B*u
+        Fx = np.matmul(self.F_, self.x_[..., None])
+        Bu = np.matmul(self.B_, self.u_[..., None])
+        self.x_ = (Fx + Bu)[..., 0]
+        
+        # Covariance prediction: P = F*P*F^T + Q
+        F_transpose = np.swapaxes(self.F_, -1, -2)
+        self.P_ = self.F_ @ self.P_ @ F_transpose + self.Q_
+    
+    def update(self, z, mask=None):
+        """
+        Update step for all filters with an available measurement
+        
+        Args:
+            z: measurement vectors, (N, k)
+            mask: optional (N,) boolean array; filters where it is False
+                  have no measurement this frame and keep their predicted state
+        """
+        z = np.asarray(z, dtype=self.dtype_)
+        if mask is None:
+            index = slice(None)
+        else:
+            index = np.flatnonzero(mask)
+            if index.size == 0:
+                return
+            z = z[index]
+        
+        H = self._select(self.H_, index)
+        R = self._select(self.R_, index)
+        x = self.x_[index]
+        P = self.P_[index]
+        
+        method = self.resolved_update_method()
+        if method == "solve":
+            x, P = self._update_solve(H, R, x, P, z)
+        elif method == "sequential":
+            x, P = self._update_sequential(H, R, x, P, z)
+        else:
+            x, P = self._update_inverse(H, R, x, P, z)
+        self.x_[index] = x
+        self.P_[index] = P
+    
+    def resolved_update_method(self):
+        """
+        Update engine used for the current H_ and R_
+        """
+        h_identity = (self.H_.shape[-1] == self.H_.shape[-2]
+                      and bool(np.all(self.H_ == np.eye(self.H_.shape[-1]))))
+        if self.update_method_ == "auto":
+            return "solve" if h_identity else "inverse"
+        if self.update_method_ == "sequential":
+            r_diag = np.diagonal(self.R_, axis1=-2, axis2=-1)
+            if not np.array_equal(self.R_, r_diag[..., None] * np.eye(self.R_.shape[-1])):
+                raise ValueError("sequential update requires a diagonal R")
+        return self.update_method_
+    
+    @staticmethod
+    def _update_inverse(H, R, x, P, z):
+        """
+        Batched update with S^(-1), as in KalmanFilter "inverse"
+        """
+        # Innovation: y = z - H*x
+        y = z - np.matmul(H, x[..., None])[..., 0]
+        
+        # Innovation covariance: S = H*P*H^T + R
+        H_transpose = np.swapaxes(H, -1, -2)
+        S = H @ P @ H_transpose + R
+        
+        # Kalman gain: K = P*H^T*S^(-1)
+        S_inv = np.linalg.inv(S)
+        K = P @ H_transpose @ S_inv
+        
+        # State update: x = x + K*y
+        x = x + np.matmul(K, y[..., None])[..., 0]
         
         # Covariance update: P = (I - K*H)*P
-        x_size = self.x_.shape[0]  # Use shape[0] instead of size
-        I = np.eye(x_size)
-        self.P_ = (I - K @ self.H_) @ self.P_
+        I = np.eye(x.shape[-1])
+        return x, (I - K @ H) @ P
+    
+    def _update_solve(self, H, R, x, P, z):
+        """
+        Batched update with the gain from a linear solve, as in KalmanFilter "solve"
+        """
+        # Innovation y = z - H*x, cross term H*P and S = H*P*H^T + R
+        y = z - np.matmul(H, x[..., None])[..., 0]
+        HP = H @ P
+        S = HP @ np.swapaxes(H, -1, -2) + R
+        
+        # Kalman gain: K = W^T with S*W = H*P; LAPACK has no float32 advantage
+        # for tiny systems, the vectorized elimination does for large batches
+        if self.dtype_ == np.float64 or S.shape[0] < self.SPD_BATCH_MIN:
+            W = np.linalg.solve(S, HP)
+        else:
+            W = solve_spd_batch(S, HP)
+        
+        # State update: x = x + K*y
+        x = x + np.matmul(y[..., None, :], W)[..., 0, :]
+        
+        # Covariance update accumulated in float64, rounded to dtype_ on store
+        HP, W, P, H, R = (np.asarray(a, dtype=np.float64) for a in (HP, W, P, H, R))
+        K = np.swapaxes(W, -1, -2)
+        if self.joseph_form_:
+            # P = (I - K*H)*P*(I - K*H)^T + K*R*K^T
+            A = np.eye(x.shape[-1]) - K @ H
+            P = A @ P @ np.swapaxes(A, -1, -2) + K @ R @ W
+        else:
+            # P = P - (H*P)^T*S^(-1)*(H*P)
+            P = P - np.swapaxes(HP, -1, -2) @ W
+        return x, 0.5 * (P + np.swapaxes(P, -1, -2))
     
-    def update_ekf(self, z):
+    @staticmethod
+    def _update_sequential(H, R, x, P, z):
         """
-        Extended Kalman Filter update (placeholder for future implementation)
+        Batched scalar updates per measurement row, as in KalmanFilter "sequential"
         """
-        # TODO: implement Extended Kalman Filter equations
-        pass 
\ No newline at end of file
+        x = x.copy()
+        P = P.copy()
+        r = np.diagonal(R, axis1=-2, axis2=-1)
+        for i in range(z.shape[-1]):
+            h = H[..., i, :]
+            p = np.matmul(P, h[..., None])[..., 0]
+            s = np.sum(h * p, axis=-1) + r[..., i]
+            y = z[:, i] - np.sum(h * x, axis=-1)
+            x += p * (y / s)[:, None]
+            P -= p[:, :, None] * p[:, None, :] / s[:, None, None]
+        return x, 0.5 * (P + np.swapaxes(P, -1, -2))
@@ -0,0 +1,91 @@
+"""
+Batched evaluation of lane curves y = c0 + c1*x + c2*x^2 + c3*x^3
+Evaluates many lanes at many look-ahead positions, optionally with the
+1-sigma lateral uncertainty from the filter covariance
+"""
+import functools
+from collections import namedtuple
+
+import numpy as np
+from estimate_lane_param import LaneParamBatch, LaneParamInfo
+from kalman_filter import pack_covariance, packed_covariance_indices
+
+
+LaneGrid = namedtuple("LaneGrid", ["x", "basis", "quadratic_basis"])
+LaneGrid.__doc__ = """
+Look-ahead positions with their precomputed evaluation bases
+
+x: positions, (M,)
+basis: phi(x) = [1, x, x^2, x^3] per position, (M, 4)
+quadratic_basis: phi_i*phi_j for the packed upper triangle of P, with
+                 off-diagonal terms doubled, (M, 10); packed P times this
+                 basis gives phi^T*P*phi
+"""
+
+
+def make_grid(x):
+    """
+    Build the evaluation bases for arbitrary look-ahead positions
+
+    Args:
+        x: positions, (M,)
+
+    Returns:
+        LaneGrid with read-only arrays
+    """
+    x = np.array(x, dtype=float).reshape(-1)
+    basis = np.stack([np.ones_like(x), x, x * x, x * x * x], axis=1)
+    rows, cols = packed_covariance_indices(4)
+    quadratic_basis = basis[:, rows] * basis[:, cols] * np.where(rows == cols, 1.0, 2.0)
+    for array in (x, basis, quadratic_basis):
+        array.setflags(write=False)
+    return LaneGrid(x, basis, quadratic_basis)
+
+
+@functools.lru_cache(maxsize=64)
+def lane_grid(stop, count, start=0.0):
+    """
+    Cached grid of `count` evenly spaced positions from start to stop
+
+    Repeated calls with the same arguments return the same LaneGrid.
+    """
+    return make_grid(np.linspace(start, stop, count))
+
+
+def _states(lanes):
+    """
+    Coefficients of LaneParamInfo, LaneParamBatch or stacked states as (..., 4)
+    """
+    if isinstance(lanes, LaneParamInfo):
+        return lanes.as_array()
+    if isinstance(lanes, LaneParamBatch):
+        return lanes.states()
+    return np.asarray(lanes, dtype=float)
+
+
+def evaluate_lanes(lanes, grid, matrix_P=None):
+    """
+    Evaluate lane curves at look-ahead positions
+
+    With the power basis of the grid precomputed, the polynomial is one
+    batched product y = [c0, c1, c2, c3] * phi(x)^T, and the lateral
+    variance phi^T*P*phi is the packed P times the quadratic basis.
+
+    Args:
+        lanes: LaneParamInfo, LaneParamBatch or states (..., 4)
+        grid: LaneGrid (e.g. from lane_grid) or positions (M,)
+        matrix_P: optional error covariance matrices (..., 4, 4) of the lanes
+
+    Returns:
+        (y (..., M), sigma (..., M) or None)
+    """
+    if not isinstance(grid, LaneGrid):
+        grid = make_grid(grid)
+    y = _states(lanes) @ grid.basis.T
+    if matrix_P is None:
+        return y, None
+    # Lateral variance phi^T*P*phi, clipped at 0 against rounding; in place
+    sigma = pack_covariance(np.asarray(matrix_P, dtype=float)) @ grid.quadratic_basis.T
+    np.maximum(sigma, 0.0, out=sigma)
+    np.sqrt(sigma, out=sigma)
+    return y, sigma
@@ -0,0 +1,336 @@
+"""
+Scalar-unrolled Kalman Filter for the 4-state lane model
+Same interface as KalmanFilter, specialized to the estimateLaneParam model:
+upper-triangular Toeplitz F, H = I and diagonal Q and R
+"""
+import numpy as np
+from kalman_filter import information_update
+
+
+def _is_diagonal(M):
+    return np.array_equal(M, np.diag(np.diag(M)))
+
+
+def _floats(v):
+    """
+    Entries of a vector as a list of Python floats
+    """
+    if type(v) is np.ndarray and v.ndim == 1:
+        return v.tolist()
+    return np.ravel(v).astype(float).tolist()
+
+
+class LaneKalmanFilter:
+    """
+    Kalman Filter for one lane on plain Python floats
+
+    For a 4x4 model NumPy's per-call overhead dominates the arithmetic, so
+    this engine keeps x and the 10 unique entries of the symmetric P as
+    floats and writes out F*x, F*P*F^T and the update in closed form.
+
+    F must have the structure built by motion_model.build_motion_matrices,
+        [[1, a, b, c],
+         [0, 1, a, b],
+         [0, 0, 1, a],
+         [0, 0, 0, 1]]
+    H must be the identity and Q and R diagonal. With diagonal R the update
+    is done as four sequential scalar updates, which equals the matrix update.
+    """
+
+    def __init__(self, A, B, H, P, Q, R, x, u, log_hook=None, instrumentation=None):
+        """
+        Initialize the lane Kalman Filter
+
+        Args:
+            A: state transition matrix, upper-triangular Toeplitz (4, 4)
+            B: control matrix (4, 1)
+            H: measurement matrix, must be the identity
+            P: error covariance matrix
+            Q: process noise covariance matrix, diagonal
+            R: measurement noise covariance matrix, diagonal
+            x: state vector
+            u: control vector (1, 1)
+            log_hook: optional callable log_hook(stage, x) invoked after each step
+            instrumentation: optional FilterInstrumentation
+        """
+        H = np.asarray(H)
+        if H.shape != (4, 4) or not np.array_equal(H, np.eye(4)):
+            raise ValueError("LaneKalmanFilter requires H = I (4x4)")
+        if not (_is_diagonal(np.asarray(Q)) and _is_diagonal(np.asarray(R))):
+            raise ValueError("LaneKalmanFilter requires diagonal Q and R")
+
+        self.H_ = H
+        self.Q_ = Q
+        self.R_ = R
+        self.q_ = tuple(np.diag(Q).tolist())
+        self.r_ = tuple(np.diag(R).tolist())
+        self.log_hook_ = log_hook
+        self.instrumentation_ = instrumentation
+
+        self.F_ = None
+        self.set_model(A, B, u)
+        self.load_state(x, P)
+
+    def set_model(self, F, B, u):
+        """
+        Replace the motion model used by the predict step
+
+        Args:
+            F: state transition matrix
+            B: control matrix
+            u: control vector
+        """
+        if F is not self.F_:
+            F = np.asarray(F)
+            a, b, c = F[0, 1:].tolist()
+            if not np.array_equal(F, np.array([[1.0, a, b, c], [0.0, 1.0, a, b],
+                                               [0.0, 0.0, 1.0, a], [0.0, 0.0, 0.0, 1.0]])):
+                raise ValueError("LaneKalmanFilter requires an upper-triangular Toeplitz F")
+            self.F_ = F
+            self.a_, self.b_, self.c_ = a, b, c
+        self.B_ = B
+        self.u_ = u
+        # Control term B*u for the scalar control input
+        w = np.asarray(u).item(0)
+        self.bu_ = tuple(row[0] * w for row in np.asarray(B).tolist())
+
+    def set_process_noise(self, Q):
+        """
+        Replace the process noise covariance used by the predict step
+
+        Args:
+            Q: process noise covariance matrix, diagonal
+        """
+        if not _is_diagonal(np.asarray(Q)):
+            raise ValueError("LaneKalmanFilter requires diagonal Q")
+        self.Q_ = Q
+        self.q_ = tuple(np.diag(Q).tolist())
+
+    def set_measurement_noise(self, R):
+        """
+        Replace the measurement noise covariance used by the update step
+
+        Args:
+            R: measurement noise covariance matrix, diagonal
+        """
+        if not _is_diagonal(np.asarray(R)):
+            raise ValueError("LaneKalmanFilter requires diagonal R")
+        self.R_ = R
+        self.r_ = tuple(np.diag(R).tolist())
+
+    def load_state(self, x, P):
+        """
+        Load state vector and covariance into the filter
+
+        Args:
+            x: state vector
+            P: error covariance matrix
+        """
+        self.state_ = _floats(x)
+        row0, row1, row2, row3 = np.asarray(P).tolist()
+        self.cov_ = row0 + row1[1:] + row2[2:] + row3[3:]
+
+    def store_state(self, x, P):
+        """
+        Copy state vector and covariance out of the filter
+
+        Args:
+            x: state vector (output)
+            P: error covariance matrix (output)
+        """
+        x[:] = self.state_
+        p00, p01, p02, p03, p11, p12, p13, p22, p23, p33 = self.cov_
+        values = [p00, p01, p02, p03, p01, p11, p12, p13, p02, p12, p22, p23, p03, p13, p23, p33]
+        if P.flags.c_contiguous:
+            # ravel() is a view here, and a flat assignment is the cheapest write
+            P.ravel()[:] = values
+        else:
+            P[:] = np.reshape(values, (4, 4))
+
+    @property
+    def x_(self):
+        """
+        State vector as a new array
+        """
+        return np.array(self.state_)
+
+    @property
+    def P_(self):
+        """
+        Error covariance matrix as a new array
+        """
+        P = np.empty((4, 4))
+        self.store_state(np.empty(4), P)
+        return P
+
+    def predict(self):
+        """
+        Predict step of Kalman Filter
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+
+        a, b, c = self.a_, self.b_, self.c_
+        x0, x1, x2, x3 = self.state_
+        p00, p01, p02, p03, p11, p12, p13, p22, p23, p33 = self.cov_
+        q0, q1, q2, q3 = self.q_
+        u0, u1, u2, u3 = self.bu_
+
+        # State prediction: x = F*x + B*u
+        self.state_ = [x0 + a * x1 + b * x2 + c * x3 + u0,
+                       x1 + a * x2 + b * x3 + u1,
+                       x2 + a * x3 + u2,
+                       x3 + u3]
+
+        # M = F*P, upper triangle only (F*P*F^T needs M[i][k] for k >= i)
+        m00 = p00 + a * p01 + b * p02 + c * p03
+        m01 = p01 + a * p11 + b * p12 + c * p13
+        m02 = p02 + a * p12 + b * p22 + c * p23
+        m03 = p03 + a * p13 + b * p23 + c * p33
+        m11 = p11 + a * p12 + b * p13
+        m12 = p12 + a * p22 + b * p23
+        m13 = p13 + a * p23 + b * p33
+        m22 = p22 + a * p23
+        m23 = p23 + a * p33
+
+        # Covariance prediction: P = M*F^T + Q
+        self.cov_ = [
+            m00 + a * m01 + b * m02 + c * m03 + q0,
+            m01 + a * m02 + b * m03,
+            m02 + a * m03,
+            m03,
+            m11 + a * m12 + b * m13 + q1,
+            m12 + a * m13,
+            m13,
+            m22 + a * m23 + q2,
+            m23,
+            p33 + q3,
+        ]
+
+        if instrumentation is not None:
+            instrumentation.record_time("predict", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("predict", self.x_)
+
+    def innovation(self, z):
+        """
+        Innovation of a measurement against the current state
+
+        Returns:
+            (y, S) with y = z - x and S = P + R
+        """
+        return np.ravel(z) - self.x_, self.P_ + self.R_
+
+    def update(self, z):
+        """
+        Update step of Kalman Filter
+
+        Each measurement row i is fused on its own with the column c = P[:, i]
+        and s = P[i, i] + r_i: x = x + c*(z_i - x_i)/s and P = P - c*c^T/s.
+
+        Args:
+            z: measurement vector
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            instrumentation.record_innovation(*self.innovation(z))
+            instrumentation.count("updates")
+            start = instrumentation.clock_()
+
+        z0, z1, z2, z3 = _floats(z)
+        r0, r1, r2, r3 = self.r_
+        x0, x1, x2, x3 = self.state_
+        p00, p01, p02, p03, p11, p12, p13, p22, p23, p33 = self.cov_
+
+        # Row 0: c = (p00, p01, p02, p03)
+        s = p00 + r0
+        k0, k1, k2, k3 = p00 / s, p01 / s, p02 / s, p03 / s
+        y = z0 - x0
+        x0 += k0 * y
+        x1 += k1 * y
+        x2 += k2 * y
+        x3 += k3 * y
+        p11 -= k1 * p01
+        p12 -= k1 * p02
+        p13 -= k1 * p03
+        p22 -= k2 * p02
+        p23 -= k2 * p03
+        p33 -= k3 * p03
+        p00, p01, p02, p03 = p00 - k0 * p00, p01 - k0 * p01, p02 - k0 * p02, p03 - k0 * p03
+
+        # Row 1: c = (p01, p11, p12, p13)
+        s = p11 + r1
+        k0, k1, k2, k3 = p01 / s, p11 / s, p12 / s, p13 / s
+        y = z1 - x1
+        x0 += k0 * y
+        x1 += k1 * y
+        x2 += k2 * y
+        x3 += k3 * y
+        p00 -= k0 * p01
+        p02 -= k0 * p12
+        p03 -= k0 * p13
+        p22 -= k2 * p12
+        p23 -= k2 * p13
+        p33 -= k3 * p13
+        p01, p11, p12, p13 = p01 - k1 * p01, p11 - k1 * p11, p12 - k1 * p12, p13 - k1 * p13
+
+        # Row 2: c = (p02, p12, p22, p23)
+        s = p22 + r2
+        k0, k1, k2, k3 = p02 / s, p12 / s, p22 / s, p23 / s
+        y = z2 - x2
+        x0 += k0 * y
+        x1 += k1 * y
+        x2 += k2 * y
+        x3 += k3 * y
+        p00 -= k0 * p02
+        p01 -= k0 * p12
+        p03 -= k0 * p23
+        p11 -= k1 * p12
+        p13 -= k1 * p23
+        p33 -= k3 * p23
+        p02, p12, p22, p23 = p02 - k2 * p02, p12 - k2 * p12, p22 - k2 * p22, p23 - k2 * p23
+
+        # Row 3: c = (p03, p13, p23, p33)
+        s = p33 + r3
+        k0, k1, k2, k3 = p03 / s, p13 / s, p23 / s, p33 / s
+        y = z3 - x3
+        x0 += k0 * y
+        x1 += k1 * y
+        x2 += k2 * y
+        x3 += k3 * y
+        p00 -= k0 * p03
+        p01 -= k0 * p13
+        p02 -= k0 * p23
+        p11 -= k1 * p13
+        p12 -= k1 * p23
+        p22 -= k2 * p23
+        p03, p13, p23, p33 = p03 - k3 * p03, p13 - k3 * p13, p23 - k3 * p23, p33 - k3 * p33
+
+        self.state_ = [x0, x1, x2, x3]
+        self.cov_ = [p00, p01, p02, p03, p11, p12, p13, p22, p23, p33]
+
+        if instrumentation is not None:
+            instrumentation.record_time("update", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("update", self.x_)
+
+    def update_ekf(self, z, h, jacobian, R):
+        """
+        Extended Kalman Filter update with a block of measurements
+
+        Same as KalmanFilter.update_ekf; the m x 4 block is done with NumPy.
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            instrumentation.count("updates")
+            start = instrumentation.clock_()
+
+        x = np.array(self.state_)
+        y = np.ravel(z) - np.ravel(h(x))
+        self.load_state(*information_update(x, self.P_, y, np.asarray(jacobian(x), dtype=float), R))
+
+        if instrumentation is not None:
+            instrumentation.record_time("update", instrumentation.clock_() - start)
+        if self.log_hook_ is not None:
+            self.log_hook_("update", self.x_)
@@ -0,0 +1,195 @@
+"""
+Memory-mapped binary logs for input frames and output estimates
+
+File layout (all fields little-endian):
+
+    header   64 bytes, HEADER_DTYPE
+             magic    8 bytes  b"LANELOG\\0"
+             version  uint32   FORMAT_VERSION
+             kind     uint32   KIND_FRAMES or KIND_ESTIMATES
+             record   uint32   record size in bytes
+             reserved uint32   0
+             count    uint64   number of records
+             (32 bytes of zero padding)
+    records  count fixed-size records, FRAME_DTYPE or ESTIMATE_DTYPE
+
+Frame record (72 bytes): timestamp, speed, w, look_forward_time (float64),
+z = [c0, c1, c2, c3] (4 x float64), valid (uint8), 7 bytes padding.
+
+Estimate record (120 bytes): timestamp (float64), x = [c0, c1, c2, c3]
+(4 x float64), p_upper = row-major upper triangle of P (10 x float64),
+see kalman_filter.pack_covariance.
+
+Readers return NumPy memmaps, so fields such as records["speed"] are
+views into the file and need no parsing or copying.
+"""
+import numpy as np
+
+
+MAGIC = b"LANELOG\0"
+FORMAT_VERSION = 1
+KIND_FRAMES = 1
+KIND_ESTIMATES = 2
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("kind", "<u4"),
+    ("record", "<u4"),
+    ("reserved", "<u4"),
+    ("count", "<u8"),
+    ("padding", "V32"),
+])
+
+FRAME_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("speed", "<f8"),
+    ("w", "<f8"),
+    ("look_forward_time", "<f8"),
+    ("z", "<f8", (4,)),
+    ("valid", "u1"),
+    ("padding", "V7"),
+])
+
+ESTIMATE_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("x", "<f8", (4,)),
+    ("p_upper", "<f8", (10,)),
+])
+
+_RECORD_DTYPES = {KIND_FRAMES: FRAME_DTYPE, KIND_ESTIMATES: ESTIMATE_DTYPE}
+
+
+def create_log(path, kind, count):
+    """
+    Create a log file and map its records for writing
+
+    Args:
+        path: file path
+        kind: KIND_FRAMES or KIND_ESTIMATES
+        count: number of records
+
+    Returns:
+        writable memmap of `count` records
+    """
+    dtype = _RECORD_DTYPES[kind]
+    header = np.zeros((), dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["kind"] = kind
+    header["record"] = dtype.itemsize
+    header["count"] = count
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        f.truncate(HEADER_DTYPE.itemsize + count * dtype.itemsize)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r+", offset=HEADER_DTYPE.itemsize, shape=(count,))
+
+
+def read_header(path):
+    """
+    Read and validate the header of a log file
+
+    Returns:
+        header as a structured scalar of HEADER_DTYPE
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    # "S8" fields drop trailing NUL bytes on read
+    if header.shape[0] != 1 or header[0]["magic"] != MAGIC.rstrip(b"\0"):
+        raise ValueError(f"{path}: not a lane log")
+    header = header[0]
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported lane log version {header['version']}")
+    dtype = _RECORD_DTYPES.get(int(header["kind"]))
+    if dtype is None or header["record"] != dtype.itemsize:
+        raise ValueError(f"{path}: unknown lane log record kind {header['kind']}")
+    return header
+
+
+def open_log(path, kind, mode="r"):
+    """
+    Memory-map the records of a log file
+
+    Args:
+        path: file path
+        kind: expected KIND_FRAMES or KIND_ESTIMATES
+        mode: "r" for read-only, "r+" for read-write
+
+    Returns:
+        memmap of the records
+    """
+    header = read_header(path)
+    if header["kind"] != kind:
+        raise ValueError(f"{path}: expected lane log kind {kind}, found {header['kind']}")
+    count = int(header["count"])
+    if count == 0:
+        return np.zeros(0, dtype=_RECORD_DTYPES[kind])
+    return np.memmap(path, dtype=_RECORD_DTYPES[kind], mode=mode,
+                     offset=HEADER_DTYPE.itemsize, shape=(count,))
+
+
+def write_frames(path, timestamps, speeds, ws, look_forward_times, matrix_Z, valid):
+    """
+    Write a frame log from per-frame arrays
+
+    Args:
+        path: file path
+        timestamps: shape (T,)
+        speeds: shape (T,)
+        ws: angular velocity, shape (T,)
+        look_forward_times: scalar or shape (T,)
+        matrix_Z: measurements, shape (T, 4)
+        valid: measurement availability, shape (T,)
+    """
+    records = create_log(path, KIND_FRAMES, len(timestamps))
+    records["timestamp"] = timestamps
+    records["speed"] = speeds
+    records["w"] = ws
+    records["look_forward_time"] = look_forward_times
+    records["z"] = matrix_Z
+    records["valid"] = valid
+    if isinstance(records, np.memmap):
+        records.flush()
+
+
+def write_estimates(path, timestamps, states, P_packed):
+    """
+    Write an estimate log from per-frame arrays
+
+    Args:
+        path: file path
+        timestamps: shape (T,)
+        states: shape (T, 4)
+        P_packed: packed upper-triangular covariances, shape (T, 10)
+    """
+    records = create_log(path, KIND_ESTIMATES, len(timestamps))
+    records["timestamp"] = timestamps
+    records["x"] = states
+    records["p_upper"] = P_packed
+    if isinstance(records, np.memmap):
+        records.flush()
+
+
+def iter_frames(records, block_size=4096):
+    """
+    Iterate frame records in the format of EstimateLaneParam.stream
+
+    Scalars are converted block by block to keep memory bounded;
+    measurements are views into the records and invalid frames yield None.
+
+    Args:
+        records: frame records, e.g. from open_log(path, KIND_FRAMES)
+        block_size: records converted per block
+
+    Yields:
+        (timestamp, speed, look_forward_time, w, z_or_None)
+    """
+    for start in range(0, len(records), block_size):
+        block = records[start:start + block_size]
+        matrix_Z = block["z"]
+        columns = zip(block["timestamp"].tolist(), block["speed"].tolist(),
+                      block["look_forward_time"].tolist(), block["w"].tolist(),
+                      block["valid"].tolist())
+        for k, (timestamp, speed, look_forward_time, w, valid) in enumerate(columns):
+            yield timestamp, speed, look_forward_time, w, matrix_Z[k] if valid else None
@@ -0,0 +1,498 @@
+"""
+Asyncio lane-estimation service with per-vehicle sessions
+Keeps one filter session per (vehicle, camera, lane), accepts frames as JSON
+lines over a local Unix socket or stdin, and runs the frames that arrive
+within a short window as one batched KalmanFilterBank step
+
+Usage:
+    python lane_service.py --socket /tmp/lane_service.sock
+    python lane_service.py < frames.jsonl > estimates.jsonl
+
+Protocol, one JSON object per line:
+    request:  {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.1,
+               "speed": 3.6, "look_forward_time": 0.5, "w": 0.0,
+               "z": [c0, c1, c2, c3] or null}
+    response: {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.1,
+               "x": [c0, c1, c2, c3], "P": [10 packed upper-triangle values],
+               "created": false}
+              or {..., "error": "message"}
+"""
+import argparse
+import asyncio
+import json
+import os
+import stat
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+from instrumentation import FilterInstrumentation
+from kalman_filter import KalmanFilterBank, pack_covariance
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, build_motion_matrices_batch
+
+
+LaneFrame = namedtuple("LaneFrame", ["key", "timestamp", "speed", "look_forward_time", "w", "z"])
+LaneFrame.__doc__ = """
+One lane measurement frame of a session
+
+key: session key (vehicle, camera, lane)
+timestamp: frame time, echoed in the response
+speed, look_forward_time, w: motion data of the step
+z: measurement [c0, c1, c2, c3] as a (4,) array, or None when the lane was
+   not detected (predict only)
+"""
+
+_FRAME_FIELDS = ("vehicle", "camera", "lane", "timestamp", "speed", "look_forward_time")
+
+
+def parse_frame(message):
+    """
+    Build a LaneFrame from a decoded request
+
+    A session keeps its state between frames, so every value that enters
+    the filter is checked here: a NaN would stay in the session for good.
+
+    Raises:
+        ValueError: on missing fields, non-finite values, a negative speed,
+                    a non-positive look forward time or a malformed measurement
+    """
+    missing = [field for field in _FRAME_FIELDS if field not in message]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+    z = message.get("z")
+    if z is not None:
+        z = np.asarray(z, dtype=float)
+        if z.shape != (4,):
+            raise ValueError("z must hold 4 coefficients")
+        if not np.all(np.isfinite(z)):
+            raise ValueError("z must be finite")
+    frame = LaneFrame(
+        key=(str(message["vehicle"]), str(message["camera"]), int(message["lane"])),
+        timestamp=float(message["timestamp"]),
+        speed=float(message["speed"]),
+        look_forward_time=float(message["look_forward_time"]),
+        w=float(message.get("w", 0.0)),
+        z=z,
+    )
+    if not np.all(np.isfinite([frame.speed, frame.look_forward_time, frame.w])):
+        raise ValueError("speed, look_forward_time and w must be finite")
+    # Speed 0 (a stopped vehicle) is a valid step: F = I, no lateral motion
+    if frame.speed < 0:
+        raise ValueError("speed must not be negative")
+    if frame.look_forward_time <= 0:
+        raise ValueError("look_forward_time must be positive")
+    return frame
+
+
+class SessionRegistry:
+    """
+    Filter sessions keyed by (vehicle, camera, lane)
+
+    Session states live in slots of preallocated arrays (states (C, 4),
+    covariances (C, 4, 4)), so a batch of sessions is gathered and scattered
+    with one fancy-indexing operation. Slots of evicted sessions are reused;
+    the arrays double in size when all slots are taken.
+    """
+
+    def __init__(self, capacity=256, initial_P=None):
+        """
+        Initialize an empty registry
+
+        Args:
+            capacity: initial number of slots
+            initial_P: error covariance of new sessions (default 0.001*I,
+                       as in main.py)
+        """
+        self.initial_P_ = (np.array(initial_P, dtype=float) if initial_P is not None
+                           else np.eye(4) * 0.001)
+        self.x_ = np.zeros((capacity, 4))
+        self.P_ = np.zeros((capacity, 4, 4))
+        self.last_seen_ = np.zeros(capacity)
+        self.slots_ = {}
+        self.free_ = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots_)
+
+    def __contains__(self, key):
+        return key in self.slots_
+
+    def _grow(self):
+        """
+        Double the number of slots
+        """
+        capacity = self.x_.shape[0]
+        self.x_ = np.concatenate([self.x_, np.zeros_like(self.x_)])
+        self.P_ = np.concatenate([self.P_, np.zeros_like(self.P_)])
+        self.last_seen_ = np.concatenate([self.last_seen_, np.zeros_like(self.last_seen_)])
+        self.free_.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def slot(self, key):
+        """
+        Slot of an existing session, or None
+        """
+        return self.slots_.get(key)
+
+    def create(self, key, matrix_X, now):
+        """
+        Start a session at the given state with the initial covariance
+
+        Returns:
+            slot of the new session
+        """
+        if not self.free_:
+            self._grow()
+        slot = self.free_.pop()
+        self.slots_[key] = slot
+        self.x_[slot] = matrix_X
+        self.P_[slot] = self.initial_P_
+        self.last_seen_[slot] = now
+        return slot
+
+    def state(self, key):
+        """
+        Copies of (matrix_X, matrix_P) of a session
+        """
+        slot = self.slots_[key]
+        return self.x_[slot].copy(), self.P_[slot].copy()
+
+    def evict_idle(self, now, idle_timeout):
+        """
+        Drop sessions without a frame for more than idle_timeout seconds
+
+        Returns:
+            list of evicted keys
+        """
+        evicted = [key for key, slot in self.slots_.items()
+                   if now - self.last_seen_[slot] > idle_timeout]
+        for key in evicted:
+            self.free_.append(self.slots_.pop(key))
+        return evicted
+
+
+class LaneEstimationService:
+    """
+    Micro-batching lane estimation service
+
+    Frames are queued by submit(); a batcher task waits at most `window`
+    seconds after the first queued frame (or until max_batch frames are
+    queued) and runs all of them as one batched step. This bounds the added
+    latency of a frame by the window plus the time of one batch, while
+    concurrent sessions share the cost of the filter step.
+
+    A session is started by its first frame with a measurement, using the
+    measurement as state and the registry's initial covariance. Each later
+    frame is one predict + update (predict only without a measurement) with
+    the fixed-step model of EstimateLaneParam.predict_and_update. Frames of
+    the same session within one batch are applied in arrival order.
+    """
+
+    def __init__(self, window=0.002, max_batch=1024, idle_timeout=30.0, registry=None,
+                 instrumentation=None, clock=time.monotonic):
+        """
+        Initialize the service
+
+        Args:
+            window: maximum time in seconds a frame waits for others to batch with
+            max_batch: maximum number of frames per batch
+            idle_timeout: sessions without frames for this many seconds are evicted
+            registry: SessionRegistry (a new one by default)
+            instrumentation: optional FilterInstrumentation; records "batch"
+                             and per-frame "latency" timings and "frames"/"batches"/"evicted" counters
+            clock: time source in seconds for session activity
+        """
+        self.window_ = window
+        self.max_batch_ = max_batch
+        self.idle_timeout_ = idle_timeout
+        self.registry_ = registry if registry is not None else SessionRegistry()
+        self.instrumentation_ = instrumentation
+        self.clock_ = clock
+        self.queue_ = None
+        self._tasks = []
+
+    def step(self, frames):
+        """
+        Run one batch of frames synchronously
+
+        Args:
+            frames: sequence of LaneFrame
+
+        Returns:
+            one response dict per frame, in order
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+
+        registry = self.registry_
+        now = self.clock_()
+        responses = [None] * len(frames)
+
+        # Split the batch into rounds holding each session at most once
+        rounds = []
+        seen = {}
+        for i, frame in enumerate(frames):
+            slot = registry.slot(frame.key)
+            if slot is None:
+                if frame.z is None:
+                    responses[i] = self._error(frame, "unknown session: first frame needs z")
+                    continue
+                slot = registry.create(frame.key, frame.z, now)
+                responses[i] = self._response(frame, frame.z.tolist(),
+                                              pack_covariance(registry.initial_P_).tolist(), True)
+                continue
+            index = seen.get(slot, 0)
+            seen[slot] = index + 1
+            if index == len(rounds):
+                rounds.append([])
+            rounds[index].append((i, slot))
+
+        for batch in rounds:
+            index = np.array([i for i, _ in batch])
+            slots = np.array([slot for _, slot in batch])
+            self._filter_step([frames[i] for i in index], slots, now)
+            # Convert the round's states in bulk; per-slot conversion dominates large batches
+            states = registry.x_[slots].tolist()
+            covariances = pack_covariance(registry.P_[slots]).tolist()
+            for i, x, P in zip(index.tolist(), states, covariances):
+                responses[i] = self._response(frames[i], x, P)
+
+        if instrumentation is not None:
+            instrumentation.count("frames", len(frames))
+            instrumentation.count("batches")
+            instrumentation.record_time("batch", instrumentation.clock_() - start)
+        return responses
+
+    def _filter_step(self, frames, slots, now):
+        """
+        One predict + update of the sessions in `slots` (all distinct)
+        """
+        registry = self.registry_
+        speeds = np.array([frame.speed for frame in frames])
+        look_forward_times = np.array([frame.look_forward_time for frame in frames])
+        ws = np.array([[frame.w] for frame in frames])
+        mask = np.array([frame.z is not None for frame in frames])
+        matrix_Z = np.zeros((len(frames), 4))
+        if mask.any():
+            matrix_Z[mask] = [frame.z for frame in frames if frame.z is not None]
+
+        matrix_A, matrix_B = build_motion_matrices_batch(speeds, look_forward_times)
+        bank = KalmanFilterBank(matrix_A, matrix_B, MATRIX_H, registry.P_[slots],
+                                MATRIX_Q, MATRIX_R, registry.x_[slots], ws)
+        bank.predict()
+        bank.update(matrix_Z, mask)
+        registry.x_[slots] = bank.x_
+        registry.P_[slots] = bank.P_
+        registry.last_seen_[slots] = now
+
+    @staticmethod
+    def _response(frame, x, P, created=False):
+        vehicle, camera, lane = frame.key
+        return {"vehicle": vehicle, "camera": camera, "lane": lane, "timestamp": frame.timestamp,
+                "x": x, "P": P, "created": created}
+
+    @staticmethod
+    def _error(frame, message):
+        vehicle, camera, lane = frame.key
+        return {"vehicle": vehicle, "camera": camera, "lane": lane,
+                "timestamp": frame.timestamp, "error": message}
+
+    def evict_idle(self, now=None):
+        """
+        Evict idle sessions
+
+        Returns:
+            list of evicted keys
+        """
+        evicted = self.registry_.evict_idle(self.clock_() if now is None else now,
+                                            self.idle_timeout_)
+        if self.instrumentation_ is not None and evicted:
+            self.instrumentation_.count("evicted", len(evicted))
+        return evicted
+
+    async def start(self):
+        """
+        Start the batcher and eviction tasks on the running loop
+        """
+        self.queue_ = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._batcher()),
+                       asyncio.create_task(self._evictor())]
+
+    async def stop(self):
+        """
+        Cancel the background tasks
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, frame):
+        """
+        Queue a frame for the next batch and wait for its response
+        """
+        instrumentation = self.instrumentation_
+        if instrumentation is not None:
+            start = instrumentation.clock_()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue_.put((frame, future))
+        response = await future
+        if instrumentation is not None:
+            instrumentation.record_time("latency", instrumentation.clock_() - start)
+        return response
+
+    async def _batcher(self):
+        """
+        Collect frames into batches and run them
+        """
+        queue = self.queue_
+        while True:
+            batch = [await queue.get()]
+            # Give other frames up to `window` to arrive, unless the batch is already full
+            if queue.qsize() < self.max_batch_ - 1:
+                await asyncio.sleep(self.window_)
+            while len(batch) < self.max_batch_ and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                responses = self.step([frame for frame, _ in batch])
+            except Exception as error:  # keep serving; fail this batch only
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def _evictor(self):
+        """
+        Periodically evict idle sessions
+        """
+        while True:
+            await asyncio.sleep(max(self.idle_timeout_ / 4, 0.01))
+            self.evict_idle()
+
+    async def handle_line(self, line):
+        """
+        Process one request line and return the response line
+        """
+        try:
+            frame = parse_frame(json.loads(line))
+        except (ValueError, TypeError) as error:
+            return json.dumps({"error": str(error)}) + "\n"
+        try:
+            response = await self.submit(frame)
+        except Exception as error:
+            response = self._error(frame, str(error))
+        return json.dumps(response) + "\n"
+
+    async def _serve_stream(self, reader, write):
+        """
+        Answer every line of `reader`; requests are processed concurrently
+        so frames of one stream can share a batch
+        """
+        pending = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(self.handle_line(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            task.add_done_callback(lambda done: write(done.result()))
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def serve_unix(self, path):
+        """
+        Serve clients on a Unix socket until cancelled
+        """
+        async def handle_client(reader, writer):
+            try:
+                await self._serve_stream(reader, lambda text: writer.write(text.encode()))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(handle_client, path=path)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_stdio(self):
+        """
+        Serve requests from stdin, writing responses to stdout, until EOF
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        mode = os.fstat(sys.stdin.fileno()).st_mode
+        feeder = None
+        if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode):
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        else:
+            # Regular files (`< frames.jsonl`) cannot be watched by the loop
+            feeder = asyncio.create_task(_feed_from_file(reader, sys.stdin.buffer))
+
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        try:
+            await self._serve_stream(reader, write)
+        finally:
+            if feeder is not None:
+                feeder.cancel()
+
+
+async def _feed_from_file(reader, stream, chunk_size=65536):
+    """
+    Feed a StreamReader from a blocking binary file, reading in a thread
+    """
+    while True:
+        chunk = await asyncio.to_thread(stream.read1, chunk_size)
+        if not chunk:
+            reader.feed_eof()
+            return
+        reader.feed_data(chunk)
+
+
+async def _run(args):
+    instrumentation = FilterInstrumentation()
+    service = LaneEstimationService(window=args.window_ms / 1000.0, max_batch=args.max_batch,
+                                    idle_timeout=args.idle_timeout,
+                                    instrumentation=instrumentation)
+    await service.start()
+    try:
+        if args.socket:
+            await service.serve_unix(args.socket)
+        else:
+            await service.serve_stdio()
+    finally:
+        await service.stop()
+        snapshot = instrumentation.snapshot()
+        print(f"counters: {snapshot.counters}", file=sys.stderr)
+        for stage, stats in snapshot.stages.items():
+            print(f"{stage}: p50 {stats.p50_ns / 1e3:.1f} us, p99 {stats.p99_ns / 1e3:.1f} us, "
+                  f"max {stats.max_ns / 1e3:.1f} us", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-batching lane estimation service")
+    parser.add_argument("--socket", help="Unix socket path; reads stdin when omitted")
+    parser.add_argument("--window-ms", type=float, default=2.0, help="batching window in ms")
+    parser.add_argument("--max-batch", type=int, default=1024, help="maximum frames per batch")
+    parser.add_argument("--idle-timeout", type=float, default=30.0,
+                        help="evict sessions idle for this many seconds")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_run(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
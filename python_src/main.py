@@ -6,6 +6,14 @@ import numpy as np
 from estimate_lane_param import EstimateLaneParam, LaneParamInfo
 
 
+def print_filter_step(stage, x):
+    """
+    Log hook printing the filter state like the C++ "predict x_" trace
+    """
+    if stage == "predict":
+        print(f"predict x_: {x}")
+
+
 def main():
     """
     Main function demonstrating lane parameter estimation
@@ -24,19 +32,14 @@ def main():
     lane_param.c3_ = 0.000001
     
     # Initialize state vector (equivalent to matrix_X in C++)
-    matrix_X = np.array([
-        lane_param.c0_,
-        lane_param.c1_,
-        lane_param.c2_,
-        lane_param.c3_
-    ])
+    matrix_X = lane_param.as_array().copy()
     
     print(f"matrix_X_init = {matrix_X}")
     
     # Main estimation loop
     for i in range(10):
         print(f"i = {i}")
-        estimate_instance = EstimateLaneParam()
+        estimate_instance = EstimateLaneParam(log_hook=print_filter_step)
         
         # Set parameters
         look_dis_time = 0.5
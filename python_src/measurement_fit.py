@@ -0,0 +1,173 @@
+"""
+Measurement generation from raw lane points
+Weighted least-squares cubic fits for many lanes at once, accumulated
+incrementally as normal equations, giving the measurement matrix_Z and a
+data-driven measurement noise matrix_R per lane
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+CubicFit = namedtuple("CubicFit", ["z", "r", "valid", "count", "residual_variance"])
+CubicFit.__doc__ = """
+Cubic fits of L lanes
+
+z: fitted coefficients [c0, c1, c2, c3] per lane, i.e. matrix_Z, (L, 4)
+r: covariance of the coefficients, i.e. matrix_R for the update, (L, 4, 4)
+valid: lanes with enough well-spread points for a fit, (L,); z and r are
+       nan elsewhere
+count: number of accumulated points per lane, (L,)
+residual_variance: noise variance used to scale r per lane, (L,)
+"""
+
+# Accumulator columns: S_k = sum(w*t^k), k = 0..6; T_k = sum(w*t^k*y), k = 0..3;
+# U = sum(w*y^2), with t = x / x_scale
+_S = slice(0, 7)
+_T = slice(7, 11)
+_U = 11
+_COLUMNS = 12
+
+# Normal matrix A[i, j] = S_(i+j)
+_HANKEL = np.add.outer(np.arange(4), np.arange(4))
+
+
+class CubicFitAccumulator:
+    """
+    Normal-equation accumulators for weighted cubic fits of L lanes
+
+    Each lane keeps the weighted power sums of its points, so points can be
+    streamed in any number of add_points calls, and solve() fits all lanes
+    from these 12 numbers per lane without another pass over the points.
+
+    Positions are divided by x_scale before the powers are taken, which
+    keeps the normal equations well conditioned for look-ahead distances of
+    tens of meters; the results are in the original units.
+    """
+
+    def __init__(self, lanes, x_scale=50.0):
+        """
+        Initialize the accumulators
+
+        Args:
+            lanes: number of lanes L
+            x_scale: typical look-ahead distance used to normalize positions
+        """
+        self.x_scale_ = float(x_scale)
+        self.sums_ = np.zeros((lanes, _COLUMNS))
+        self.count_ = np.zeros(lanes, dtype=np.int64)
+
+    @property
+    def lanes(self):
+        """
+        Number of lanes
+        """
+        return self.count_.shape[0]
+
+    def reset(self, lanes=None):
+        """
+        Clear the accumulators of all lanes or of the given lane indices
+        """
+        if lanes is None:
+            lanes = slice(None)
+        self.sums_[lanes] = 0.0
+        self.count_[lanes] = 0
+
+    def add_points(self, lanes, x, y, weights=None):
+        """
+        Accumulate lane points
+
+        Args:
+            lanes: lane index per point, (N,), or one index for all points
+            x: longitudinal positions, (N,)
+            y: lateral positions, (N,)
+            weights: optional weights per point, e.g. inverse variances or
+                     detector confidences, (N,)
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        y = np.asarray(y, dtype=float).reshape(-1)
+        lanes = np.broadcast_to(np.asarray(lanes, dtype=np.intp), x.shape)
+        if x.shape[0] == 0:
+            return
+
+        # One column of sums per point: w*t^k, w*t^k*y and w*y^2
+        columns = np.empty((_COLUMNS, x.shape[0]))
+        columns[0] = 1.0 if weights is None else weights
+        t = x / self.x_scale_
+        for k in range(1, 7):
+            np.multiply(columns[k - 1], t, out=columns[k])
+        np.multiply(columns[:4], y, out=columns[_T])
+        np.multiply(columns[7], y, out=columns[_U])
+
+        if np.all(lanes[1:] >= lanes[:-1]):
+            # Points grouped by lane: sum each run of the same lane
+            starts = np.flatnonzero(np.r_[True, lanes[1:] != lanes[:-1]])
+            self.sums_[lanes[starts]] += np.add.reduceat(columns, starts, axis=1).T
+        else:
+            for k in range(_COLUMNS):
+                self.sums_[:, k] += np.bincount(lanes, weights=columns[k], minlength=self.lanes)
+        self.count_ += np.bincount(lanes, minlength=self.lanes)
+
+    def solve(self, noise_variance=None, min_points=5, rcond=1e-12):
+        """
+        Fit all lanes from the accumulated points
+
+        Solves the normal equations A*d = b per lane with A = sum(w*phi*phi^T)
+        and b = sum(w*phi*y), phi = [1, t, t^2, t^3]. The coefficient
+        covariance is sigma^2 * A^(-1), where sigma^2 is noise_variance or,
+        with weights as relative inverse variances, the weighted residual
+        sum of squares over count - 4 degrees of freedom.
+
+        Args:
+            noise_variance: known variance of the unit-weight point noise;
+                            estimated from the residuals per lane if None
+            min_points: minimum number of points for a valid fit
+            rcond: minimum ratio of the smallest to the largest eigenvalue
+                   of the (normalized) normal matrix
+
+        Returns:
+            CubicFit
+        """
+        A = self.sums_[:, _S][:, _HANKEL]
+        b = self.sums_[:, _T]
+
+        # A^(-1) from the eigendecomposition, which also flags degenerate point sets
+        eigenvalues, V = np.linalg.eigh(A)
+        valid = (self.count_ >= min_points) & (eigenvalues[:, 0] > rcond * eigenvalues[:, -1])
+        eigenvalues[~valid] = 1.0
+        A_inv = (V / eigenvalues[:, None, :]) @ np.swapaxes(V, -1, -2)
+        d = (A_inv @ b[..., None])[..., 0]
+
+        if noise_variance is None:
+            # Weighted residual sum of squares: sum(w*y^2) - b^T*d
+            residual = np.maximum(self.sums_[:, _U] - np.einsum("li,li->l", b, d), 0.0)
+            variance = residual / np.maximum(self.count_ - 4, 1)
+        else:
+            variance = np.full(self.lanes, float(noise_variance))
+
+        # Back to original units: c_k = d_k / x_scale^k
+        scale = self.x_scale_ ** -np.arange(4.0)
+        z = d * scale
+        r = variance[:, None, None] * A_inv * np.multiply.outer(scale, scale)
+        z[~valid] = np.nan
+        r[~valid] = np.nan
+        return CubicFit(z, r, valid, self.count_.copy(), variance)
+
+
+def fit_lanes(lanes, x, y, count, weights=None, x_scale=50.0, **kwargs):
+    """
+    Fit cubics to the points of `count` lanes in one pass
+
+    Args:
+        lanes: lane index per point, (N,)
+        x, y, weights: see CubicFitAccumulator.add_points
+        count: number of lanes L
+        x_scale: see CubicFitAccumulator
+        kwargs: CubicFitAccumulator.solve arguments
+
+    Returns:
+        CubicFit
+    """
+    accumulator = CubicFitAccumulator(count, x_scale)
+    accumulator.add_points(lanes, x, y, weights)
+    return accumulator.solve(**kwargs)
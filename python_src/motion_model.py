@@ -0,0 +1,192 @@
+"""
+Motion model matrices for lane parameter estimation
+Builds the A/B matrices of the C++ estimateLaneParam model and caches them
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def _read_only(matrix):
+    """
+    Mark a shared matrix as read-only so no filter can modify it in place
+    """
+    matrix.setflags(write=False)
+    return matrix
+
+
+def _diagonal(values):
+    """
+    Build a diagonal matrix from a sequence of values
+    """
+    matrix = np.zeros((len(values), len(values)))
+    np.fill_diagonal(matrix, values)
+    return matrix
+
+
+# Measurement matrix H, process noise Q and measurement noise R do not
+# depend on the motion data, so they are built once and shared
+MATRIX_H = _read_only(_diagonal([1.0, 1.0, 1.0, 1.0]))
+MATRIX_Q = _read_only(_diagonal([0.001, 0.001, 0.001, 0.001]))
+MATRIX_R = _read_only(_diagonal([0.1, 0.1, 0.1, 0.1]))  # 固定测量噪声
+
+
+def build_motion_matrices(speed, look_forward_time):
+    """
+    Build the state transition and control matrices
+
+    Args:
+        speed: vehicle speed
+        look_forward_time: look forward time
+
+    Returns:
+        (matrix_A, matrix_B) with shapes (4, 4) and (4, 1)
+    """
+    # Calculate look ahead distance
+    dx = speed * look_forward_time
+
+    # State transition matrix A (equivalent to matrix_A in C++)
+    matrix_A = np.zeros((4, 4))
+    matrix_A[0, 0] = 1
+    matrix_A[0, 1] = dx
+    matrix_A[0, 2] = pow(dx, 2) / 2
+    matrix_A[0, 3] = pow(dx, 3) / 6
+
+    matrix_A[1, 1] = 1
+    matrix_A[1, 2] = dx
+    matrix_A[1, 3] = pow(dx, 2) / 2
+
+    matrix_A[2, 2] = 1
+    matrix_A[2, 3] = dx
+
+    matrix_A[3, 3] = 1
+
+    # Control matrix B (equivalent to matrix_B in C++)
+    matrix_B = np.zeros((4, 1))
+    # -dx^2 / (2*speed) of the C++ model, in a form that is finite at speed 0
+    matrix_B[0, 0] = -speed * pow(look_forward_time, 2) / 2
+    matrix_B[1, 0] = -look_forward_time
+
+    return matrix_A, matrix_B
+
+
+def build_motion_matrices_batch(speeds, look_forward_times, dtype=np.float64):
+    """
+    Build the state transition and control matrices for many frames at once
+
+    Args:
+        speeds: vehicle speeds, shape (T,)
+        look_forward_times: look forward times, scalar or shape (T,)
+        dtype: dtype of the returned matrices; computed in float64
+
+    Returns:
+        (matrix_A, matrix_B) with shapes (T, 4, 4) and (T, 4, 1)
+    """
+    speeds = np.asarray(speeds, dtype=float)
+    look_forward_times = np.broadcast_to(np.asarray(look_forward_times, dtype=float), speeds.shape)
+    dx = speeds * look_forward_times
+    dx2 = np.power(dx, 2) / 2
+    dx3 = np.power(dx, 3) / 6
+
+    matrix_A = np.zeros(speeds.shape + (4, 4))
+    for i in range(4):
+        matrix_A[..., i, i] = 1
+    matrix_A[..., 0, 1] = dx
+    matrix_A[..., 0, 2] = dx2
+    matrix_A[..., 0, 3] = dx3
+    matrix_A[..., 1, 2] = dx
+    matrix_A[..., 1, 3] = dx2
+    matrix_A[..., 2, 3] = dx
+
+    matrix_B = np.zeros(speeds.shape + (4, 1))
+    # -dx^2 / (2*speed) of the C++ model, in a form that is finite at speed 0
+    matrix_B[..., 0, 0] = -speeds * np.power(look_forward_times, 2) / 2
+    matrix_B[..., 1, 0] = -look_forward_times
+
+    return matrix_A.astype(dtype, copy=False), matrix_B.astype(dtype, copy=False)
+
+
+class MotionModelCache:
+    """
+    Bounded LRU cache of (A, B) keyed by quantized (speed, look_forward_time)
+
+    Speed and look forward time are rounded to a multiple of `resolution`
+    and the matrices are built from the rounded values, so every key maps
+    to exactly one model. Cached matrices are read-only and shared.
+    """
+
+    def __init__(self, maxsize=128, resolution=1e-3, dtype=np.float64):
+        """
+        Initialize the cache
+
+        Args:
+            maxsize: maximum number of cached models
+            resolution: quantization step for speed and look forward time
+            dtype: dtype of the cached matrices; built in float64
+        """
+        self.maxsize_ = maxsize
+        self.dtype_ = np.dtype(dtype)
+        self.scale_ = round(1.0 / resolution)
+        self.hits_ = 0
+        self.misses_ = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, speed, look_forward_time):
+        """
+        Quantized cache key for the given motion data
+        """
+        return (round(speed * self.scale_), round(look_forward_time * self.scale_))
+
+    def get(self, speed, look_forward_time):
+        """
+        Get the (A, B) matrices for the given motion data
+
+        Args:
+            speed: vehicle speed
+            look_forward_time: look forward time
+
+        Returns:
+            (matrix_A, matrix_B), shared read-only arrays
+        """
+        key = self.key(speed, look_forward_time)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits_ += 1
+                return entry
+            self.misses_ += 1
+
+        matrix_A, matrix_B = build_motion_matrices(key[0] / self.scale_, key[1] / self.scale_)
+        entry = (_read_only(matrix_A.astype(self.dtype_, copy=False)),
+                 _read_only(matrix_B.astype(self.dtype_, copy=False)))
+
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize_:
+                self._entries.popitem(last=False)
+        return entry
+
+    def cache_info(self):
+        """
+        Hit/miss statistics, in the style of functools.lru_cache
+        """
+        return CacheInfo(self.hits_, self.misses_, self.maxsize_, len(self._entries))
+
+    def clear(self):
+        """
+        Drop all cached models and reset the statistics
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits_ = 0
+            self.misses_ = 0
+
+
+# Cache shared by all estimators unless one is given explicitly
+default_model_cache = MotionModelCache()
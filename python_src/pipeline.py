@@ -0,0 +1,462 @@
+"""
+Thread-pool pipeline for per-camera lane estimation
+Runs ingest, fit, filter and publish as separate stages connected by
+bounded queues of preallocated frame buffers, so source/sink I/O overlaps
+with the fits and filter steps
+"""
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from estimate_lane_param import EstimateLaneParam
+from measurement_fit import CubicFitAccumulator
+
+
+PointFrame = namedtuple("PointFrame", ["timestamp", "speed", "look_forward_time", "w", "lanes", "x", "y"])
+PointFrame.__doc__ = """
+One camera frame of raw lane points, as produced by a pipeline source
+
+timestamp: frame time
+speed, look_forward_time, w: motion data of the frame
+lanes: lane index per point, (N,)
+x, y: longitudinal and lateral positions of the points, (N,)
+"""
+
+PipelineResult = namedtuple("PipelineResult", ["index", "timestamp", "states", "covariances", "valid"])
+PipelineResult.__doc__ = """
+Filter output of one frame, passed to the pipeline sink
+
+index: frame number in the source
+timestamp: frame time
+states: lane states after the frame, (L, 4)
+covariances: error covariances after the frame, (L, 4, 4)
+valid: lanes updated with a measurement in this frame, (L,)
+
+The arrays are views of a pipeline buffer that is reused once the sink
+returns; copy them to keep them.
+"""
+
+StageMetrics = namedtuple("StageMetrics", ["name", "frames", "busy_seconds", "wait_seconds", "utilization"])
+StageMetrics.__doc__ = """
+Work of one pipeline stage
+
+frames: frames processed
+busy_seconds: time spent processing frames
+wait_seconds: time blocked on the input or output queue
+utilization: busy_seconds over the pipeline run time
+"""
+
+QueueMetrics = namedtuple("QueueMetrics", ["name", "capacity", "mean_occupancy", "max_occupancy", "dropped"])
+QueueMetrics.__doc__ = """
+Occupancy of one queue between stages
+
+mean_occupancy: time-weighted mean number of queued frames
+max_occupancy: largest number of queued frames
+dropped: frames discarded by the drop_oldest backpressure
+"""
+
+PipelineReport = namedtuple(
+    "PipelineReport",
+    ["frames_in", "frames_out", "dropped", "seconds", "frames_per_second", "stages", "queues"],
+)
+PipelineReport.__doc__ = """
+Summary of a pipeline run
+
+frames_in: frames read from the source
+frames_out: frames passed to the sink
+dropped: frames discarded by backpressure
+seconds: wall time of the run
+frames_per_second: frames_out / seconds
+stages: StageMetrics per stage
+queues: QueueMetrics per queue
+"""
+
+BACKPRESSURE_MODES = ("block", "drop_oldest")
+
+
+class FrameQueue:
+    """
+    Bounded FIFO between two pipeline threads
+
+    With "block" backpressure put() waits while the queue is full; with
+    "drop_oldest" it discards the oldest queued frame instead, so a slow
+    consumer sees the newest frames. A closed queue still hands out its
+    remaining frames, then get() returns None.
+    """
+
+    def __init__(self, capacity=2, backpressure="block", clock=time.perf_counter):
+        """
+        Initialize an empty queue
+
+        Args:
+            capacity: maximum number of queued frames (2 double-buffers a stage)
+            backpressure: "block" or "drop_oldest"
+            clock: time source for the occupancy statistics
+        """
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f"unknown backpressure: {backpressure}")
+        self.capacity_ = capacity
+        self.backpressure_ = backpressure
+        self.clock_ = clock
+        self.closed_ = False
+        self.dropped_ = 0
+        self.max_occupancy_ = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._start = clock()
+        self._last = self._start
+        self._area = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def _account(self):
+        """
+        Integrate the occupancy up to now; called before every change
+        """
+        now = self.clock_()
+        self._area += len(self._items) * (now - self._last)
+        self._last = now
+
+    def put(self, item):
+        """
+        Queue a frame
+
+        Returns:
+            the frame that was not kept (the dropped oldest frame, or `item`
+            itself if the queue is closed), or None
+        """
+        with self._condition:
+            if self.backpressure_ == "block":
+                while len(self._items) >= self.capacity_ and not self.closed_:
+                    self._condition.wait()
+            if self.closed_:
+                return item
+            self._account()
+            dropped = None
+            if len(self._items) >= self.capacity_:
+                dropped = self._items.popleft()
+                self.dropped_ += 1
+            self._items.append(item)
+            self.max_occupancy_ = max(self.max_occupancy_, len(self._items))
+            self._condition.notify_all()
+            return dropped
+
+    def get(self):
+        """
+        Take the oldest frame, waiting for one; None once closed and empty
+        """
+        with self._condition:
+            while not self._items and not self.closed_:
+                self._condition.wait()
+            if not self._items:
+                return None
+            self._account()
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self, discard=False):
+        """
+        Mark the end of the stream, optionally discarding queued frames
+        """
+        with self._condition:
+            self._account()
+            self.closed_ = True
+            if discard:
+                self._items.clear()
+            self._condition.notify_all()
+
+    def mean_occupancy(self):
+        """
+        Time-weighted mean number of queued frames since creation
+        """
+        with self._condition:
+            self._account()
+            elapsed = self._last - self._start
+            return self._area / elapsed if elapsed > 0 else 0.0
+
+
+class FrameSlot:
+    """
+    Preallocated buffers for one frame on its way through the pipeline
+    """
+
+    def __init__(self, lanes, max_points):
+        self.index = -1
+        self.timestamp = 0.0
+        self.speed = 0.0
+        self.look_forward_time = 0.0
+        self.w = 0.0
+        self.count = 0
+        self.lanes = np.zeros(max_points, dtype=np.intp)
+        self.x = np.zeros(max_points)
+        self.y = np.zeros(max_points)
+        self.z = np.zeros((lanes, 4))
+        self.r = np.zeros((lanes, 4, 4))
+        self.valid = np.zeros(lanes, dtype=bool)
+        self.states = np.zeros((lanes, 4))
+        self.covariances = np.zeros((lanes, 4, 4))
+
+
+class LanePipeline:
+    """
+    Lane estimation of one camera as a four-stage pipeline
+
+    ingest: copies the points of a source frame into a free FrameSlot
+    fit:    cubic fit per lane (measurement_fit), giving z and R
+    filter: EstimateLaneParam predict per lane, then update with the fitted
+            z and R for lanes with a valid fit
+    publish: passes a PipelineResult to the sink
+
+    Each stage runs on its own pool thread and hands slots to the next one
+    through a FrameQueue of queue_size frames; slots return to a free list
+    after publishing, so no per-frame buffers are allocated. NumPy releases
+    the GIL in the fits and filter products, and the source and sink
+    usually wait on I/O, so the stages overlap.
+
+    The lane states carry over from one run to the next, so a drive can be
+    fed in several sources; each source is the continuation of the last.
+
+    With "drop_oldest" backpressure frames may be dropped before the filter
+    stage; the filter then predicts over the missed frames with the motion
+    data of the frame it receives, so the state stays on the frame clock.
+    """
+
+    STAGES = ("ingest", "fit", "filter", "publish")
+
+    def __init__(self, matrix_X, matrix_P, max_points=1024, queue_size=2, backpressure="block",
+                 noise_variance=None, min_points=5, x_scale=50.0):
+        """
+        Initialize the pipeline
+
+        Args:
+            matrix_X: initial lane states, (L, 4)
+            matrix_P: initial error covariances, (L, 4, 4)
+            max_points: maximum number of points per frame
+            queue_size: frames per queue between two stages
+            backpressure: "block" or "drop_oldest"
+            noise_variance, min_points: CubicFitAccumulator.solve arguments
+            x_scale: CubicFitAccumulator position scale
+        """
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f"unknown backpressure: {backpressure}")
+        self.matrix_X_ = np.array(matrix_X, dtype=float)
+        self.matrix_P_ = np.array(matrix_P, dtype=float)
+        self.lanes_ = self.matrix_X_.shape[0]
+        self.max_points_ = max_points
+        self.queue_size_ = queue_size
+        self.backpressure_ = backpressure
+        self.noise_variance_ = noise_variance
+        self.min_points_ = min_points
+        self.accumulator_ = CubicFitAccumulator(self.lanes_, x_scale)
+        self.estimator_ = EstimateLaneParam()
+        self.last_index_ = -1
+        # Every queue full plus one slot held by each stage
+        self.slots_ = [FrameSlot(self.lanes_, max_points)
+                       for _ in range(3 * queue_size + len(self.STAGES))]
+
+    def _ingest(self, slot, index, frame):
+        """
+        Copy a source frame into a slot
+        """
+        count = len(frame.x)
+        if count > self.max_points_:
+            raise ValueError(f"frame {index}: {count} points exceed max_points={self.max_points_}")
+        slot.index = index
+        slot.timestamp = frame.timestamp
+        slot.speed = frame.speed
+        slot.look_forward_time = frame.look_forward_time
+        slot.w = frame.w
+        slot.count = count
+        slot.lanes[:count] = frame.lanes
+        slot.x[:count] = frame.x
+        slot.y[:count] = frame.y
+
+    def _fit(self, slot):
+        """
+        Fit z and R of every lane from the slot's points
+        """
+        count = slot.count
+        accumulator = self.accumulator_
+        accumulator.reset()
+        accumulator.add_points(slot.lanes[:count], slot.x[:count], slot.y[:count])
+        fit = accumulator.solve(self.noise_variance_, self.min_points_)
+        slot.z[:] = fit.z
+        slot.r[:] = fit.r
+        slot.valid[:] = fit.valid
+
+    def _filter(self, slot):
+        """
+        Predict all lanes to the slot's frame and update the fitted ones
+        """
+        estimator = self.estimator_
+        estimator.set_motion_data(slot.speed, slot.look_forward_time, slot.w)
+        steps = slot.index - self.last_index_ if self.last_index_ >= 0 else 1
+        self.last_index_ = slot.index
+        for lane in range(self.lanes_):
+            matrix_X = self.matrix_X_[lane]
+            matrix_P = self.matrix_P_[lane]
+            for _ in range(steps):
+                estimator.predict(matrix_P, matrix_X)
+            if slot.valid[lane]:
+                estimator.update(matrix_P, matrix_X, slot.z[lane], matrix_R=slot.r[lane])
+        slot.states[:] = self.matrix_X_
+        slot.covariances[:] = self.matrix_P_
+
+    @staticmethod
+    def _result(slot):
+        return PipelineResult(slot.index, slot.timestamp, slot.states, slot.covariances, slot.valid)
+
+    def run_serial(self, source, sink):
+        """
+        Run all stages one frame at a time on the calling thread
+
+        Same results as run() with "block" backpressure; the baseline for
+        the pipeline speedup.
+
+        Returns:
+            number of frames processed
+        """
+        # Frame indices restart at 0 for every source
+        self.last_index_ = -1
+        slot = self.slots_[0]
+        frames = 0
+        for index, frame in enumerate(source):
+            self._ingest(slot, index, frame)
+            self._fit(slot)
+            self._filter(slot)
+            sink(self._result(slot))
+            frames += 1
+        return frames
+
+    def run(self, source, sink):
+        """
+        Run the pipeline until the source is exhausted
+
+        Args:
+            source: iterable of PointFrame
+            sink: callable sink(PipelineResult)
+
+        Returns:
+            PipelineReport
+
+        Raises:
+            the first exception raised by a stage, the source or the sink,
+            after all stages stopped
+        """
+        # Frame indices restart at 0 for every source
+        self.last_index_ = -1
+        clock = time.perf_counter
+        free = FrameQueue(len(self.slots_), "block", clock)
+        for slot in self.slots_:
+            free.put(slot)
+        queues = [FrameQueue(self.queue_size_, self.backpressure_, clock) for _ in range(3)]
+        metrics = {name: [0, 0.0, 0.0] for name in self.STAGES}  # frames, busy, wait
+        frames_in = [0]
+
+        def abort():
+            for queue in [free] + queues:
+                queue.close(discard=True)
+
+        def forward(outbox, slot):
+            dropped = outbox.put(slot)
+            if dropped is not None:
+                free.put(dropped)
+
+        def ingest():
+            stats = metrics["ingest"]
+            iterator = iter(source)
+            index = 0
+            while True:
+                start = clock()
+                slot = free.get()
+                if slot is None:
+                    return
+                # Reading the source is the ingest work, usually I/O
+                ready = clock()
+                try:
+                    frame = next(iterator)
+                except StopIteration:
+                    free.put(slot)
+                    return
+                self._ingest(slot, index, frame)
+                done = clock()
+                forward(queues[0], slot)
+                stats[0] += 1
+                stats[1] += done - ready
+                stats[2] += (ready - start) + (clock() - done)
+                index += 1
+                frames_in[0] = index
+
+        def stage(name, work, inbox, outbox):
+            stats = metrics[name]
+            while True:
+                start = clock()
+                slot = inbox.get()
+                if slot is None:
+                    return
+                ready = clock()
+                work(slot)
+                done = clock()
+                if outbox is None:
+                    free.put(slot)
+                else:
+                    forward(outbox, slot)
+                stats[0] += 1
+                stats[1] += done - ready
+                stats[2] += (ready - start) + (clock() - done)
+
+        def guarded(function, outbox, *args):
+            try:
+                function(*args)
+            except BaseException:
+                abort()
+                raise
+            finally:
+                if outbox is not None:
+                    outbox.close()
+
+        start = clock()
+        with ThreadPoolExecutor(max_workers=len(self.STAGES), thread_name_prefix="lane-pipeline") as pool:
+            futures = [
+                pool.submit(guarded, ingest, queues[0]),
+                pool.submit(guarded, stage, queues[1], "fit", self._fit, queues[0], queues[1]),
+                pool.submit(guarded, stage, queues[2], "filter", self._filter, queues[1], queues[2]),
+                pool.submit(guarded, stage, None, "publish", lambda slot: sink(self._result(slot)),
+                            queues[2], None),
+            ]
+        seconds = clock() - start
+        for future in futures:
+            future.result()
+
+        frames_out = metrics["publish"][0]
+        return PipelineReport(
+            frames_in=frames_in[0],
+            frames_out=frames_out,
+            dropped=sum(queue.dropped_ for queue in queues),
+            seconds=seconds,
+            frames_per_second=frames_out / seconds if seconds > 0 else 0.0,
+            stages=[StageMetrics(name, frames, busy, wait, busy / seconds if seconds > 0 else 0.0)
+                    for name, (frames, busy, wait) in metrics.items()],
+            queues=[QueueMetrics(f"{a}->{b}", queue.capacity_, queue.mean_occupancy(),
+                                 queue.max_occupancy_, queue.dropped_)
+                    for (a, b), queue in zip(zip(self.STAGES, self.STAGES[1:]), queues)],
+        )
+
+
+def format_report(report):
+    """
+    Human-readable summary of a PipelineReport
+    """
+    lines = [f"frames: {report.frames_in} in, {report.frames_out} out, {report.dropped} dropped, "
+             f"{report.frames_per_second:.0f} frames/s"]
+    for stage in report.stages:
+        lines.append(f"  {stage.name:8s} {stage.frames:8d} frames  busy {stage.busy_seconds:8.3f} s  "
+                     f"wait {stage.wait_seconds:8.3f} s  utilization {stage.utilization:6.1%}")
+    for queue in report.queues:
+        lines.append(f"  {queue.name:16s} occupancy mean {queue.mean_occupancy:5.2f} "
+                     f"max {queue.max_occupancy}/{queue.capacity}  dropped {queue.dropped}")
+    return "\n".join(lines)
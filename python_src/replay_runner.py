@@ -0,0 +1,158 @@
+"""
+Multi-process replay of recorded drives through EstimateLaneParam
+Drives are sharded over a process pool; every worker writes its estimates
+straight into shared memory-mapped result arrays, so no results are pickled
+"""
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from estimate_lane_param import EstimateLaneParam
+from kalman_filter import pack_covariance
+from lane_log import KIND_FRAMES, open_log, read_header
+
+
+ReplayDrive = namedtuple(
+    "ReplayDrive",
+    ["speeds", "look_forward_times", "ws", "matrix_Z", "valid", "matrix_X", "matrix_P"],
+)
+ReplayDrive.__doc__ = """
+One recorded drive: per-frame speed, look forward time, angular velocity,
+measurement (T, 4) and measurement validity, plus the initial state/covariance
+"""
+
+FrameLogDrive = namedtuple("FrameLogDrive", ["path", "matrix_X", "matrix_P"])
+FrameLogDrive.__doc__ = """
+A recorded drive stored as a lane_log frame file; workers memory-map the
+file themselves, so only the path and the initial state are sent to them
+"""
+
+WorkerStats = namedtuple("WorkerStats", ["pid", "drives", "frames", "seconds", "frames_per_second"])
+ReplayResult = namedtuple("ReplayResult", ["states", "covariances", "offsets", "workers"])
+
+STATES_FILE = "states.npy"
+COVARIANCES_FILE = "covariances.npy"
+
+# Result arrays opened once per worker process by _init_worker
+_worker_outputs = None
+
+
+def _init_worker(states_path, covariances_path):
+    """
+    Open the shared result arrays in a worker process
+    """
+    global _worker_outputs
+    _worker_outputs = (
+        np.lib.format.open_memmap(states_path, mode="r+"),
+        np.lib.format.open_memmap(covariances_path, mode="r+"),
+    )
+
+
+def _drive_length(drive):
+    """
+    Number of frames of a ReplayDrive or FrameLogDrive
+    """
+    if isinstance(drive, FrameLogDrive):
+        return int(read_header(drive.path)["count"])
+    return len(drive.speeds)
+
+
+def load_drive(drive):
+    """
+    Resolve a FrameLogDrive into a ReplayDrive of views into the mapped file
+    """
+    if not isinstance(drive, FrameLogDrive):
+        return drive
+    records = open_log(drive.path, KIND_FRAMES)
+    return ReplayDrive(records["speed"], records["look_forward_time"], records["w"],
+                       records["z"], records["valid"], drive.matrix_X, drive.matrix_P)
+
+
+def _frames(drive):
+    """
+    Iterate the frames of a drive in the format of EstimateLaneParam.stream
+    """
+    look_forward_times = np.broadcast_to(drive.look_forward_times, np.shape(drive.speeds))
+    for k in range(len(drive.speeds)):
+        matrix_Z = drive.matrix_Z[k] if drive.valid[k] else None
+        yield k, drive.speeds[k], look_forward_times[k], drive.ws[k], matrix_Z
+
+
+def replay_drive(drive, states, covariances):
+    """
+    Replay one drive, writing estimates into the given output rows
+
+    Args:
+        drive: ReplayDrive
+        states: output state rows, shape (T, 4)
+        covariances: output packed covariance rows, shape (T, 10)
+    """
+    matrix_X = np.array(drive.matrix_X, dtype=float)
+    matrix_P = np.array(drive.matrix_P, dtype=float)
+    estimator = EstimateLaneParam(use_workspace=True)
+    for k, _, matrix_P in estimator.stream(_frames(drive), matrix_X, matrix_P):
+        states[k] = matrix_X
+        covariances[k] = pack_covariance(matrix_P)
+
+
+def _replay_task(task):
+    """
+    Worker entry point: replay one drive into its slice of the shared output
+    """
+    drive, offset = task
+    states, covariances = _worker_outputs
+    start = time.perf_counter()
+    drive = load_drive(drive)
+    frames = len(drive.speeds)
+    replay_drive(drive, states[offset:offset + frames], covariances[offset:offset + frames])
+    states.flush()
+    covariances.flush()
+    return os.getpid(), frames, time.perf_counter() - start
+
+
+def replay_drives(drives, output_dir, processes=None, chunksize=1):
+    """
+    Replay many drives in parallel
+
+    Results of drive i are rows offsets[i]:offsets[i + 1] of the memory-mapped
+    states (total, 4) and packed covariances (total, 10) stored as .npy files
+    in output_dir.
+
+    Args:
+        drives: sequence of ReplayDrive or FrameLogDrive
+        output_dir: directory for states.npy and covariances.npy
+        processes: number of worker processes (default: CPU count)
+        chunksize: drives handed to a worker at a time
+
+    Returns:
+        ReplayResult with read-only memory-mapped arrays, the row offsets and
+        one WorkerStats per worker process
+    """
+    lengths = [_drive_length(drive) for drive in drives]
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+    states_path = os.path.join(output_dir, STATES_FILE)
+    covariances_path = os.path.join(output_dir, COVARIANCES_FILE)
+
+    # Preallocate the result files; workers map them read-write
+    np.lib.format.open_memmap(states_path, mode="w+", shape=(int(offsets[-1]), 4)).flush()
+    np.lib.format.open_memmap(covariances_path, mode="w+", shape=(int(offsets[-1]), 10)).flush()
+
+    totals = {}
+    tasks = [(drive, int(offset)) for drive, offset in zip(drives, offsets[:-1])]
+    with multiprocessing.Pool(processes, _init_worker, (states_path, covariances_path)) as pool:
+        for pid, frames, seconds in pool.imap_unordered(_replay_task, tasks, chunksize):
+            drive_count, frame_count, busy = totals.get(pid, (0, 0, 0.0))
+            totals[pid] = (drive_count + 1, frame_count + frames, busy + seconds)
+
+    workers = [
+        WorkerStats(pid, drive_count, frame_count, busy, frame_count / busy if busy > 0 else 0.0)
+        for pid, (drive_count, frame_count, busy) in sorted(totals.items())
+    ]
+    return ReplayResult(
+        np.lib.format.open_memmap(states_path, mode="r"),
+        np.lib.format.open_memmap(covariances_path, mode="r"),
+        offsets,
+        workers,
+    )
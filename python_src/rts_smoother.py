@@ -0,0 +1,239 @@
+"""
+Offline Rauch-Tung-Striebel smoother for recorded drives
+Runs the EstimateLaneParam model (H = I) forward over a whole log and then
+smooths it backward, both as vectorized associative scans over the frames
+"""
+from collections import namedtuple
+
+import numpy as np
+from kalman_filter import pack_covariance, unpack_covariance
+from motion_model import MATRIX_Q, MATRIX_R, build_motion_matrices_batch
+
+
+SmootherResult = namedtuple(
+    "SmootherResult",
+    ["x_smoothed", "P_smoothed", "x_filtered", "P_filtered", "x_predicted", "P_predicted"],
+)
+SmootherResult.__doc__ = """
+Output of rts_smooth; states are (T, 4) and covariances are packed
+upper triangles (T, 10), see kalman_filter.unpack_covariance
+"""
+
+
+def _transpose(M):
+    return np.swapaxes(M, -1, -2)
+
+
+def _symmetrize(M):
+    return 0.5 * (M + _transpose(M))
+
+
+def _associative_scan(combine, elements):
+    """
+    Inclusive prefix scan of an associative operator over the leading axis
+
+    Odd-even recursion: pairs are combined, the pairs are scanned
+    recursively and the remaining even prefixes are filled in, so the
+    total work is about twice one batched combine over all elements.
+
+    Args:
+        combine: combine(a, b) -> element for "a followed by b", batched
+        elements: tuple of arrays sharing the leading (time) axis
+
+    Returns:
+        tuple of arrays with the prefix element at every index
+    """
+    T = elements[0].shape[0]
+    if T < 2:
+        return elements
+
+    pairs = combine(tuple(e[0:T - 1:2] for e in elements), tuple(e[1::2] for e in elements))
+    odd = _associative_scan(combine, pairs)
+
+    result = tuple(np.empty_like(e) for e in elements)
+    for r, e, o in zip(result, elements, odd):
+        r[0] = e[0]
+        r[1::2] = o
+    if T > 2:
+        even = combine(tuple(o[:(T - 1) // 2] for o in odd), tuple(e[2::2] for e in elements))
+        for r, v in zip(result, even):
+            r[2::2] = v
+    return result
+
+
+def _combine_filter(first, second):
+    """
+    Combine two Kalman filtering elements (A, b, C, eta, J)
+
+    Parallel-in-time form of the Kalman filter (Sarkka & Garcia-Fernandez):
+    each element is a conditional Gaussian over one or more frames.
+    """
+    A_i, b_i, C_i, eta_i, J_i = first
+    A_j, b_j, C_j, eta_j, J_j = second
+
+    n = A_i.shape[-1]
+    M_inv = np.linalg.inv(np.eye(n) + C_i @ J_j)  # (I + C_i*J_j)^(-1)
+    AjM = A_j @ M_inv
+    AiTN = _transpose(A_i) @ _transpose(M_inv)  # A_i^T*(I + J_j*C_i)^(-1)
+
+    A = AjM @ A_i
+    b = (AjM @ (b_i + (C_i @ eta_j[..., None])[..., 0])[..., None])[..., 0] + b_j
+    C = _symmetrize(AjM @ C_i @ _transpose(A_j)) + C_j
+    eta = (AiTN @ (eta_j - (J_j @ b_i[..., None])[..., 0])[..., None])[..., 0] + eta_i
+    J = _symmetrize(AiTN @ J_j @ A_i) + J_i
+    return A, b, C, eta, J
+
+
+def _combine_smoother(first, second):
+    """
+    Combine two backward smoothing elements (E, g, L)
+
+    Each element is the affine map x_s = E*x_s_next + g with covariance
+    P_s = E*P_s_next*E^T + L; "first" is applied first.
+    """
+    E_i, g_i, L_i = first
+    E_j, g_j, L_j = second
+    E = E_j @ E_i
+    g = (E_j @ g_i[..., None])[..., 0] + g_j
+    L = _symmetrize(E_j @ L_i @ _transpose(E_j)) + L_j
+    return E, g, L
+
+
+def _filter_chunk(F, u, Z, valid, x_prior, P_prior, Q, R):
+    """
+    Filtered moments of one chunk of frames given the prior before it
+    """
+    T, n = u.shape
+    I = np.eye(n)
+
+    # Frames after the first: conditional elements independent of the prior
+    S_inv = np.linalg.inv(Q + R)
+    K = Q @ S_inv
+    innovation = Z - u
+    A = np.where(valid[:, None, None], (I - K) @ F, F)
+    b = u + np.where(valid[:, None], innovation @ K.T, 0.0)
+    C = np.broadcast_to(np.where(valid[:, None, None], (I - K) @ Q, Q), (T, n, n)).copy()
+    eta = np.where(valid[:, None], ((_transpose(F) @ S_inv) @ innovation[..., None])[..., 0], 0.0)
+    J = np.where(valid[:, None, None], _transpose(F) @ S_inv @ F, 0.0)
+
+    # First frame: absorb the prior, predict and (optionally) update
+    x_pred = F[0] @ x_prior + u[0]
+    P_pred = F[0] @ P_prior @ F[0].T + Q
+    A[0] = 0.0
+    eta[0] = 0.0
+    J[0] = 0.0
+    if valid[0]:
+        W = np.linalg.solve(P_pred + R, P_pred)
+        b[0] = x_pred + (Z[0] - x_pred) @ W
+        C[0] = _symmetrize(P_pred - P_pred @ W)
+    else:
+        b[0] = x_pred
+        C[0] = P_pred
+
+    _, x_filtered, P_filtered, _, _ = _associative_scan(_combine_filter, (A, b, C, eta, J))
+    return x_filtered, P_filtered
+
+
+def _smooth_chunk(F_next, x_filtered, P_filtered, x_pred_next, P_pred_next, x_after, P_after):
+    """
+    Smoothed moments of one chunk given the smoothed moments after it
+
+    F_next, x_pred_next and P_pred_next belong to the frame following each
+    frame of the chunk; x_after/P_after is the smoothed state of the frame
+    following the chunk.
+    """
+    # Smoother gain: E = P_f*F^T*P_pred^(-1)
+    E = _transpose(np.linalg.solve(P_pred_next, F_next @ P_filtered))
+    g = x_filtered - (E @ x_pred_next[..., None])[..., 0]
+    L = _symmetrize(P_filtered - E @ P_pred_next @ _transpose(E))
+
+    # Scan backward in time, then apply the composite maps to the state after the chunk
+    E, g, L = _associative_scan(_combine_smoother, (E[::-1], g[::-1], L[::-1]))
+    x_smoothed = E @ x_after + g
+    P_smoothed = _symmetrize(E @ P_after @ _transpose(E)) + L
+    return x_smoothed[::-1], P_smoothed[::-1]
+
+
+def rts_smooth(speeds, look_forward_times, ws, matrix_Z, valid, matrix_X, matrix_P,
+               Q=MATRIX_Q, R=MATRIX_R, chunk_size=65536):
+    """
+    Rauch-Tung-Striebel smoothing of a recorded drive
+
+    Frame k predicts with the motion model of (speeds[k], look_forward_times[k],
+    ws[k]) and is updated with matrix_Z[k] when valid[k], exactly like
+    EstimateLaneParam.predict / predict_and_update. Both passes are
+    associative scans, processed in chunks of chunk_size frames to bound
+    the working memory.
+
+    Args:
+        speeds: vehicle speed per frame, shape (T,)
+        look_forward_times: look forward time, scalar or shape (T,)
+        ws: angular velocity per frame, shape (T,)
+        matrix_Z: measurement per frame, shape (T, 4); ignored where not valid
+        valid: measurement availability per frame, shape (T,) bool
+        matrix_X: initial state vector before the first frame
+        matrix_P: initial error covariance matrix before the first frame
+        Q: process noise covariance matrix
+        R: measurement noise covariance matrix
+        chunk_size: frames per vectorized chunk
+
+    Returns:
+        SmootherResult; empty (0, 4) / (0, 10) arrays for an empty drive
+    """
+    speeds = np.asarray(speeds, dtype=float)
+    T = speeds.shape[0]
+    ws = np.broadcast_to(np.asarray(ws, dtype=float), (T,))
+    look_forward_times = np.broadcast_to(np.asarray(look_forward_times, dtype=float), (T,))
+    valid = np.asarray(valid, dtype=bool)
+    matrix_Z = np.where(valid[:, None], np.asarray(matrix_Z, dtype=float), 0.0)
+    n = matrix_Z.shape[1]
+    packed = n * (n + 1) // 2
+
+    x_filtered = np.empty((T, n))
+    x_predicted = np.empty((T, n))
+    x_smoothed = np.empty((T, n))
+    P_filtered = np.empty((T, packed))
+    P_predicted = np.empty((T, packed))
+    P_smoothed = np.empty((T, packed))
+    if T == 0:
+        return SmootherResult(x_smoothed, P_smoothed, x_filtered, P_filtered, x_predicted, P_predicted)
+
+    # Forward pass
+    x_prior = np.asarray(matrix_X, dtype=float).reshape(-1)
+    P_prior = np.asarray(matrix_P, dtype=float)
+    for start in range(0, T, chunk_size):
+        stop = min(start + chunk_size, T)
+        F, B = build_motion_matrices_batch(speeds[start:stop], look_forward_times[start:stop])
+        u = B[..., 0] * ws[start:stop, None]
+        x_f, P_f = _filter_chunk(F, u, matrix_Z[start:stop], valid[start:stop],
+                                 x_prior, P_prior, Q, R)
+
+        # Predicted moments: x = F*x_prev + B*u, P = F*P_prev*F^T + Q
+        x_prev = np.concatenate([x_prior[None], x_f[:-1]])
+        P_prev = np.concatenate([P_prior[None], P_f[:-1]])
+        x_predicted[start:stop] = (F @ x_prev[..., None])[..., 0] + u
+        P_predicted[start:stop] = pack_covariance(F @ P_prev @ _transpose(F) + Q)
+        x_filtered[start:stop] = x_f
+        P_filtered[start:stop] = pack_covariance(P_f)
+        x_prior, P_prior = x_f[-1], P_f[-1]
+
+    # Backward pass; the last frame is its own smoothed estimate
+    unpack = lambda P: unpack_covariance(P, n)  # noqa: E731
+    x_smoothed[-1] = x_filtered[-1]
+    P_smoothed[-1] = P_filtered[-1]
+    x_after, P_after = x_filtered[-1], unpack(P_filtered[-1])
+    stop = T - 1
+    while stop > 0:
+        start = max(stop - chunk_size, 0)
+        F_next, _ = build_motion_matrices_batch(speeds[start + 1:stop + 1],
+                                                look_forward_times[start + 1:stop + 1])
+        x_s, P_s = _smooth_chunk(
+            F_next, x_filtered[start:stop], unpack(P_filtered[start:stop]),
+            x_predicted[start + 1:stop + 1], unpack(P_predicted[start + 1:stop + 1]),
+            x_after, P_after)
+        x_smoothed[start:stop] = x_s
+        P_smoothed[start:stop] = pack_covariance(P_s)
+        x_after, P_after = x_s[0], P_s[0]
+        stop = start
+
+    return SmootherResult(x_smoothed, P_smoothed, x_filtered, P_filtered, x_predicted, P_predicted)
@@ -0,0 +1,113 @@
+"""
+Steady-state Kalman gains for constant-speed operation
+With constant speed, look forward time, Q and R the covariance recursion
+converges, so the gain can be precomputed from the discrete Riccati equation
+"""
+import bisect
+from collections import namedtuple
+
+import numpy as np
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, build_motion_matrices
+
+
+SteadyStateGain = namedtuple(
+    "SteadyStateGain",
+    ["speed", "P_predicted", "P_filtered", "K", "A_closed", "B_closed"],
+)
+
+
+def solve_discrete_riccati(F, H, Q, R, tol=1e-13, max_iter=100000):
+    """
+    Solve the filter form of the discrete algebraic Riccati equation
+
+    Iterates P = F*(P - P*H^T*S^(-1)*H*P)*F^T + Q with S = H*P*H^T + R
+    until the relative change drops below tol.
+
+    Args:
+        F: state transition matrix
+        H: measurement matrix
+        Q: process noise covariance matrix
+        R: measurement noise covariance matrix
+        tol: relative convergence tolerance (Frobenius norm)
+        max_iter: maximum number of iterations
+
+    Returns:
+        (P_predicted, P_filtered, K) at the fixed point
+    """
+    P = np.array(Q, dtype=float)
+    for _ in range(max_iter):
+        HP = H @ P
+        S = HP @ H.T + R
+        W = np.linalg.solve(S, HP)
+        P_filtered = P - HP.T @ W
+        P_filtered = 0.5 * (P_filtered + P_filtered.T)
+        P_next = F @ P_filtered @ F.T + Q
+        if np.linalg.norm(P_next - P) <= tol * np.linalg.norm(P_next):
+            HP = H @ P_next
+            W = np.linalg.solve(HP @ H.T + R, HP)
+            P_filtered = P_next - HP.T @ W
+            return P_next, 0.5 * (P_filtered + P_filtered.T), W.T
+        P = P_next
+    raise RuntimeError("Riccati iteration did not converge")
+
+
+class SteadyStateGainTable:
+    """
+    Table of steady-state gains for a set of speed bins
+
+    Each bin stores the steady-state covariances, the gain K and the
+    closed-loop matrices of the state-only step
+        x = (I - K*H)*F*x + (I - K*H)*B*u + K*z
+    """
+
+    def __init__(self, speeds, look_forward_time, speed_tolerance=1e-3,
+                 convergence_tol=1e-6, Q=MATRIX_Q, R=MATRIX_R, H=MATRIX_H):
+        """
+        Initialize the table
+
+        Args:
+            speeds: speed of each bin
+            look_forward_time: look forward time shared by all bins
+            speed_tolerance: maximum |speed - bin speed| for a bin to apply
+            convergence_tol: maximum relative distance between the current
+                             covariance and the steady-state one
+            Q: process noise covariance matrix
+            R: measurement noise covariance matrix
+            H: measurement matrix
+        """
+        self.look_forward_time_ = look_forward_time
+        self.speed_tolerance_ = speed_tolerance
+        self.convergence_tol_ = convergence_tol
+        self.speeds_ = sorted(float(speed) for speed in speeds)
+        self.entries_ = [self._build_entry(speed, Q, R, H) for speed in self.speeds_]
+
+    def _build_entry(self, speed, Q, R, H):
+        """
+        Solve the Riccati equation for one speed bin
+        """
+        F, B = build_motion_matrices(speed, self.look_forward_time_)
+        P_predicted, P_filtered, K = solve_discrete_riccati(F, H, Q, R)
+        I_KH = np.eye(F.shape[0]) - K @ H
+        return SteadyStateGain(speed, P_predicted, P_filtered, K, I_KH @ F, I_KH @ B)
+
+    def lookup(self, speed, look_forward_time):
+        """
+        Steady-state entry for the given motion data
+
+        Returns:
+            SteadyStateGain, or None when no bin covers the motion data
+        """
+        if abs(look_forward_time - self.look_forward_time_) > 1e-12:
+            return None
+        i = bisect.bisect_left(self.speeds_, speed)
+        for j in (i - 1, i):
+            if 0 <= j < len(self.speeds_) and abs(self.speeds_[j] - speed) <= self.speed_tolerance_:
+                return self.entries_[j]
+        return None
+
+    def is_converged(self, matrix_P, entry):
+        """
+        Whether a posterior covariance has reached the steady state of a bin
+        """
+        diff = np.linalg.norm(matrix_P - entry.P_filtered)
+        return diff <= self.convergence_tol_ * np.linalg.norm(entry.P_filtered)
@@ -0,0 +1,223 @@
+"""
+Tests for the batch tools working on whole recorded drives
+"""
+import numpy as np
+import golden_validator
+import lane_log
+from estimate_lane_param import EstimateLaneParam
+from kalman_filter import KalmanFilter, pack_covariance, unpack_covariance
+from motion_model import MATRIX_Q, build_motion_matrices
+from replay_runner import FrameLogDrive, ReplayDrive, replay_drive, replay_drives
+from rts_smoother import rts_smooth
+from tuning import grid_candidates, random_candidates, tune
+
+
+def make_drive(T, seed=0):
+    """
+    Synthetic drive: speeds on the model cache grid, drifting lane
+    measurements and about 20% frames without update
+    """
+    rng = np.random.default_rng(seed)
+    speeds = np.round(rng.uniform(5.0, 25.0, T), 3)
+    ws = rng.normal(0.0, 0.05, T)
+    Z = np.cumsum(rng.normal(0.0, [0.05, 0.005, 0.0005, 0.00005], (T, 4)), axis=0)
+    Z += [1.8, 0.1, 0.001, 0.000001]
+    valid = rng.random(T) > 0.2
+    return speeds, ws, Z, valid
+
+
+def test_rts_smoother_matches_sequential_reference():
+    """
+    The scan-based forward and backward passes must match a per-frame
+    filter loop and the textbook RTS recursion, across chunk boundaries and
+    through a stop (speed 0)
+    """
+    T = 300
+    speeds, ws, Z, valid = make_drive(T)
+    # Stop at a traffic light, across a chunk boundary
+    speeds[124:132] = 0.0
+    x0, P0 = np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001
+    result = rts_smooth(speeds, 0.5, ws, Z, valid, x0, P0, chunk_size=64)
+    assert np.all(np.isfinite(result.x_smoothed)) and np.all(np.isfinite(result.P_smoothed))
+
+    estimator = EstimateLaneParam()
+    X, P = x0.copy(), P0.copy()
+    x_f, P_f, x_p, P_p = [], [], [], []
+    for k in range(T):
+        F, B = build_motion_matrices(speeds[k], 0.5)
+        x_p.append(F @ X + B[:, 0] * ws[k])
+        P_p.append(F @ P @ F.T + MATRIX_Q)
+        estimator.set_motion_data(speeds[k], 0.5, ws[k])
+        if valid[k]:
+            estimator.predict_and_update(P, X, Z[k])
+        else:
+            estimator.predict(P, X)
+        x_f.append(X.copy())
+        P_f.append(P.copy())
+
+    x_s, P_s = [None] * T, [None] * T
+    x_s[-1], P_s[-1] = x_f[-1], P_f[-1]
+    for k in range(T - 2, -1, -1):
+        F, _ = build_motion_matrices(speeds[k + 1], 0.5)
+        E = P_f[k] @ F.T @ np.linalg.inv(P_p[k + 1])
+        x_s[k] = x_f[k] + E @ (x_s[k + 1] - x_p[k + 1])
+        P_s[k] = P_f[k] + E @ (P_s[k + 1] - P_p[k + 1]) @ E.T
+
+    assert np.allclose(result.x_predicted, x_p, rtol=1e-8, atol=1e-9)
+    assert np.allclose(result.x_filtered, x_f, rtol=1e-8, atol=1e-9)
+    assert np.allclose(unpack_covariance(result.P_filtered), P_f, rtol=1e-8, atol=1e-9)
+    assert np.allclose(result.x_smoothed, x_s, rtol=1e-8, atol=1e-9)
+    assert np.allclose(unpack_covariance(result.P_smoothed), P_s, rtol=1e-7, atol=1e-9)
+
+    empty = rts_smooth(np.zeros(0), 0.5, np.zeros(0), np.zeros((0, 4)), np.zeros(0, dtype=bool), x0, P0)
+    assert empty.x_smoothed.shape == (0, 4) and empty.P_predicted.shape == (0, 10)
+
+
+def test_replay_drives_writes_shared_outputs(tmp_path):
+    """
+    Parallel replay must produce the same estimates as a sequential replay
+    """
+    drives = []
+    for seed, T in enumerate([40, 7, 25]):
+        speeds, ws, Z, valid = make_drive(T, seed)
+        drives.append(ReplayDrive(speeds, 0.5, ws, Z, valid,
+                                  np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001))
+
+    result = replay_drives(drives, str(tmp_path), processes=2)
+
+    assert list(result.offsets) == [0, 40, 47, 72]
+    assert sum(worker.frames for worker in result.workers) == 72
+    for i, drive in enumerate(drives):
+        T = len(drive.speeds)
+        states, covariances = np.empty((T, 4)), np.empty((T, 10))
+        replay_drive(drive, states, covariances)
+        rows = slice(result.offsets[i], result.offsets[i + 1])
+        assert np.array_equal(result.states[rows], states)
+        assert np.array_equal(result.covariances[rows], covariances)
+
+
+def test_lane_log_round_trip_feeds_stream_and_replay(tmp_path):
+    """
+    Frame logs are consumed through memory maps by the streaming API and
+    the replay runner; estimate logs round-trip the packed covariance
+    """
+    T = 30
+    speeds, ws, Z, valid = make_drive(T, seed=3)
+    timestamps = np.arange(T) * 0.05
+    frame_path = str(tmp_path / "drive.lanelog")
+    lane_log.write_frames(frame_path, timestamps, speeds, ws, 0.5, Z, valid)
+
+    records = lane_log.open_log(frame_path, lane_log.KIND_FRAMES)
+    assert np.array_equal(records["z"], Z) and np.array_equal(records["valid"], valid)
+
+    x0, P0 = np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001
+    X, P = x0.copy(), P0.copy()
+    states, packed = np.empty((T, 4)), np.empty((T, 10))
+    for k, (_, _, matrix_P) in enumerate(EstimateLaneParam().stream(lane_log.iter_frames(records, 8), X, P)):
+        states[k] = X
+        packed[k] = pack_covariance(matrix_P)
+
+    estimate_path = str(tmp_path / "estimates.lanelog")
+    lane_log.write_estimates(estimate_path, timestamps, states, packed)
+    estimates = lane_log.open_log(estimate_path, lane_log.KIND_ESTIMATES)
+    assert np.array_equal(estimates["x"], states)
+    assert np.array_equal(unpack_covariance(estimates["p_upper"])[-1], P)
+
+    result = replay_drives([FrameLogDrive(frame_path, x0, P0)], str(tmp_path), processes=1)
+    assert np.allclose(result.states, states, rtol=1e-12, atol=1e-15)
+
+
+def test_tuning_scores_match_per_candidate_filter():
+    """
+    Batched candidate evaluation must give the NIS and reference error of
+    a separate KalmanFilter run per candidate, summed over drives
+    """
+    T = 120
+    speeds, ws, Z, valid = make_drive(T, seed=4)
+    x0, P0 = np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001
+    drive = ReplayDrive(speeds, 0.5, ws, Z, valid, x0, P0)
+    reference = Z + 0.01
+    q, r = grid_candidates([1e-4, 1e-3], [0.01, [0.1, 0.01, 0.001, 0.0001]])
+    q_random, r_random = random_candidates(5, seed=0)
+    q, r = np.concatenate([q, q_random]), np.concatenate([r, r_random])
+
+    result = tune([drive, drive], q, r, references=[reference, reference],
+                  processes=2, chunk_size=3, burn_in=10)
+
+    for c in range(q.shape[0]):
+        X, P = x0.copy(), P0.copy()
+        nis, squared_error = [], []
+        for k in range(T):
+            A, B = build_motion_matrices(speeds[k], 0.5)
+            kf = KalmanFilter(A, B, np.eye(4), P, np.diag(q[c]), np.diag(r[c]), X, np.array([[ws[k]]]))
+            kf.predict()
+            if valid[k]:
+                y, S = kf.innovation(Z[k])
+                nis.append(y @ np.linalg.solve(S, y))
+                kf.update(Z[k])
+            X, P = kf.x_, kf.P_
+            squared_error.append((X - reference[k]) ** 2)
+        burn_in_updates = int(np.count_nonzero(valid[:10]))
+        assert np.isclose(result.nis_mean[c], np.mean(nis[burn_in_updates:]), rtol=1e-9)
+        assert np.allclose(result.rmse[c], np.sqrt(np.mean(squared_error[10:], axis=0)), rtol=1e-9)
+
+    assert q.shape == (9, 4) and np.all((r_random >= 1e-4) & (r_random <= 1.0))
+    assert result.rmse_score.min() >= 0.0
+    assert np.allclose(result.score, result.nis_score + result.rmse_score)
+
+    # Noise-free reference: the state never leaves x0, so every RMSE is 0
+    x0 = np.array([1.8, 0.0, 0.0, 0.0])
+    still = ReplayDrive(speeds, 0.5, np.zeros(T), np.tile(x0, (T, 1)), valid, x0, P0)
+    exact = tune([still], q, r, references=[np.tile(x0, (T, 1))], processes=1)
+    assert np.all(exact.rmse == 0.0) and np.all(exact.rmse_score == 0.0)
+    assert np.all(np.isfinite(exact.score))
+
+
+CPP_LOG = b"""matrix_X_init =   1.8
+  0.1
+0.001
+1e-06
+predict x_:  1.98162
+ 0.101802
+0.0010018
+    1e-06
+matrix_X_res =      1.9808
+   0.102254
+ 0.00150389
+0.000227482
+matrix_X_res =    2.21254
+  0.124447
+ 0.0299768
+0.00420442
+"""
+
+
+def test_golden_validator_finds_first_divergent_frame(tmp_path, capsys):
+    """
+    The validator parses C++/Python text logs, estimate logs and .npy files
+    and reports the first frame outside the tolerance
+    """
+    assert np.array_equal(golden_validator.parse_text_log(CPP_LOG),
+                          [[1.9808, 0.102254, 0.00150389, 0.000227482],
+                           [2.21254, 0.124447, 0.0299768, 0.00420442]])
+    python_log = b"predict x_: [1.98e+00 1.0e-01 1.0e-03 1.0e-06]\nmatrix_X_res = [1.98080223e+00 1.02254359e-01 1.50389205e-03 2.27482064e-04]\n"
+    report = golden_validator.validate(golden_validator.parse_text_log(CPP_LOG)[:1],
+                                       golden_validator.parse_text_log(python_log))
+    assert report.passed and report.frames == 1
+
+    rng = np.random.default_rng(8)
+    reference = rng.normal(size=(1000, 4))
+    actual = reference * (1.0 + 1e-12)
+    actual[[600, 900], 2] += 1e-3
+    np.save(tmp_path / "golden.npy", reference)
+    lane_log.write_estimates(tmp_path / "replay.bin", np.arange(1000.0), actual, np.zeros((1000, 10)))
+
+    report = golden_validator.validate(golden_validator.load_states(tmp_path / "golden.npy"),
+                                       golden_validator.load_states(tmp_path / "replay.bin"))
+    assert not report.passed
+    assert report.divergent_frames == 2 and report.first_divergent == 600
+    assert np.isclose(report.max_abs[2], 1e-3, rtol=1e-6)
+
+    assert golden_validator.main([str(tmp_path / "golden.npy"), str(tmp_path / "replay.bin")]) == 1
+    assert "first divergent frame: 600" in capsys.readouterr().out
+    assert golden_validator.main([str(tmp_path / "golden.npy"), str(tmp_path / "golden.npy")]) == 0
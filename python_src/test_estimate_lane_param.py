@@ -0,0 +1,442 @@
+"""
+Tests for the lane parameter estimator built on the Kalman Filter
+"""
+import numpy as np
+import pytest
+import checkpoint
+import lane_curve
+import measurement_fit
+from estimate_lane_param import EstimateLaneParam, LaneParamBatch, LaneParamInfo
+from instrumentation import FilterInstrumentation
+from motion_model import MotionModelCache, build_motion_matrices
+from steady_state import SteadyStateGainTable
+from timed_estimator import TimedEstimateLaneParam
+
+
+def initial_state():
+    """
+    Initial state and covariance used by main.py
+    """
+    return np.array([1.8, 0.1, 0.001, 0.000001]), np.eye(4) * 0.001
+
+
+def test_model_cache_hits_and_eviction():
+    """
+    Quantized keys share one model and the LRU bound is respected
+    """
+    cache = MotionModelCache(maxsize=2, resolution=1e-3)
+    A, B = cache.get(3.6, 0.5)
+    A_again, _ = cache.get(3.6000001, 0.5)
+    cache.get(10.0, 0.5)
+    cache.get(20.0, 0.5)
+
+    assert A is A_again
+    assert cache.cache_info() == (1, 3, 2, 2)
+    assert np.array_equal(A, build_motion_matrices(3.6, 0.5)[0])
+    assert not A.flags.writeable and not B.flags.writeable
+
+
+def test_set_motion_data_swaps_model():
+    """
+    Changing speed on an existing estimator must use the new model,
+    exactly as a freshly created estimator would
+    """
+    cache = MotionModelCache()
+    estimator = EstimateLaneParam(model_cache=cache)
+    matrix_X, matrix_P = initial_state()
+    estimator.set_motion_data(3.6, 0.5, 0.0)
+    estimator.predict(matrix_P, matrix_X)
+    estimator.set_motion_data(12.0, 0.5, 0.05)
+    estimator.predict(matrix_P, matrix_X)
+
+    fresh_X, fresh_P = initial_state()
+    first = EstimateLaneParam(model_cache=cache)
+    first.set_motion_data(3.6, 0.5, 0.0)
+    first.predict(fresh_P, fresh_X)
+    second = EstimateLaneParam(model_cache=cache)
+    second.set_motion_data(12.0, 0.5, 0.05)
+    second.predict(fresh_P, fresh_X)
+
+    assert np.array_equal(matrix_X, fresh_X)
+    assert np.array_equal(matrix_P, fresh_P)
+    assert estimator.model_cache_info().hits == 2
+
+
+def test_steady_state_gains_match_full_recursion():
+    """
+    After convergence the steady-state step must track the full recursion,
+    and a speed outside the table must fall back to it
+    """
+    table = SteadyStateGainTable([10.0, 20.0, 30.0], 0.5)
+    steady = EstimateLaneParam()
+    steady.enable_steady_state(table)
+    full = EstimateLaneParam()
+    X_steady, P_steady = initial_state()
+    X_full, P_full = initial_state()
+    rng = np.random.default_rng(7)
+
+    for step in range(300):
+        speed = 20.0 if step < 250 else 25.0
+        z = X_full + rng.normal(0.0, [0.1, 0.01, 0.001, 0.0001])
+        for estimator, X, P in ((steady, X_steady, P_steady), (full, X_full, P_full)):
+            estimator.set_motion_data(speed, 0.5, 0.01)
+            estimator.predict_and_update(P, X, z)
+        if step == 249:
+            steps_at_switch = steady.steady_state_steps_
+            assert steps_at_switch > 100
+            assert np.allclose(X_steady, X_full, rtol=1e-4, atol=1e-6)
+
+    assert steady.steady_state_steps_ == steps_at_switch
+    assert np.allclose(X_steady, X_full, rtol=1e-4, atol=1e-6)
+    assert np.allclose(P_steady, P_full, rtol=1e-4, atol=1e-9)
+
+
+def test_stream_matches_manual_loop():
+    """
+    Streaming over frames must reproduce the hand-written main.py loop
+    """
+    frames = [
+        (0.1 * i, 3.6, 0.5, 0.0,
+         None if i == 5 else np.array([1.95 + 0.3 * i, 0.13 + 0.01 * i, 0.006 + 0.001 * i, 0.000001]))
+        for i in range(10)
+    ]
+
+    manual = EstimateLaneParam()
+    X_manual, P_manual = initial_state()
+    expected = []
+    for timestamp, speed, look_forward_time, w, matrix_Z in frames:
+        manual.set_motion_data(speed, look_forward_time, w)
+        manual.predict(P_manual, X_manual)
+        if matrix_Z is not None:
+            manual.update(P_manual, X_manual, matrix_Z)
+        expected.append((timestamp, X_manual.copy(), P_manual.copy()))
+
+    X_stream, P_stream = initial_state()
+    results = list(EstimateLaneParam().stream(iter(frames), X_stream, P_stream, copy=True))
+
+    assert len(results) == len(expected)
+    for (timestamp, lane_param, matrix_P), (ts, X, P) in zip(results, expected):
+        assert timestamp == ts
+        assert np.allclose([lane_param.c0_, lane_param.c1_, lane_param.c2_, lane_param.c3_], X,
+                           rtol=1e-12, atol=1e-15)
+        assert np.allclose(matrix_P, P, rtol=1e-12, atol=1e-15)
+
+
+def test_lane_param_views_share_memory():
+    """
+    LaneParamInfo and LaneParamBatch convert to and from arrays without copies
+    """
+    matrix_X, _ = initial_state()
+    lane_param = LaneParamInfo.from_array(matrix_X)
+    lane_param.c2_ = 0.5
+    assert matrix_X[2] == 0.5 and lane_param.as_array() is matrix_X
+    assert not hasattr(lane_param, "__dict__")
+
+    states = np.arange(24.0).reshape(3, 2, 4)  # (frames, lanes, 4)
+    batch = LaneParamBatch.from_states(states)
+    assert batch.shape == (3, 2) and batch.c1_.flags.c_contiguous
+    assert np.array_equal(batch.c3_, states[..., 3])
+    assert np.array_equal(batch.states(), states)
+
+    lane = batch[1, 0]
+    lane.c0_ = -1.0
+    assert batch.c0_[1, 0] == -1.0
+    batch.set_states(2, np.zeros((2, 4)))
+    assert np.array_equal(batch[2].states(), np.zeros((2, 4)))
+
+
+def test_instrumentation_counts_stages_without_changing_results():
+    """
+    Instrumented streaming records timings, counters and NIS per update
+    and produces exactly the uninstrumented estimates
+    """
+    frames = [
+        (i, 3.6, 0.5, 0.0,
+         None if i == 5 else np.array([1.95 + 0.3 * i, 0.13 + 0.01 * i, 0.006 + 0.001 * i, 0.000001]))
+        for i in range(10)
+    ]
+    instrumentation = FilterInstrumentation(capacity=8)
+    X_plain, P_plain = initial_state()
+    X_timed, P_timed = initial_state()
+    for _ in EstimateLaneParam().stream(iter(frames), X_plain, P_plain):
+        pass
+    for _ in EstimateLaneParam(instrumentation=instrumentation).stream(iter(frames), X_timed, P_timed):
+        pass
+
+    assert np.array_equal(X_plain, X_timed) and np.array_equal(P_plain, P_timed)
+    snapshot = instrumentation.snapshot()
+    assert snapshot.counters == {"updates": 9, "skips": 1}
+    assert snapshot.stages["predict"].count == 10
+    assert snapshot.stages["update"].count == 9
+    assert snapshot.stages["initialize"].count == 1
+    # Ring buffers keep only the most recent `capacity` values
+    assert snapshot.stages["step"].histogram.counts.sum() == 8
+    assert snapshot.nis.counts.sum() == 8 and snapshot.nis_mean > 0
+
+
+def test_scalar_engine_matches_numpy_engine():
+    """
+    EstimateLaneParam(engine="scalar") runs the main.py loop like the default engine
+    """
+    results = []
+    for engine in ("numpy", "scalar"):
+        matrix_X, matrix_P = initial_state()
+        for i in range(10):
+            estimator = EstimateLaneParam(engine=engine)
+            estimator.set_motion_data(3.6, 0.5, 0.0)
+            estimator.predict(matrix_P, matrix_X)
+            if i != 5:
+                estimator.update(matrix_P, matrix_X, np.array([1.95 + 0.3 * i, 0.13 + 0.01 * i,
+                                                               0.006 + 0.001 * i, 0.000001]))
+        results.append((matrix_X, matrix_P))
+
+    (X_numpy, P_numpy), (X_scalar, P_scalar) = results
+    assert np.allclose(X_scalar, X_numpy, rtol=1e-12, atol=1e-15)
+    assert np.allclose(P_scalar, P_numpy, rtol=1e-12, atol=1e-15)
+
+
+def test_timed_estimator_matches_fixed_steps():
+    """
+    Timestamps one look forward time apart reproduce the fixed-step estimator
+    """
+    X_fixed, P_fixed = initial_state()
+    fixed = EstimateLaneParam()
+    fixed.set_motion_data(3.6, 0.5, 0.0)
+    timed = TimedEstimateLaneParam()
+    timed.set_motion_data(3.6, 0.5, 0.0)
+    timed.reset(0.0, *initial_state())
+
+    for i in range(10):
+        matrix_Z = np.array([1.95 + 0.3 * i, 0.13 + 0.01 * i, 0.006 + 0.001 * i, 0.000001])
+        if i == 5:
+            fixed.predict(P_fixed, X_fixed)
+            timed.predict_to(0.5 * (i + 1))
+        else:
+            fixed.predict_and_update(P_fixed, X_fixed, matrix_Z)
+            timed.update_at(0.5 * (i + 1), matrix_Z)
+
+    assert np.allclose(timed.matrix_X_, X_fixed, rtol=1e-12, atol=1e-15)
+    assert np.allclose(timed.matrix_P_, P_fixed, rtol=1e-12, atol=1e-15)
+
+
+def test_timed_estimator_fuses_late_measurements():
+    """
+    A delayed measurement within the history gives the in-order result;
+    one older than the history is dropped
+    """
+    rng = np.random.default_rng(3)
+    timestamps = np.cumsum(rng.uniform(0.03, 0.07, 40))
+    matrix_X, _ = initial_state()
+    measurements = matrix_X + rng.normal(0.0, [0.1, 0.01, 0.001, 0.0001], (40, 4))
+
+    def run(order):
+        estimator = TimedEstimateLaneParam(history_size=16)
+        estimator.set_motion_data(8.0, 0.05, 0.01)
+        estimator.reset(0.0, *initial_state())
+        fused = [estimator.update_at(timestamps[k], measurements[k]) for k in order]
+        return estimator, fused
+
+    in_order, _ = run(range(40))
+    late_order = list(range(40))
+    late_order.remove(20)
+    late_order.insert(23, 20)
+    late, fused = run(late_order)
+
+    assert all(fused) and late.refiltered_steps_ == 3
+    assert np.allclose(late.matrix_X_, in_order.matrix_X_, rtol=1e-12, atol=1e-15)
+    assert np.allclose(late.matrix_P_, in_order.matrix_P_, rtol=1e-12, atol=1e-15)
+
+    X_before = late.matrix_X_.copy()
+    assert not late.update_at(timestamps[2], measurements[2])
+    assert late.dropped_measurements_ == 1 and np.array_equal(late.matrix_X_, X_before)
+
+
+def test_checkpoint_restores_estimators_and_filters(tmp_path):
+    """
+    Restored estimators and filters continue bit-for-bit where the
+    checkpointed ones stopped, for single blobs and batch files
+    """
+    rng = np.random.default_rng(8)
+    tracks = []
+    for engine in ("numpy", "scalar", "numpy"):
+        estimator = EstimateLaneParam(engine=engine)
+        matrix_X, matrix_P = initial_state()
+        for _ in range(5):
+            estimator.set_motion_data(round(rng.uniform(5.0, 20.0), 3), 0.5, rng.normal(0.0, 0.05))
+            estimator.predict_and_update(matrix_P, matrix_X, matrix_X + rng.normal(0.0, 0.05, 4))
+        tracks.append((estimator, matrix_X, matrix_P))
+
+    checkpoint.write_checkpoint(tmp_path / "tracks.ckpt", [estimator for estimator, _, _ in tracks])
+    restored = checkpoint.read_checkpoint(tmp_path / "tracks.ckpt")
+    single = checkpoint.load_estimator(checkpoint.save_estimator(tracks[0][0]))
+    matrix_Z = np.array([2.0, 0.1, 0.002, 0.000001])
+
+    for (estimator, X, P), (copy, X_copy, P_copy) in zip(tracks + tracks[:1], restored + [single]):
+        assert copy.engine_ == estimator.engine_ and copy.speed_ == estimator.speed_
+        X, P = X.copy(), P.copy()
+        estimator.predict_and_update(P, X, matrix_Z)
+        copy.predict_and_update(P_copy, X_copy, matrix_Z)
+        assert np.array_equal(X_copy, X) and np.array_equal(P_copy, P)
+
+    kf = tracks[0][0].kalman_
+    kf_copy = checkpoint.load_filter(checkpoint.save_filter(kf))
+    for attribute in ("F_", "B_", "H_", "Q_", "R_", "x_", "P_"):
+        assert np.array_equal(getattr(kf_copy, attribute), getattr(kf, attribute))
+
+    with pytest.raises(ValueError):
+        checkpoint.load_filter(checkpoint.save_estimator(tracks[0][0]))
+
+
+def test_checkpoint_after_steady_state_steps():
+    """
+    A checkpoint taken after steady-state steps restores the live state
+    """
+    table = SteadyStateGainTable([3.6], 0.5)
+    estimator = EstimateLaneParam()
+    estimator.enable_steady_state(table)
+    estimator.set_motion_data(3.6, 0.5, 0.0)
+    matrix_X, matrix_P = initial_state()
+    for i in range(200):
+        estimator.predict_and_update(matrix_P, matrix_X, np.array([1.95 + 0.01 * i, 0.13, 0.006, 0.000001]))
+    assert estimator.steady_state_steps_ > 100
+    # Steady-state steps leave the filter behind until it is needed
+    assert estimator.pending_state_ is not None
+    assert not np.array_equal(estimator.kalman_.x_, matrix_X)
+
+    copy, X_copy, P_copy = checkpoint.load_estimator(checkpoint.save_estimator(estimator))
+    assert np.array_equal(X_copy, matrix_X) and np.array_equal(P_copy, matrix_P)
+    # Gain tables are not checkpointed
+    copy.enable_steady_state(table)
+    matrix_Z = np.array([4.0, 0.13, 0.006, 0.000001])
+    estimator.predict_and_update(matrix_P, matrix_X, matrix_Z)
+    copy.predict_and_update(P_copy, X_copy, matrix_Z)
+    assert np.array_equal(X_copy, matrix_X) and np.array_equal(P_copy, matrix_P)
+
+
+def test_predict_horizon_matches_repeated_predict():
+    """
+    predict_horizon equals K predict() calls on copies and mutates nothing
+    """
+    estimator = EstimateLaneParam()
+    estimator.set_motion_data(12.3, 0.5, 0.03)
+    matrix_X, matrix_P = initial_state()
+    estimator.predict(matrix_P, matrix_X)
+    X_before, P_before = matrix_X.copy(), matrix_P.copy()
+
+    states, covariances = estimator.predict_horizon(20, matrix_X, matrix_P)
+    means_only, none = estimator.predict_horizon(20, matrix_X, with_covariance=False)
+
+    assert np.array_equal(matrix_X, X_before) and np.array_equal(matrix_P, P_before)
+    assert none is None and np.array_equal(means_only, states)
+    X, P = matrix_X.copy(), matrix_P.copy()
+    for k in range(20):
+        estimator.predict(P, X)
+        assert np.allclose(states[k], X, rtol=1e-12, atol=1e-15)
+        assert np.allclose(covariances[k], P, rtol=1e-12, atol=1e-15)
+
+
+def test_lane_curves_match_pointwise_evaluation():
+    """
+    Batched curves and sigma bands equal the per-lane, per-point formulas
+    """
+    rng = np.random.default_rng(3)
+    states = rng.normal(size=(5, 3, 4)) * np.array([1.0, 0.1, 1e-3, 1e-5])
+    roots = rng.normal(size=(5, 3, 4, 4))
+    covariances = roots @ np.swapaxes(roots, -1, -2) * 1e-3
+    grid = lane_curve.lane_grid(50.0, 11)
+    assert lane_curve.lane_grid(50.0, 11) is grid
+
+    y, sigma = lane_curve.evaluate_lanes(states, grid, covariances)
+    batch_y, none = lane_curve.evaluate_lanes(LaneParamBatch.from_states(states), grid.x)
+
+    assert y.shape == sigma.shape == (5, 3, 11) and none is None
+    assert np.allclose(batch_y, y, rtol=1e-12, atol=1e-12)
+    for index in np.ndindex(5, 3):
+        c0, c1, c2, c3 = states[index]
+        for j, x in enumerate(grid.x):
+            phi = np.array([1.0, x, x * x, x ** 3])
+            assert np.isclose(y[index][j], c0 + c1 * x + c2 * x * x + c3 * x ** 3, rtol=1e-12, atol=1e-12)
+            assert np.isclose(sigma[index][j], np.sqrt(phi @ covariances[index] @ phi), rtol=1e-10)
+    single, _ = lane_curve.evaluate_lanes(LaneParamInfo.from_array(states[0, 0]), grid)
+    assert np.allclose(single, y[0, 0], rtol=1e-12, atol=1e-12)
+
+
+def test_cubic_fits_match_polyfit_and_stream():
+    """
+    Batched fits equal per-lane weighted polyfit, in one or many chunks
+    """
+    rng = np.random.default_rng(5)
+    lanes, points = 6, 40
+    x = rng.uniform(2.0, 80.0, (lanes, points))
+    w = rng.uniform(0.5, 2.0, (lanes, points))
+    y = 1.5 + 0.02 * x - 4e-4 * x ** 2 + 2e-6 * x ** 3 + rng.normal(size=x.shape) * 0.05
+    index = np.repeat(np.arange(lanes), points)
+
+    fit = measurement_fit.fit_lanes(index, x.ravel(), y.ravel(), lanes + 1, w.ravel())
+    accumulator = measurement_fit.CubicFitAccumulator(lanes + 1)
+    order = rng.permutation(index.size)
+    for chunk in np.array_split(order, 7):
+        accumulator.add_points(index[chunk], x.ravel()[chunk], y.ravel()[chunk], w.ravel()[chunk])
+    streamed = accumulator.solve()
+
+    assert fit.valid.tolist() == [True] * lanes + [False]
+    assert np.isnan(fit.z[-1]).all() and fit.count[-1] == 0
+    assert np.allclose(streamed.z[:lanes], fit.z[:lanes], rtol=1e-9, atol=1e-12)
+    for lane in range(lanes):
+        coefficients, covariance = np.polyfit(x[lane], y[lane], 3, w=np.sqrt(w[lane]), cov=True)
+        sigma = np.sqrt(np.diag(covariance))[::-1]
+        assert np.all(np.abs(fit.z[lane] - coefficients[::-1]) < 1e-8 * sigma)
+        assert np.allclose(fit.r[lane], covariance[::-1, ::-1], rtol=1e-6)
+
+
+def test_update_with_measurement_noise_override():
+    """
+    update(..., matrix_R) uses the given R once and keeps the fixed R after
+    """
+    estimator = EstimateLaneParam()
+    estimator.set_motion_data(12.3, 0.5, 0.03)
+    matrix_X, matrix_P = initial_state()
+    estimator.predict(matrix_P, matrix_X)
+    matrix_Z = np.array([1.9, 0.12, 0.0012, 0.000002])
+    matrix_R = np.diag([0.02, 1e-4, 1e-6, 1e-9]) + 1e-7
+
+    X, P = matrix_X.copy(), matrix_P.copy()
+    estimator.update(P, X, matrix_Z, matrix_R)
+    S = matrix_P + matrix_R
+    K = matrix_P @ np.linalg.inv(S)
+    assert np.allclose(X, matrix_X + K @ (matrix_Z - matrix_X), rtol=1e-10, atol=1e-15)
+    assert np.allclose(P, matrix_P - K @ matrix_P, rtol=1e-9, atol=1e-15)
+
+    assert estimator.kalman_.R_ is estimator.matrix_R_
+    X_fixed, P_fixed = matrix_X.copy(), matrix_P.copy()
+    estimator.update(P_fixed, X_fixed, matrix_Z)
+    assert not np.allclose(X_fixed, X)
+
+
+@pytest.mark.parametrize("engine", EstimateLaneParam.ENGINES)
+def test_update_points_fuses_raw_lane_points(engine):
+    """
+    update_points equals a standard update with H = [phi(x_i)^T] per frame,
+    with a varying number of points and no change for an empty frame
+    """
+    rng = np.random.default_rng(11)
+    estimator = EstimateLaneParam(engine=engine)
+    estimator.set_motion_data(12.3, 0.5, 0.03)
+    matrix_X, matrix_P = initial_state()
+    for count in (8, 12, 0, 5):
+        estimator.predict(matrix_P, matrix_X)
+        x = rng.uniform(2.0, 20.0, count)
+        y = np.vander(x, 4, increasing=True) @ [1.85, 0.09, 0.0011, 0.000002] + rng.normal(size=count) * 0.1
+        variances = rng.uniform(0.005, 0.02, count)
+
+        X_before, P_before = matrix_X.copy(), matrix_P.copy()
+        estimator.update_points(matrix_P, matrix_X, x, y, variances)
+        if count == 0:
+            assert np.array_equal(matrix_X, X_before) and np.array_equal(matrix_P, P_before)
+            continue
+        phi = np.vander(x, 4, increasing=True)
+        S = phi @ P_before @ phi.T + np.diag(variances)
+        K = P_before @ phi.T @ np.linalg.inv(S)
+        assert np.allclose(matrix_X, X_before + K @ (y - phi @ X_before), rtol=1e-6, atol=1e-12)
+        # The reference subtracts from a much larger prior P and loses digits
+        assert np.allclose(matrix_P, P_before - K @ phi @ P_before, rtol=1e-5, atol=1e-10)
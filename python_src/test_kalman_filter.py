@@ -0,0 +1,221 @@
+"""
+Tests for the Kalman Filter core and its batched variants
+"""
+import numpy as np
+import pytest
+import comparison_analysis
+from estimate_lane_param import LaneParamBatch
+from kalman_filter import KalmanFilter, KalmanFilterBank
+from lane_filter import LaneKalmanFilter
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, MotionModelCache
+
+
+def make_lane_model(speed, look_forward_time):
+    """
+    Build the lane motion model used by EstimateLaneParam
+    """
+    dx = speed * look_forward_time
+    A = np.array([
+        [1.0, dx, dx ** 2 / 2, dx ** 3 / 6],
+        [0.0, 1.0, dx, dx ** 2 / 2],
+        [0.0, 0.0, 1.0, dx],
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+    B = np.zeros((4, 1))
+    B[0, 0] = -dx ** 2 / (2 * speed)
+    B[1, 0] = -look_forward_time
+    return A, B, np.eye(4), np.eye(4) * 0.001, np.eye(4) * 0.1
+
+
+def make_filters(count, seed=0):
+    """
+    Create independent lane filters with random states and speeds
+    """
+    rng = np.random.default_rng(seed)
+    filters = []
+    for _ in range(count):
+        A, B, H, Q, R = make_lane_model(rng.uniform(1.0, 30.0), 0.5)
+        x = rng.normal(0.0, [1.0, 0.1, 0.01, 0.001])
+        P = np.eye(4) * rng.uniform(0.001, 0.1)
+        u = np.array([[rng.normal(0.0, 0.1)]])
+        filters.append(KalmanFilter(A, B, H, P, Q, R, x, u))
+    return filters
+
+
+def test_bank_matches_individual_filters():
+    """
+    A bank with per-lane models must reproduce N separate filters,
+    including frames where some lanes have no measurement
+    """
+    filters = make_filters(8)
+    bank = KalmanFilterBank.from_filters(filters)
+    rng = np.random.default_rng(1)
+
+    for step in range(20):
+        z = rng.normal(0.0, [1.0, 0.1, 0.01, 0.001], size=(8, 4))
+        mask = rng.random(8) > 0.3
+        bank.predict()
+        bank.update(z, mask)
+        for i, kf in enumerate(filters):
+            kf.predict()
+            if mask[i]:
+                kf.update(z[i])
+
+        assert np.allclose(bank.x_, np.stack([kf.x_ for kf in filters]), rtol=1e-12, atol=1e-14)
+        assert np.allclose(bank.P_, np.stack([kf.P_ for kf in filters]), rtol=1e-12, atol=1e-14)
+
+
+def test_bank_shared_model_broadcasts():
+    """
+    Shared model matrices and a shared control input broadcast over all lanes
+    """
+    A, B, H, Q, R = make_lane_model(3.6, 0.5)
+    x = np.tile([1.8, 0.1, 0.001, 0.000001], (5, 1))
+    P = np.tile(np.eye(4) * 0.001, (5, 1, 1))
+    bank = KalmanFilterBank(A, B, H, P, Q, R, x, np.array([[0.0]]))
+    single = KalmanFilter(A, B, H, P[0].copy(), Q, R, x[0].copy(), np.array([[0.0]]))
+
+    z = np.array([1.95, 0.13, 0.006, 0.000001])
+    bank.predict()
+    bank.update(np.tile(z, (5, 1)))
+    single.predict()
+    single.update(z)
+
+    assert bank.size == 5
+    assert np.allclose(bank.x_, single.x_, rtol=1e-12)
+    assert np.allclose(bank.P_, single.P_, rtol=1e-12)
+
+
+def test_workspace_mode_matches_default(capsys):
+    """
+    The preallocated in-place path must match the allocating path,
+    keep its buffers and stay silent unless a log hook is given
+    """
+    reference = make_filters(1, seed=3)[0]
+    A, B, H, Q, R = reference.F_, reference.B_, reference.H_, reference.Q_, reference.R_
+    events = []
+    fast = KalmanFilter(A, B, H, reference.P_.copy(), Q, R, reference.x_.copy(), reference.u_,
+                        use_workspace=True, log_hook=lambda stage, x: events.append(stage))
+    x_buffer, P_buffer = fast.x_, fast.P_
+    rng = np.random.default_rng(4)
+
+    for _ in range(10):
+        z = rng.normal(0.0, [1.0, 0.1, 0.01, 0.001])
+        reference.predict()
+        reference.update(z)
+        fast.predict()
+        fast.update(z)
+
+    assert np.allclose(fast.x_, reference.x_, rtol=1e-12, atol=1e-15)
+    assert np.allclose(fast.P_, reference.P_, rtol=1e-12, atol=1e-15)
+    assert fast.x_ is x_buffer and fast.P_ is P_buffer
+    assert events == ["predict", "update"] * 10
+    assert capsys.readouterr().out == ""
+
+
+def test_update_engines_agree_and_keep_P_symmetric():
+    """
+    The solve, Joseph and sequential engines must match the inverse engine
+    and keep P symmetric positive definite
+    """
+    template = make_filters(1, seed=5)[0]
+    engines = [("inverse", False), ("solve", False), ("solve", True), ("sequential", False)]
+    filters = [
+        KalmanFilter(template.F_, template.B_, template.H_, template.P_.copy(), template.Q_,
+                     template.R_, template.x_.copy(), template.u_,
+                     update_method=method, joseph_form=joseph)
+        for method, joseph in engines
+    ]
+    rng = np.random.default_rng(6)
+
+    for _ in range(200):
+        z = rng.normal(0.0, [1.0, 0.1, 0.01, 0.001])
+        for kf in filters:
+            kf.predict()
+            kf.update(z)
+
+    reference = filters[0]
+    for kf in filters[1:]:
+        assert np.allclose(kf.x_, reference.x_, rtol=1e-9, atol=1e-12)
+        assert np.allclose(kf.P_, reference.P_, rtol=1e-9, atol=1e-12)
+        assert np.array_equal(kf.P_, kf.P_.T)
+        assert np.all(np.linalg.eigvalsh(kf.P_) > 0)
+    assert filters[1].resolved_update_method() == "solve"
+
+
+def test_lane_filter_matches_kalman_filter_per_step():
+    """
+    The scalar-unrolled lane engine must reproduce KalmanFilter within 1e-12
+    from the same state, for predict-only and predict+update frames
+    """
+    rng = np.random.default_rng(7)
+    x = np.array([1.8, 0.1, 0.001, 0.000001])
+    P = np.eye(4) * 0.001
+    for k in range(500):
+        A, B, H, Q, R = make_lane_model(rng.uniform(1.0, 10.0), 0.5)
+        u = np.array([[rng.normal(0.0, 0.05)]])
+        z = x + rng.normal(0.0, [0.1, 0.01, 0.001, 0.0001])
+        reference = KalmanFilter(A, B, H, P.copy(), Q, R, x.copy(), u)
+        lane = LaneKalmanFilter(A, B, H, P, Q, R, x, u)
+        reference.predict()
+        lane.predict()
+        if k % 5:
+            reference.update(z)
+            lane.update(z)
+
+        x_lane, P_lane = np.empty(4), np.empty((4, 4), order="F")
+        lane.store_state(x_lane, P_lane)
+        assert np.allclose(x_lane, reference.x_, rtol=1e-12, atol=1e-12 * np.abs(reference.x_).max())
+        assert np.allclose(P_lane, reference.P_, rtol=1e-12, atol=1e-12 * np.abs(reference.P_).max())
+        assert np.array_equal(P_lane, P_lane.T)
+        x, P = reference.x_, reference.P_
+
+    A[1, 2] += 1.0
+    with pytest.raises(ValueError):
+        LaneKalmanFilter(A, B, H, P, Q, R, x, u)
+
+
+def test_update_ekf_matches_linear_update_for_any_point_count():
+    """
+    A linear measurement block fused by update_ekf equals the standard
+    update with the same H and R, for diagonal and full R and both engines
+    """
+    rng = np.random.default_rng(7)
+    A, B, H, Q, R = make_lane_model(10.0, 0.5)
+    x = np.array([1.8, 0.1, 0.001, 0.000001])
+    for m in (1, 3, 12):
+        Hm = rng.normal(size=(m, 4))
+        variances = rng.uniform(0.05, 0.2, m)
+        z = Hm @ x + rng.normal(size=m) * 0.1
+        for Rm in (variances, np.diag(variances) + 0.01):
+            full = np.diag(Rm) if Rm.ndim == 1 else Rm
+            reference = KalmanFilter(A, B, Hm, np.eye(4) * 0.01, Q, full, x.copy(), np.zeros((1, 1)))
+            reference.update(z)
+            for kf in (KalmanFilter(A, B, H, np.eye(4) * 0.01, Q, R, x.copy(), np.zeros((1, 1))),
+                       LaneKalmanFilter(A, B, H, np.eye(4) * 0.01, Q, R, x.copy(), np.zeros((1, 1)))):
+                kf.update_ekf(z, lambda state: Hm @ state, lambda state: Hm, Rm)
+                assert np.allclose(kf.x_, reference.x_, rtol=1e-10, atol=1e-12)
+                assert np.allclose(kf.P_, reference.P_, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize("dtype, atol", [(np.float64, 1e-15), (np.float32, 1e-6)])
+def test_bank_precision_against_reference_sequence(dtype, atol):
+    """
+    A float64 or float32 bank reproduces the float64 reference sequence of
+    comparison_analysis, with cached models and containers in the same dtype
+    """
+    reference = comparison_analysis.run_python_simulation()
+    A, B = MotionModelCache(dtype=dtype).get(3.6, 0.5)
+    lanes = KalmanFilterBank.SPD_BATCH_MIN
+    bank = KalmanFilterBank(A, B, MATRIX_H, np.tile(np.eye(4) * 0.001, (lanes, 1, 1)), MATRIX_Q, MATRIX_R,
+                            np.tile([1.8, 0.1, 0.001, 0.000001], (lanes, 1)), np.zeros(1), dtype=dtype)
+    states = LaneParamBatch((len(reference), lanes), dtype=dtype)
+    for i, result in enumerate(reference):
+        bank.predict()
+        bank.update(np.tile(result["measurement"], (lanes, 1)))
+        states.set_states(i, bank.x_)
+
+    assert A.dtype == bank.P_.dtype == states.coeffs_.dtype == dtype
+    expected = np.array([result["final_state"] for result in reference])[:, None, :]
+    assert np.allclose(states.states(), expected, rtol=0.0, atol=atol)
+    assert np.all(np.linalg.eigvalsh(bank.P_.astype(np.float64)) > 0)
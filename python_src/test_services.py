@@ -0,0 +1,419 @@
+"""
+Tests for the online lane estimation service, camera pipeline and track manager
+"""
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from estimate_lane_param import EstimateLaneParam
+from instrumentation import FilterInstrumentation
+from lane_service import LaneEstimationService, LaneFrame, SessionRegistry
+from pipeline import LanePipeline, PointFrame, format_report
+from track_manager import GATE_CHI2_4DOF_99, LaneTrackManager, linear_assignment, mahalanobis_costs
+
+
+def make_session_frames(keys, T, seed=0):
+    """
+    Frames of several sessions, tick by tick; every session has its own
+    speed profile and about 20% frames without measurement after the first
+    """
+    rng = np.random.default_rng(seed)
+    ticks = []
+    for t in range(T):
+        tick = []
+        for key in keys:
+            z = None
+            if t == 0 or rng.random() > 0.2:
+                z = np.array([1.8, 0.1, 0.001, 0.000001]) + rng.normal(0.0, [0.05, 0.005, 0.0005, 0.00005])
+            tick.append(LaneFrame(key, 0.1 * t, round(rng.uniform(5.0, 25.0), 3), 0.5,
+                                  rng.normal(0.0, 0.05), z))
+        ticks.append(tick)
+    return ticks
+
+
+def sequential_states(frames):
+    """
+    Per-session reference with EstimateLaneParam
+    """
+    states = {}
+    for frame in frames:
+        if frame.key not in states:
+            states[frame.key] = (frame.z.copy(), np.eye(4) * 0.001)
+            continue
+        matrix_X, matrix_P = states[frame.key]
+        estimator = EstimateLaneParam()
+        estimator.set_motion_data(frame.speed, frame.look_forward_time, frame.w)
+        estimator.predict(matrix_P, matrix_X)
+        if frame.z is not None:
+            estimator.update(matrix_P, matrix_X, frame.z)
+    return states
+
+
+def test_lane_service_batches_sessions_like_sequential_estimators():
+    """
+    Concurrent frames are micro-batched, including repeated frames of one
+    session in a batch, and give the per-session sequential estimates
+    """
+    keys = [("v1", "front", 0), ("v1", "front", 1), ("v2", "front", 0), ("v2", "rear", 0)]
+    ticks = make_session_frames(keys, 8)
+    # Two consecutive frames of every session in the last batch
+    ticks[-2:] = [ticks[-2] + ticks[-1]]
+    instrumentation = FilterInstrumentation()
+    service = LaneEstimationService(window=0.05, registry=SessionRegistry(capacity=2),
+                                    instrumentation=instrumentation)
+
+    async def run():
+        await service.start()
+        try:
+            responses = []
+            for tick in ticks:
+                responses.append(await asyncio.gather(*(service.submit(frame) for frame in tick)))
+            return responses
+        finally:
+            await service.stop()
+
+    responses = asyncio.run(run())
+    frames = [frame for tick in ticks for frame in tick]
+    expected = sequential_states(frames)
+
+    assert all(response["created"] for response in responses[0])
+    assert len(service.registry_) == len(keys)
+    for key, (matrix_X, matrix_P) in expected.items():
+        x, P = service.registry_.state(key)
+        np.testing.assert_allclose(x, matrix_X, rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(P, matrix_P, rtol=1e-12, atol=1e-15)
+    final = {(r["vehicle"], r["camera"], r["lane"]): r["x"] for r in responses[-1]}
+    for key in keys:
+        np.testing.assert_allclose(final[key], expected[key][0], rtol=1e-12, atol=1e-15)
+
+    counters = instrumentation.snapshot().counters
+    assert counters["frames"] == len(frames)
+    assert counters["batches"] == len(ticks)
+
+
+def test_lane_service_json_protocol_and_eviction(tmp_path):
+    """
+    Unix socket round trip with malformed and unknown-session requests, and
+    eviction of idle sessions
+    """
+    now = [0.0]
+    service = LaneEstimationService(window=0.001, idle_timeout=5.0, clock=lambda: now[0])
+    path = str(tmp_path / "lanes.sock")
+    requests = [
+        {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.0, "speed": 3.6,
+         "look_forward_time": 0.5, "w": 0.0, "z": [1.95, 0.13, 0.006, 0.000001]},
+        {"vehicle": "v2", "camera": "front", "lane": 0, "timestamp": 0.0, "speed": 3.6,
+         "look_forward_time": 0.5, "z": None},
+        {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.0, "speed": 3.6},
+    ]
+
+    async def run():
+        await service.start()
+        server = asyncio.create_task(service.serve_unix(path))
+        try:
+            for _ in range(100):
+                if (tmp_path / "lanes.sock").exists():
+                    break
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write("".join(json.dumps(r) + "\n" for r in requests).encode())
+            writer.write(b"not json\n")
+            writer.write_eof()
+            lines = [json.loads(line) async for line in reader]
+            writer.close()
+            return lines
+        finally:
+            server.cancel()
+            await service.stop()
+
+    responses = asyncio.run(run())
+    assert len(responses) == 4
+    created = [r for r in responses if r.get("created")]
+    assert len(created) == 1 and created[0]["x"] == requests[0]["z"]
+    errors = sorted(r["error"] for r in responses if "error" in r)
+    assert any("missing fields: look_forward_time" in e for e in errors)
+    assert any("unknown session" in e for e in errors)
+    assert len(errors) == 3
+
+    assert ("v1", "front", 0) in service.registry_
+    assert service.evict_idle(now=4.0) == []
+    assert service.evict_idle(now=6.0) == [("v1", "front", 0)]
+    assert len(service.registry_) == 0
+    assert len(service.registry_.free_) == service.registry_.x_.shape[0]
+
+
+def test_lane_service_reads_stdin_redirected_from_file(tmp_path):
+    """
+    `python lane_service.py < frames.jsonl` serves a regular file on stdin
+    """
+    frame = {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.0, "speed": 3.6,
+             "look_forward_time": 0.5, "w": 0.0, "z": [1.95, 0.13, 0.006, 0.000001]}
+    path = tmp_path / "frames.jsonl"
+    path.write_text("".join(json.dumps(dict(frame, timestamp=0.5 * i)) + "\n" for i in range(3)))
+    with open(path, "rb") as stdin:
+        completed = subprocess.run([sys.executable, "lane_service.py"], stdin=stdin, capture_output=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+    assert completed.returncode == 0, completed.stderr.decode()
+    responses = [json.loads(line) for line in completed.stdout.decode().splitlines()]
+    assert sorted(r["timestamp"] for r in responses) == [0.0, 0.5, 1.0]
+    assert all("x" in r for r in responses)
+
+
+def test_lane_service_stopped_vehicle_and_invalid_motion_data():
+    """
+    A stopped vehicle (speed 0) is a regular step; non-finite or negative
+    motion data is rejected without touching the session
+    """
+    service = LaneEstimationService(window=0.001)
+    frame = {"vehicle": "v1", "camera": "front", "lane": 0, "timestamp": 0.0, "speed": 3.6,
+             "look_forward_time": 0.5, "w": 0.01, "z": [1.95, 0.13, 0.006, 0.000001]}
+    speeds = [3.6, 0.0, float("nan"), -1.0, 0.0, 3.6]
+    bad_z = dict(frame, z=[float("nan"), 0.0, 0.0, 0.0])
+
+    async def run():
+        await service.start()
+        try:
+            responses = []
+            for speed in speeds:
+                responses.append(json.loads(await service.handle_line(json.dumps(dict(frame, speed=speed)))))
+                if speed != speed:
+                    state = service.registry_.state(("v1", "front", 0))
+                    responses.append(json.loads(await service.handle_line(json.dumps(bad_z))))
+                    assert all(np.array_equal(a, b)
+                               for a, b in zip(state, service.registry_.state(("v1", "front", 0))))
+            return responses
+        finally:
+            await service.stop()
+
+    responses = asyncio.run(run())
+    assert "speed, look_forward_time and w must be finite" in responses[2]["error"]
+    assert "z must be finite" in responses[3]["error"]
+    assert "speed must not be negative" in responses[4]["error"]
+
+    matrix_X, matrix_P = np.array(frame["z"]), np.eye(4) * 0.001
+    for speed in (0.0, 0.0, 3.6):
+        estimator = EstimateLaneParam()
+        estimator.set_motion_data(speed, 0.5, 0.01)
+        estimator.predict_and_update(matrix_P, matrix_X, np.array(frame["z"]))
+    final = responses[-1]
+    assert np.all(np.isfinite(responses[1]["x"]))
+    np.testing.assert_allclose(final["x"], matrix_X, rtol=1e-12, atol=1e-15)
+
+
+def make_point_frames(T, lanes=3, points=40, seed=0):
+    """
+    Camera frames of raw points on drifting lanes; lane 2 loses its points
+    every fourth frame
+    """
+    rng = np.random.default_rng(seed)
+    offsets = np.array([-1.8, 1.8, 5.4])[:lanes]
+    frames = []
+    for t in range(T):
+        lane_index = np.repeat(np.arange(lanes), points)
+        if t % 4 == 3:
+            lane_index = lane_index[lane_index != 2]
+        x = rng.uniform(2.0, 60.0, lane_index.size)
+        y = offsets[lane_index] + 0.01 * t + 0.002 * x + 1e-5 * x ** 2 + rng.normal(0.0, 0.05, x.size)
+        frames.append(PointFrame(0.05 * t, round(rng.uniform(5.0, 25.0), 3), 0.05,
+                                 rng.normal(0.0, 0.02), lane_index, x, y))
+    return frames
+
+
+def initial_lanes(lanes=3):
+    matrix_X = np.zeros((lanes, 4))
+    matrix_X[:, 0] = [-1.8, 1.8, 5.4][:lanes]
+    return matrix_X, np.tile(np.eye(4) * 0.001, (lanes, 1, 1))
+
+
+def test_pipeline_matches_serial_loop_with_block_backpressure():
+    """
+    The threaded pipeline publishes every frame in order with the states of
+    the serial loop, and reports per-stage and per-queue metrics
+    """
+    frames = make_point_frames(60)
+    matrix_X, matrix_P = initial_lanes()
+
+    serial = LanePipeline(matrix_X, matrix_P, max_points=128)
+    expected = []
+    serial.run_serial(frames, lambda result: expected.append(
+        (result.index, result.states.copy(), result.covariances.copy(), result.valid.copy())))
+
+    pipeline = LanePipeline(matrix_X, matrix_P, max_points=128, queue_size=2)
+    published = []
+    report = pipeline.run(iter(frames), lambda result: published.append(
+        (result.index, result.states.copy(), result.covariances.copy(), result.valid.copy())))
+
+    assert [p[0] for p in published] == list(range(len(frames)))
+    for (_, x, P, valid), (_, x_ref, P_ref, valid_ref) in zip(published, expected):
+        np.testing.assert_array_equal(x, x_ref)
+        np.testing.assert_array_equal(P, P_ref)
+        np.testing.assert_array_equal(valid, valid_ref)
+    assert not published[3][3][2] and published[4][3][2]
+    np.testing.assert_array_equal(pipeline.matrix_X_, serial.matrix_X_)
+
+    assert (report.frames_in, report.frames_out, report.dropped) == (60, 60, 0)
+    assert [s.name for s in report.stages] == list(LanePipeline.STAGES)
+    assert all(s.frames == 60 and 0.0 <= s.utilization <= 1.0 for s in report.stages)
+    assert all(q.max_occupancy <= 2 and 0.0 <= q.mean_occupancy <= 2.0 for q in report.queues)
+    assert "frames/s" in format_report(report)
+
+
+def test_pipeline_continues_across_runs():
+    """
+    A drive split over several runs gives the states of one serial run;
+    every run starts with a predict for its first frame
+    """
+    frames = make_point_frames(40)
+    matrix_X, matrix_P = initial_lanes()
+    whole = LanePipeline(matrix_X, matrix_P, max_points=128)
+    whole.run_serial(frames, lambda result: None)
+
+    split = LanePipeline(matrix_X, matrix_P, max_points=128)
+    split.run(frames[:15], lambda result: None)
+    split.run_serial(frames[15:25], lambda result: None)
+    split.run(frames[25:], lambda result: None)
+    np.testing.assert_array_equal(split.matrix_X_, whole.matrix_X_)
+    np.testing.assert_array_equal(split.matrix_P_, whole.matrix_P_)
+
+
+def test_pipeline_drop_oldest_and_stage_errors():
+    """
+    A slow sink with drop_oldest backpressure drops frames instead of
+    stalling the source; stage errors stop the pipeline and propagate
+    """
+    frames = make_point_frames(80)
+    matrix_X, matrix_P = initial_lanes()
+    pipeline = LanePipeline(matrix_X, matrix_P, max_points=128, queue_size=1,
+                            backpressure="drop_oldest")
+    published = []
+
+    def slow_sink(result):
+        time.sleep(0.002)
+        published.append(result.index)
+
+    report = pipeline.run(frames, slow_sink)
+    assert report.dropped > 0
+    assert report.frames_in == 80
+    assert report.frames_out + report.dropped == report.frames_in
+    assert published == sorted(published) and len(published) == report.frames_out
+    assert np.all(np.isfinite(pipeline.matrix_X_))
+    assert sum(q.dropped for q in report.queues) == report.dropped
+
+    def failing_sink(result):
+        if result.index == 5:
+            raise RuntimeError("sink failed")
+
+    with pytest.raises(RuntimeError, match="sink failed"):
+        LanePipeline(matrix_X, matrix_P, max_points=128).run(frames, failing_sink)
+    with pytest.raises(ValueError, match="max_points"):
+        LanePipeline(matrix_X, matrix_P, max_points=16).run(frames, lambda result: None)
+
+
+def test_linear_assignment_matches_brute_force():
+    """
+    Optimal assignments of square and rectangular cost matrices, including ties
+    """
+    rng = np.random.default_rng(3)
+    for trial in range(200):
+        n, m = (int(v) for v in rng.integers(1, 6, 2))
+        cost = rng.integers(0, 5, (n, m)).astype(float) if trial % 2 else rng.random((n, m))
+        rows, cols = linear_assignment(cost)
+        if n <= m:
+            best = min(cost[np.arange(n), list(p)].sum() for p in itertools.permutations(range(m), n))
+        else:
+            best = min(cost[list(p), np.arange(m)].sum() for p in itertools.permutations(range(n), m))
+        assert len(rows) == min(n, m) and len(set(cols.tolist())) == min(n, m)
+        assert np.all(np.diff(rows) > 0)
+        assert abs(cost[rows, cols].sum() - best) < 1e-12
+
+
+def test_track_manager_shared_measurement_noise_matches_estimator():
+    """
+    A shared (4, 4) R is used in the update, not only in the gating
+    """
+    matrix_R = np.eye(4) * 5.0
+    truth = np.array([1.8, 0.01, 0.001, 0.00001])
+    manager = LaneTrackManager()
+    matrix_X, matrix_P = truth.copy(), np.eye(4) * 0.001
+    manager.step(10.0, 0.5, 0.0, truth[None], matrix_R)
+    for k, z in enumerate([truth + 0.05, truth - 0.03]):
+        step = manager.step(10.0 + k, 0.5, 0.01, z[None], matrix_R)
+        assert step.track_ids.tolist() == [0]
+        estimator = EstimateLaneParam()
+        estimator.set_motion_data(10.0 + k, 0.5, 0.01)
+        estimator.predict(matrix_P, matrix_X)
+        estimator.update(matrix_P, matrix_X, z, matrix_R=matrix_R)
+
+    tracks = manager.tracks()
+    np.testing.assert_allclose(tracks.states[0], matrix_X, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(tracks.covariances[0], matrix_P, rtol=1e-12, atol=1e-15)
+
+
+def test_track_manager_associates_lanes_with_birth_and_death():
+    """
+    Shuffled lane detections update the right tracks exactly like per-lane
+    estimators; a lane missing too long dies and is reborn, an outlier
+    outside the gate starts its own track
+    """
+    rng = np.random.default_rng(4)
+    truth = np.array([[-3.6, 0.01, 0.001, 0.00001], [0.0, 0.01, 0.001, 0.00001],
+                      [3.6, 0.01, 0.001, 0.00001]])
+    manager = LaneTrackManager(max_misses=3)
+    references = {}
+    steps = []
+    for t in range(30):
+        speed = round(rng.uniform(5.0, 25.0), 3)
+        w = rng.normal(0.0, 0.02)
+        lanes = [0, 1] if 10 <= t < 15 else [0, 1, 2]
+        Z = truth[lanes] + rng.normal(0.0, [0.05, 0.005, 0.0005, 0.00005], (len(lanes), 4))
+        if t == 20:
+            Z = np.vstack([Z, [50.0, 0.0, 0.0, 0.0]])
+            lanes = lanes + [-1]
+        # New tracks take ids in measurement order; shuffle after the first frame
+        order = rng.permutation(len(lanes)) if t else np.arange(len(lanes))
+        steps.append((t, [lanes[i] for i in order], manager.step(speed, 0.5, w, Z[order])))
+
+        for lane, z in zip(lanes, Z):
+            if lane not in (0, 1):
+                continue
+            if lane not in references:
+                references[lane] = (z.copy(), np.eye(4) * 0.001)
+                continue
+            matrix_X, matrix_P = references[lane]
+            estimator = EstimateLaneParam()
+            estimator.set_motion_data(speed, 0.5, w)
+            estimator.predict(matrix_P, matrix_X)
+            estimator.update(matrix_P, matrix_X, z)
+
+    # Same lane, same track; lane 2 is deleted after 4 missed frames and reborn
+    for t, lanes, step in steps:
+        ids = dict(zip(lanes, step.track_ids.tolist()))
+        assert ids[0] == 0 and ids[1] == 1
+        if 2 in ids:
+            assert ids[2] == (2 if t < 10 else 3)
+    assert steps[0][2].born == [0, 1, 2]
+    assert steps[13][2].deleted == [2] and steps[15][2].born == [3]
+    outlier = steps[20][2]
+    assert outlier.born == [4] and np.isnan(outlier.costs[outlier.track_ids == 4]).all()
+    assert steps[24][2].deleted == [4]
+    assert np.all(steps[5][2].costs < GATE_CHI2_4DOF_99)
+
+    tracks = manager.tracks()
+    assert tracks.ids.tolist() == [0, 1, 3] and tracks.confirmed.all()
+    for lane in (0, 1):
+        np.testing.assert_allclose(tracks.states[lane], references[lane][0], rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(tracks.covariances[lane], references[lane][1], rtol=1e-12, atol=1e-15)
+
+    # Per-measurement R gives the same costs as the explicit per-pair formula
+    R = np.eye(4) * rng.uniform(0.05, 0.2, (len(Z), 1, 1))
+    cost = mahalanobis_costs(tracks.states, tracks.covariances, Z, R)
+    for t in range(len(tracks.ids)):
+        for m in range(len(Z)):
+            y = Z[m] - tracks.states[t]
+            assert np.isclose(cost[t, m], y @ np.linalg.solve(tracks.covariances[t] + R[m], y))
@@ -0,0 +1,219 @@
+"""
+Timestamp-driven lane parameter estimation
+Predicts over the actual elapsed time between frames and fuses delayed
+(out-of-sequence) measurements at their true time from a bounded history
+"""
+import numpy as np
+from estimate_lane_param import EstimateLaneParam
+from motion_model import build_motion_matrices
+
+
+# One history entry: the step that ended at `timestamp` (motion data in
+# effect over the preceding interval and the measurement fused at its end)
+# and the posterior state after it
+HISTORY_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("speed", "<f8"),
+    ("look_forward_time", "<f8"),
+    ("w", "<f8"),
+    ("z", "<f8", (4,)),
+    ("valid", "?"),
+    ("x", "<f8", (4,)),
+    ("P", "<f8", (4, 4)),
+])
+
+
+class TimedEstimateLaneParam(EstimateLaneParam):
+    """
+    Lane parameter estimation on timestamps instead of fixed steps
+
+    A prediction over dt seconds uses the motion model of the actual
+    distance speed*dt, i.e. build_motion_matrices(speed, dt), and the
+    process noise Q*dt/look_forward_time, where look_forward_time is the
+    nominal frame interval that Q refers to. For dt == look_forward_time a
+    step equals EstimateLaneParam.predict / predict_and_update.
+
+    Every step is kept in a ring buffer of history_size entries. A
+    measurement older than the current timestamp is fused at its true time
+    by restoring the state before it and re-running only the buffered
+    steps after it; measurements older than the buffer are dropped.
+
+    The estimator owns its state (matrix_X_, matrix_P_, timestamp_);
+    start it with reset() and use predict_to() / update_at() instead of
+    the fixed-step methods.
+    """
+
+    def __init__(self, history_size=64, **kwargs):
+        """
+        Initialize the estimator
+
+        Args:
+            history_size: number of past steps kept for out-of-sequence updates
+            kwargs: EstimateLaneParam arguments (use_workspace, engine, ...)
+        """
+        super().__init__(**kwargs)
+        self.history_ = np.zeros(history_size, dtype=HISTORY_DTYPE)
+        self.history_start_ = 0
+        self.history_count_ = 0
+        self.timestamp_ = None
+        self.refiltered_steps_ = 0
+        self.dropped_measurements_ = 0
+
+    def reset(self, timestamp, matrix_X, matrix_P):
+        """
+        Start estimation from a known state
+
+        Args:
+            timestamp: time of the state
+            matrix_X: initial state vector
+            matrix_P: initial error covariance matrix
+        """
+        self.matrix_X_ = np.array(matrix_X, dtype=float).reshape(-1)
+        self.matrix_P_ = np.array(matrix_P, dtype=float)
+        self.timestamp_ = timestamp
+        self.history_start_ = 0
+        self.history_count_ = 0
+        self._record(timestamp, None)
+
+    def _entry(self, index):
+        """
+        History entry `index` (0 is the oldest buffered step)
+        """
+        return self.history_[(self.history_start_ + index) % self.history_.shape[0]]
+
+    def _record(self, timestamp, matrix_Z):
+        """
+        Append the step that just ended at `timestamp` to the history
+        """
+        size = self.history_.shape[0]
+        if self.history_count_ == size:
+            self.history_start_ = (self.history_start_ + 1) % size
+            self.history_count_ -= 1
+        entry = self._entry(self.history_count_)
+        self.history_count_ += 1
+        entry["timestamp"] = timestamp
+        entry["speed"] = self.speed_
+        entry["look_forward_time"] = self.look_forward_time_
+        entry["w"] = self.w_
+        entry["valid"] = matrix_Z is not None
+        if matrix_Z is not None:
+            entry["z"] = matrix_Z
+        entry["x"] = self.matrix_X_
+        entry["P"] = self.matrix_P_
+
+    def _step(self, timestamp, matrix_Z):
+        """
+        Predict from timestamp_ to timestamp, then fuse matrix_Z if given
+        """
+        dt = timestamp - self.timestamp_
+        if self.look_forward_time_ <= 0:
+            raise ValueError("look_forward_time must be positive to scale the process noise")
+        if self.kalman_ is None:
+            self._load_state(self.matrix_P_, self.matrix_X_)
+        else:
+            self.kalman_.load_state(self.matrix_X_, self.matrix_P_)
+
+        if dt > 0:
+            # Motion over the actual distance speed*dt; Q is given per nominal interval
+            matrix_A, matrix_B = build_motion_matrices(self.speed_, dt)
+            self.matrix_U_[0, 0] = self.w_
+            self.kalman_.set_model(matrix_A, matrix_B, self.matrix_U_)
+            self.kalman_.set_process_noise(self.matrix_Q_ * (dt / self.look_forward_time_))
+            self.kalman_.predict()
+        if matrix_Z is not None:
+            self.kalman_.update(matrix_Z)
+
+        self.kalman_.store_state(self.matrix_X_, self.matrix_P_)
+        self.timestamp_ = timestamp
+        self._record(timestamp, matrix_Z)
+
+    @staticmethod
+    def _store(matrix_P, matrix_X, source_P, source_X):
+        """
+        Copy the state into the optional output arrays
+        """
+        if matrix_X is not None:
+            matrix_X[:] = source_X
+        if matrix_P is not None:
+            matrix_P[:] = source_P
+
+    def predict_to(self, timestamp, matrix_P=None, matrix_X=None):
+        """
+        Predict the state to a later timestamp with the current motion data
+
+        Args:
+            timestamp: target time, not before timestamp_
+            matrix_P: optional error covariance matrix (output)
+            matrix_X: optional state vector (output)
+        """
+        if timestamp < self.timestamp_:
+            raise ValueError(f"cannot predict back from {self.timestamp_} to {timestamp}")
+        self._step(timestamp, None)
+        self._store(matrix_P, matrix_X, self.matrix_P_, self.matrix_X_)
+
+    def update_at(self, timestamp, matrix_Z, matrix_P=None, matrix_X=None):
+        """
+        Fuse a measurement taken at `timestamp`
+
+        A measurement at or after timestamp_ predicts to its time with the
+        current motion data and is fused there. An older measurement is
+        fused at its true time: the state of the last buffered step before
+        it is restored, and the buffered steps after it are re-run with
+        their own motion data and measurements.
+
+        Args:
+            timestamp: time the measurement was taken
+            matrix_Z: measurement vector
+            matrix_P: optional error covariance matrix at timestamp_ (output)
+            matrix_X: optional state vector at timestamp_ (output)
+
+        Returns:
+            True if the measurement was fused, False if it was older than
+            the buffered history and dropped
+        """
+        matrix_Z = np.array(matrix_Z, dtype=float).reshape(-1)
+        if timestamp >= self.timestamp_:
+            self._step(timestamp, matrix_Z)
+        else:
+            # Last buffered step at or before the measurement time
+            times = np.array([self._entry(i)["timestamp"] for i in range(self.history_count_)])
+            anchor = int(np.searchsorted(times, timestamp, side="right")) - 1
+            if anchor < 0:
+                self.dropped_measurements_ += 1
+                self._store(matrix_P, matrix_X, self.matrix_P_, self.matrix_X_)
+                return False
+            self._refilter(anchor, timestamp, matrix_Z)
+
+        self._store(matrix_P, matrix_X, self.matrix_P_, self.matrix_X_)
+        return True
+
+    def _refilter(self, anchor, timestamp, matrix_Z):
+        """
+        Insert a measurement after history entry `anchor` and re-run the later steps
+        """
+        later = [self._entry(i).copy() for i in range(anchor + 1, self.history_count_)]
+        start = self._entry(anchor)
+        self.matrix_X_[:] = start["x"]
+        self.matrix_P_[:] = start["P"]
+        self.timestamp_ = float(start["timestamp"])
+        self.history_count_ = anchor + 1
+        speed, look_forward_time, w = self.speed_, self.look_forward_time_, self.w_
+
+        # The new measurement splits the interval of the step that covers it
+        if later:
+            self._set_step_motion(later[0])
+        self._step(timestamp, matrix_Z)
+        for entry in later:
+            self._set_step_motion(entry)
+            self._step(float(entry["timestamp"]), entry["z"].copy() if entry["valid"] else None)
+        self.refiltered_steps_ += len(later)
+
+        self.speed_, self.look_forward_time_, self.w_ = speed, look_forward_time, w
+
+    def _set_step_motion(self, entry):
+        """
+        Use the motion data recorded with a history entry
+        """
+        self.speed_ = float(entry["speed"])
+        self.look_forward_time_ = float(entry["look_forward_time"])
+        self.w_ = float(entry["w"])
@@ -0,0 +1,302 @@
+"""
+Lane track management with batched measurement-to-track association
+Keeps a set of lane tracks, scores every detected lane against every
+predicted track with one vectorized Mahalanobis cost matrix, solves the
+assignment optimally and handles track birth and death with gating
+"""
+from collections import namedtuple
+
+import numpy as np
+from kalman_filter import KalmanFilterBank
+from motion_model import MATRIX_H, MATRIX_Q, MATRIX_R, default_model_cache
+
+
+# 99% quantile of the chi-square distribution with 4 degrees of freedom
+GATE_CHI2_4DOF_99 = 13.277
+
+LaneTracks = namedtuple("LaneTracks", ["ids", "states", "covariances", "hits", "misses", "confirmed"])
+LaneTracks.__doc__ = """
+Current lane tracks, T = number of tracks
+
+ids: unique track ids, (T,)
+states: lane states [c0, c1, c2, c3], (T, 4)
+covariances: error covariance matrices, (T, 4, 4)
+hits: frames with an assigned measurement, (T,)
+misses: consecutive frames without an assigned measurement, (T,)
+confirmed: tracks with at least min_hits hits, (T,)
+"""
+
+TrackStep = namedtuple("TrackStep", ["track_ids", "costs", "born", "deleted"])
+TrackStep.__doc__ = """
+Association result of one frame with M measurements
+
+track_ids: id of the track each measurement updated or started, (M,)
+costs: squared Mahalanobis distance of each measurement to its track, nan
+       for measurements that started a new track, (M,)
+born: ids of the tracks started in this frame
+deleted: ids of the tracks deleted in this frame
+"""
+
+
+def mahalanobis_costs(matrix_X, matrix_P, matrix_Z, matrix_R):
+    """
+    Squared Mahalanobis distances between all tracks and all measurements
+
+    cost[t, m] = y^T * S^(-1) * y with y = z_m - x_t and S = P_t + R
+    (H = I), for all pairs in one batched computation.
+
+    Args:
+        matrix_X: predicted track states, (T, 4)
+        matrix_P: predicted error covariances, (T, 4, 4)
+        matrix_Z: measurements, (M, 4)
+        matrix_R: measurement noise, (4, 4) shared or (M, 4, 4) per measurement
+
+    Returns:
+        cost matrix, (T, M)
+    """
+    matrix_R = np.asarray(matrix_R, dtype=float)
+    y = matrix_Z[None, :, :] - matrix_X[:, None, :]
+    if matrix_R.ndim == 2:
+        # One innovation covariance per track
+        S_inv = np.linalg.inv(matrix_P + matrix_R)
+        return np.einsum("tmi,tij,tmj->tm", y, S_inv, y)
+    S = matrix_P[:, None] + matrix_R[None, :]
+    return np.einsum("tmi,tmi->tm", y, np.linalg.solve(S, y[..., None])[..., 0])
+
+
+def linear_assignment(cost):
+    """
+    Minimum-cost assignment of rows to columns
+
+    Shortest augmenting path form of the Hungarian algorithm (as in
+    Jonker-Volgenant), O(n^2 * m) for n <= m: every row is added with one
+    Dijkstra search over the reduced costs, vectorized over the columns.
+    For rectangular matrices every row (or column, if there are fewer) is
+    assigned.
+
+    Args:
+        cost: finite cost matrix, (n, m)
+
+    Returns:
+        (rows, cols) index arrays of the assigned pairs, sorted by row
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if not np.all(np.isfinite(cost)):
+        raise ValueError("linear_assignment requires finite costs")
+
+    u = np.zeros(n)  # row potentials
+    v = np.zeros(m)  # column potentials
+    row_for_col = np.full(m, -1)
+    col_for_row = np.full(n, -1)
+    for start in range(n):
+        shortest = np.full(m, np.inf)
+        path = np.full(m, -1)
+        unscanned = np.ones(m, dtype=bool)
+        scanned_rows = [start]
+        row, distance, sink = start, 0.0, -1
+        while sink < 0:
+            # Relax the reduced costs of the unscanned columns through `row`
+            reduced = distance + cost[row] - u[row] - v
+            better = unscanned & (reduced < shortest)
+            path[better] = row
+            shortest[better] = reduced[better]
+            candidates = np.flatnonzero(unscanned)
+            col = candidates[np.argmin(shortest[candidates])]
+            distance = shortest[col]
+            unscanned[col] = False
+            if row_for_col[col] < 0:
+                sink = col
+            else:
+                row = row_for_col[col]
+                scanned_rows.append(row)
+
+        # Update the potentials so all reduced costs stay non-negative
+        u[start] += distance
+        others = np.array(scanned_rows[1:], dtype=np.intp)
+        u[others] += distance - shortest[col_for_row[others]]
+        scanned = ~unscanned
+        v[scanned] -= distance - shortest[scanned]
+
+        # Augment along the shortest path
+        col = sink
+        while True:
+            row = path[col]
+            row_for_col[col] = row
+            col_for_row[row], col = col, col_for_row[row]
+            if row == start:
+                break
+
+    rows = np.arange(n)
+    if transposed:
+        order = np.argsort(col_for_row)
+        return col_for_row[order], rows[order]
+    return rows, col_for_row
+
+
+class LaneTrackManager:
+    """
+    Multi-lane tracker around a KalmanFilterBank
+
+    Each step predicts all tracks with the frame's motion model, builds the
+    (T, M) Mahalanobis cost matrix between predicted tracks and measured
+    lanes, and assigns them with linear_assignment. Pairs beyond the gate
+    are excluded: they get a cost above any sum of gated costs, so the
+    assignment first maximizes the number of gated pairs and then minimizes
+    their total distance. Assigned tracks are updated; unassigned
+    measurements start tracks at the measurement with initial_P; tracks
+    without a measurement for more than max_misses consecutive frames are
+    deleted.
+
+    A track's predict and update equal EstimateLaneParam.predict and
+    update with the same motion data and measurement.
+    """
+
+    def __init__(self, gate=GATE_CHI2_4DOF_99, max_misses=3, min_hits=2, initial_P=None,
+                 model_cache=None):
+        """
+        Initialize an empty track set
+
+        Args:
+            gate: maximum squared Mahalanobis distance of an assignment
+            max_misses: consecutive missed frames after which a track is deleted
+            min_hits: assigned measurements after which a track is confirmed
+            initial_P: error covariance of new tracks (default 0.001*I)
+            model_cache: MotionModelCache for the A/B matrices
+                         (defaults to the cache shared by all estimators)
+        """
+        self.gate_ = gate
+        self.max_misses_ = max_misses
+        self.min_hits_ = min_hits
+        self.initial_P_ = (np.array(initial_P, dtype=float) if initial_P is not None
+                           else np.eye(4) * 0.001)
+        self.model_cache_ = model_cache if model_cache is not None else default_model_cache
+        self.x_ = np.zeros((0, 4))
+        self.P_ = np.zeros((0, 4, 4))
+        self.ids_ = np.zeros(0, dtype=np.int64)
+        self.hits_ = np.zeros(0, dtype=np.int64)
+        self.misses_ = np.zeros(0, dtype=np.int64)
+        self.next_id_ = 0
+
+    def __len__(self):
+        return self.ids_.shape[0]
+
+    def tracks(self):
+        """
+        Copies of the current tracks
+
+        Returns:
+            LaneTracks
+        """
+        return LaneTracks(self.ids_.copy(), self.x_.copy(), self.P_.copy(), self.hits_.copy(),
+                          self.misses_.copy(), self.hits_ >= self.min_hits_)
+
+    def associate(self, matrix_Z, matrix_R=MATRIX_R):
+        """
+        Assign measurements to the current (predicted) tracks
+
+        Args:
+            matrix_Z: measurements, (M, 4)
+            matrix_R: measurement noise, (4, 4) shared or (M, 4, 4)
+
+        Returns:
+            (tracks, measurements, costs): index arrays of the assigned
+            pairs within the gate and their costs
+        """
+        empty = np.zeros(0, dtype=np.intp)
+        if len(self) == 0 or matrix_Z.shape[0] == 0:
+            return empty, empty, np.zeros(0)
+        cost = mahalanobis_costs(self.x_, self.P_, matrix_Z, matrix_R)
+        gated = ~(cost <= self.gate_)  # also excludes nan
+        if gated.all():
+            return empty, empty, np.zeros(0)
+        # Above the largest possible sum of gated costs
+        penalty = (min(cost.shape) + 1) * self.gate_ + 1.0
+        tracks, measurements = linear_assignment(np.where(gated, penalty, cost))
+        keep = ~gated[tracks, measurements]
+        tracks, measurements = tracks[keep], measurements[keep]
+        return tracks, measurements, cost[tracks, measurements]
+
+    def step(self, speed, look_forward_time, w, matrix_Z, matrix_R=MATRIX_R):
+        """
+        Process one frame of detected lanes
+
+        Args:
+            speed, look_forward_time, w: motion data of the frame
+            matrix_Z: measured lanes, (M, 4)
+            matrix_R: measurement noise, (4, 4) shared or (M, 4, 4) per lane,
+                      e.g. CubicFit.r
+
+        Returns:
+            TrackStep
+        """
+        matrix_Z = np.asarray(matrix_Z, dtype=float).reshape(-1, 4)
+        matrix_R = np.asarray(matrix_R, dtype=float)
+        M = matrix_Z.shape[0]
+
+        bank = None
+        if len(self):
+            matrix_A, matrix_B = self.model_cache_.get(speed, look_forward_time)
+            shared_R = matrix_R if matrix_R.ndim == 2 else MATRIX_R
+            bank = KalmanFilterBank(matrix_A, matrix_B, MATRIX_H, self.P_, MATRIX_Q, shared_R,
+                                    self.x_, [[w]])
+            bank.predict()
+            self.x_, self.P_ = bank.x_, bank.P_
+
+        tracks, measurements, costs = self.associate(matrix_Z, matrix_R)
+
+        if tracks.size:
+            matrix_Z_tracks = np.zeros_like(self.x_)
+            matrix_Z_tracks[tracks] = matrix_Z[measurements]
+            mask = np.zeros(len(self), dtype=bool)
+            mask[tracks] = True
+            if matrix_R.ndim == 3:
+                matrix_R_tracks = np.tile(MATRIX_R, (len(self), 1, 1))
+                matrix_R_tracks[tracks] = matrix_R[measurements]
+                bank.set_measurement_noise(matrix_R_tracks)
+            bank.update(matrix_Z_tracks, mask)
+            self.x_, self.P_ = bank.x_, bank.P_
+
+        assigned = np.zeros(len(self), dtype=bool)
+        assigned[tracks] = True
+        self.hits_[assigned] += 1
+        self.misses_[assigned] = 0
+        self.misses_[~assigned] += 1
+
+        track_ids = np.full(M, -1, dtype=np.int64)
+        track_ids[measurements] = self.ids_[tracks]
+        step_costs = np.full(M, np.nan)
+        step_costs[measurements] = costs
+
+        # Death: drop tracks missed for too long
+        alive = self.misses_ <= self.max_misses_
+        deleted = self.ids_[~alive].tolist()
+        if deleted:
+            self._keep(alive)
+
+        # Birth: unassigned measurements start new tracks
+        new = np.flatnonzero(track_ids < 0)
+        born = list(range(self.next_id_, self.next_id_ + new.size))
+        if new.size:
+            track_ids[new] = born
+            self.next_id_ += new.size
+            self.x_ = np.concatenate([self.x_, matrix_Z[new]])
+            self.P_ = np.concatenate([self.P_, np.broadcast_to(self.initial_P_, (new.size, 4, 4))])
+            self.ids_ = np.concatenate([self.ids_, born]).astype(np.int64)
+            self.hits_ = np.concatenate([self.hits_, np.ones(new.size, dtype=np.int64)])
+            self.misses_ = np.concatenate([self.misses_, np.zeros(new.size, dtype=np.int64)])
+
+        return TrackStep(track_ids, step_costs, born, deleted)
+
+    def _keep(self, index):
+        """
+        Keep only the tracks selected by a boolean mask
+        """
+        self.x_ = self.x_[index]
+        self.P_ = self.P_[index]
+        self.ids_ = self.ids_[index]
+        self.hits_ = self.hits_[index]
+        self.misses_ = self.misses_[index]
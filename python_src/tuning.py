@@ -0,0 +1,205 @@
+"""
+Vectorized tuning of the diagonal process/measurement noise over recorded drives
+Every Q/R candidate is one entry of a batch dimension, so a drive is filtered
+once for all candidates; candidate chunks are spread over a process pool
+"""
+import itertools
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+from motion_model import build_motion_matrices_batch
+from replay_runner import load_drive
+
+
+TuningResult = namedtuple(
+    "TuningResult",
+    ["q", "r", "nis_mean", "nis_score", "rmse", "rmse_score", "score"],
+)
+TuningResult.__doc__ = """
+Scores of C candidates, lower is better
+
+q, r: candidate diagonals of Q and R, (C, 4)
+nis_mean: mean normalized innovation squared over all updates, (C,)
+nis_score: |log(nis_mean / 4)|, 0 for a consistent filter, (C,)
+rmse: root mean squared error against the reference lanes per coefficient,
+      (C, 4); nan without references
+rmse_score: mean over coefficients of log(rmse / best rmse), 0 for the
+            most accurate candidate, (C,); 0 without references
+score: nis_weight * nis_score + rmse_weight * rmse_score, (C,)
+"""
+
+# Drives and references opened once per worker process by _init_worker
+_worker_drives = None
+
+
+def _diagonals(values):
+    """
+    Convert scalars or 4-vectors to a list of 4-element diagonals
+    """
+    return [np.broadcast_to(np.asarray(v, dtype=float), (4,)) for v in values]
+
+
+def grid_candidates(q_values, r_values):
+    """
+    All combinations of the given Q and R diagonals
+
+    Args:
+        q_values: sequence of scalars (times I) or 4-element diagonals of Q
+        r_values: sequence of scalars (times I) or 4-element diagonals of R
+
+    Returns:
+        (q, r) candidate diagonals, each (len(q_values) * len(r_values), 4)
+    """
+    pairs = list(itertools.product(_diagonals(q_values), _diagonals(r_values)))
+    return np.array([q for q, _ in pairs]), np.array([r for _, r in pairs])
+
+
+def random_candidates(count, q_bounds=(1e-6, 1e-1), r_bounds=(1e-4, 1.0), seed=None):
+    """
+    Log-uniformly sampled Q and R diagonals
+
+    Args:
+        count: number of candidates
+        q_bounds: (low, high) for every diagonal entry of Q, scalars or 4-vectors
+        r_bounds: (low, high) for every diagonal entry of R, scalars or 4-vectors
+        seed: random seed
+
+    Returns:
+        (q, r) candidate diagonals, each (count, 4)
+    """
+    rng = np.random.default_rng(seed)
+
+    def sample(bounds):
+        low, high = np.log(bounds[0]), np.log(bounds[1])
+        return np.exp(rng.uniform(low, high, (count, 4)))
+
+    return sample(q_bounds), sample(r_bounds)
+
+
+def _evaluate_drive(drive, q, r, reference, burn_in):
+    """
+    Filter one drive with C candidates at once
+
+    Returns:
+        (nis_sum (C,), nis_count, squared_error_sum (C, 4), error_count)
+    """
+    C = q.shape[0]
+    T = len(drive.speeds)
+    F, B = build_motion_matrices_batch(drive.speeds, drive.look_forward_times)
+    F_transpose = np.swapaxes(F, -1, -2)
+    u = B[..., 0] * np.asarray(drive.ws, dtype=float)[:, None]
+    Q = q[:, :, None] * np.eye(4)
+    R = r[:, :, None] * np.eye(4)
+
+    x = np.tile(np.asarray(drive.matrix_X, dtype=float).reshape(-1), (C, 1))
+    P = np.tile(np.asarray(drive.matrix_P, dtype=float), (C, 1, 1))
+    rhs = np.empty((C, 4, 5))
+    nis_sum = np.zeros(C)
+    squared_error = np.zeros((C, 4))
+    nis_count = error_count = 0
+
+    for k in range(T):
+        # Predict with the motion model of the frame, shared by all candidates
+        x = x @ F_transpose[k] + u[k]
+        P = F[k] @ P @ F_transpose[k] + Q
+
+        if drive.valid[k]:
+            # H = I: y = z - x, S = P + R; one solve gives S^(-1)*P and S^(-1)*y
+            y = np.asarray(drive.matrix_Z[k], dtype=float) - x
+            rhs[..., :4] = P
+            rhs[..., 4] = y
+            W = np.linalg.solve(P + R, rhs)
+            S_inv_y = W[..., 4]
+            x = x + (P @ S_inv_y[..., None])[..., 0]
+            P = P - P @ W[..., :4]
+            P = 0.5 * (P + np.swapaxes(P, -1, -2))
+            if k >= burn_in:
+                nis_sum += np.einsum("ci,ci->c", y, S_inv_y)
+                nis_count += 1
+
+        if reference is not None and k >= burn_in:
+            squared_error += (x - reference[k]) ** 2
+            error_count += 1
+
+    return nis_sum, nis_count, squared_error, error_count
+
+
+def _init_worker(drives, references):
+    """
+    Keep the drives and references in a worker process
+    """
+    global _worker_drives
+    _worker_drives = (drives, references)
+
+
+def _evaluate_chunk(task):
+    """
+    Worker entry point: evaluate one chunk of candidates over all drives
+    """
+    start, q, r, burn_in = task
+    drives, references = _worker_drives
+    totals = [np.zeros(q.shape[0]), 0, np.zeros((q.shape[0], 4)), 0]
+    for drive, reference in zip(drives, references):
+        for i, value in enumerate(_evaluate_drive(load_drive(drive), q, r, reference, burn_in)):
+            totals[i] += value
+    return start, totals
+
+
+def tune(drives, q, r, references=None, processes=None, chunk_size=1024, burn_in=10,
+         nis_weight=1.0, rmse_weight=1.0):
+    """
+    Score Q/R candidates over recorded drives
+
+    Each drive is filtered like EstimateLaneParam (H = I, motion model of
+    each frame, update on valid frames) for a whole chunk of candidates at
+    once. Chunks are evaluated in parallel worker processes.
+
+    Args:
+        drives: sequence of replay_runner.ReplayDrive or FrameLogDrive
+        q: candidate diagonals of Q, (C, 4), e.g. from grid_candidates
+        r: candidate diagonals of R, (C, 4)
+        references: optional sequence of reference lane states per drive,
+                    each (T, 4), e.g. from rts_smooth or ground truth
+        processes: number of worker processes (default: CPU count)
+        chunk_size: candidates per batched pass
+        burn_in: frames per drive excluded from the scores
+        nis_weight: weight of the NIS consistency score
+        rmse_weight: weight of the reference error score
+
+    Returns:
+        TuningResult
+    """
+    q = np.asarray(q, dtype=float)
+    r = np.asarray(r, dtype=float)
+    if references is None:
+        references = [None] * len(drives)
+    elif len(references) != len(drives):
+        raise ValueError("one reference per drive is required")
+
+    C = q.shape[0]
+    nis_sum = np.zeros(C)
+    squared_error = np.zeros((C, 4))
+    nis_count = error_count = 0
+    tasks = [(start, q[start:start + chunk_size], r[start:start + chunk_size], burn_in)
+             for start in range(0, C, chunk_size)]
+    with multiprocessing.Pool(processes, _init_worker, (list(drives), list(references))) as pool:
+        for start, (nis, nis_n, error, error_n) in pool.imap_unordered(_evaluate_chunk, tasks):
+            stop = start + nis.shape[0]
+            nis_sum[start:stop] = nis
+            squared_error[start:stop] = error
+            nis_count, error_count = nis_n, error_n
+
+    # Noise-free data can give NIS or RMSE 0; clamp so the logarithms stay finite
+    floor = np.finfo(float).tiny
+    nis_mean = nis_sum / nis_count if nis_count else np.full(C, np.nan)
+    nis_score = np.abs(np.log(np.maximum(nis_mean, floor) / 4.0))
+    if error_count:
+        rmse = np.sqrt(squared_error / error_count)
+        rmse_score = np.mean(np.log(np.maximum(rmse, floor) / np.maximum(rmse.min(axis=0), floor)),
+                             axis=1)
+    else:
+        rmse = np.full((C, 4), np.nan)
+        rmse_score = np.zeros(C)
+    score = nis_weight * nis_score + rmse_weight * rmse_score
+    return TuningResult(q, r, nis_mean, nis_score, rmse, rmse_score, score)